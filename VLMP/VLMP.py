@@ -9,8 +9,25 @@ import json
 import jsbeautifier
 
 from collections import OrderedDict
+from collections import deque
 
-from . import DEBUG_MODE
+from concurrent.futures import ProcessPoolExecutor
+
+import random
+import heapq
+import numpy as np
+
+from . import VALIDATION
+from . import VALIDATION_LEVELS
+from . import setDebugMode
+from . import PROFILE
+from . import PROFILE_MEMORY
+
+from VLMP.components import idsHandler
+from VLMP.utils.cache import componentsCache
+from VLMP.utils.cache import getRandomState,randomStatesEqual
+from VLMP.utils.profiler import profiler
+from VLMP.utils.cost import estimateSimulationCost
 
 import VLMP.components.systems         as _systems
 import VLMP.components.units           as _units
@@ -22,11 +39,26 @@ import VLMP.components.modelExtensions as _modelExtensions
 import VLMP.components.integrators     as _integrators
 import VLMP.components.simulationSteps as _simulationSteps
 
+from pyUAMMD import simulation
 from pyUAMMD.utils.merging.merging import mergeSimulationsSet
 
 import importlib
 import inspect
 
+#Process pool workers. Each worker process holds its own VLMP instance
+#(and its own idsHandler state), simulations are built there and sent back
+
+_workerVLMP = None
+
+def _initSimulationWorker(vlmpArgs):
+    global _workerVLMP
+    _workerVLMP = VLMP(**vlmpArgs)
+
+def _buildSimulationWorker(template,entrySimulations,seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    return _workerVLMP._buildSimulationPoolEntry(template,entrySimulations)
+
 class VLMP:
 
     def __setUpAdditionalComponents(self,additionalComponets = None):
@@ -82,7 +114,7 @@ class VLMP:
 
     #Distribute functions
 
-    def __distributeSimulationPoolByMaxNumberOfParticles(self,maxNumberOfParticles):
+    def __distributeSimulationPoolByMaxScore(self,maxScore,getScore,scoreName):
 
         simulationSets = []
 
@@ -93,27 +125,58 @@ class VLMP:
 
             for simName in simSet:
                 sim = self.simulations[simName]
-                if currentSetSize + sim.getNumberOfParticles() > maxNumberOfParticles:
+                if currentSetSize + getScore(sim) > maxScore:
                     if len(currentSet) > 0:
                         simulationSets.append(currentSet)
                     currentSet     = []
                     currentSetSize = 0
 
                 currentSet.append(simName)
-                currentSetSize += sim.getNumberOfParticles()
+                currentSetSize += getScore(sim)
 
             if len(currentSet) > 0:
                 simulationSets.append(currentSet)
 
-        #Print the number of simulations and the number of particles in each set
+        #Print the number of simulations and the score in each set
         for i in range(len(simulationSets)):
-            self.logger.debug("[VLMP] Simulation set %d has %d simulations and %d particles (max %d)",
+            self.logger.debug("[VLMP] Simulation set %d has %d simulations and %s %s (max %s)",
                               i,len(simulationSets[i]),
-                              sum([self.simulations[simName].getNumberOfParticles() for simName in simulationSets[i]]),
-                              maxNumberOfParticles)
+                              sum([getScore(self.simulations[simName]) for simName in simulationSets[i]]),
+                              scoreName,maxScore)
 
         return simulationSets.copy()
 
+    def __getScoringProperty(self,scoringPropertyName):
+        #Returns the function sim -> score of the scoring property and the name of its score
+        availableScoringProperties = ["numberOfParticles","cost"]
+
+        if scoringPropertyName not in availableScoringProperties:
+            self.logger.error("[VLMP] Scoring property \"%s\" not available, available properties are: %s",
+                              scoringPropertyName,availableScoringProperties)
+            raise Exception("Scoring property not available")
+
+        if scoringPropertyName == "numberOfParticles":
+            self.logger.debug("[VLMP] Scoring simulations by number of particles")
+            return (lambda sim: sim.getNumberOfParticles()),"particles"
+        elif scoringPropertyName == "cost":
+            self.logger.debug("[VLMP] Scoring simulations by estimated cost")
+            return (lambda sim: self.__getSimulationCost(sim)["cost"]),"cost"
+
+    def __getUpperLimitMode(self,mode):
+        #Mode ("upperLimit",scoringPropertyName,upperLimit), shared by the distribute and stream functions.
+        #Returns the function sim -> score, the name of the score and the upper limit
+        if len(mode) < 2:
+            self.logger.error("[VLMP] No scoring property specified")
+            raise Exception("No scoring property specified")
+
+        getScore,scoreName = self.__getScoringProperty(mode[1])
+
+        if len(mode) < 3:
+            self.logger.error("[VLMP] No upper limit of %s specified",scoreName)
+            raise Exception("No upper limit specified")
+
+        return getScore,scoreName,mode[2]
+
     def __distributeSimulationPoolBySize(self,size):
         simulationSets = []
 
@@ -176,6 +239,52 @@ class VLMP:
 
         return simulationSets.copy()
 
+    def __distributeSimulationPoolBalanced(self,nSets,getCost):
+
+        #Longest processing time first (LPT): simulations are sorted by decreasing cost
+        #and each one is added to the set with the lowest total cost.
+        #The whole pool is distributed in nSets sets, the current simulation sets are discarded
+
+        if len(self.simulationSets) > 1:
+            self.logger.warning("[VLMP] The simulation pool was already distributed in %d sets, "
+                                "the balanced distribution is applied to the whole pool",len(self.simulationSets))
+
+        simulationSets = []
+
+        simNames = list(self.simulations.keys())
+
+        simIndex = {simName:i for i,simName in enumerate(simNames)}
+        simCost  = {simName:getCost(self.simulations[simName]) for simName in simNames}
+
+        setsCost = [(0,i) for i in range(nSets)]
+        heapq.heapify(setsCost)
+
+        currentSets = [[] for i in range(nSets)]
+        for simName in sorted(simNames,key = lambda simName: (-simCost[simName],simIndex[simName])):
+            cost,i = heapq.heappop(setsCost)
+            currentSets[i].append(simName)
+            heapq.heappush(setsCost,(cost+simCost[simName],i))
+
+        if len(simNames) < nSets:
+            self.logger.warning("[VLMP] Number of sets (%d) is larger than the number of simulations (%d), empty sets are removed",
+                                nSets,len(simNames))
+
+        #Simulations in each set keep the pool order
+        for currentSet in currentSets:
+            if len(currentSet) > 0:
+                simulationSets.append(sorted(currentSet,key = lambda simName: simIndex[simName]))
+
+        setsCost = [sum([simCost[simName] for simName in currentSet]) for currentSet in simulationSets]
+        self.logger.info("[VLMP] Balanced distribution, cost of the sets: max %s, min %s, mean %s",
+                         max(setsCost),min(setsCost),sum(setsCost)/len(setsCost))
+
+        #Print the number of simulations and the cost of each set
+        for i in range(len(simulationSets)):
+            self.logger.debug("[VLMP] Simulation set %d has %d simulations and cost %s",
+                              i,len(simulationSets[i]),setsCost[i])
+
+        return simulationSets.copy()
+
     ########################################
 
     def __checkComponent(self,component,componentClass,simulationBuffer):
@@ -191,20 +300,20 @@ class VLMP:
         if componentType is None:
             self.logger.error(f"[VLMP] Error processing \"{componentClass}\" component ({component}), \"type\" property not found")
             raise Exception("Component type not specified")
-        self.logger.debug(f"[VLMP] Processing \"{componentClass}\" component ({component}), type \"{componentType}\"")
+        self.logger.debug("[VLMP] Processing \"%s\" component (%s), type \"%s\"",componentClass,component,componentType)
 
         componentName = component.get("name",None)
         if componentName is None:
             componentName = componentType
             self.logger.warning(f"[VLMP] ({componentClass}) Component name not specified, using \"{componentName}\".")
-        self.logger.debug(f"[VLMP] ({componentClass}) Component name \"{componentName}\".")
+        self.logger.debug("[VLMP] (%s) Component name \"%s\".",componentClass,componentName)
 
         #Check if parameters are specified
         componentParameters = component.get("parameters",None)
         if componentParameters is None:
             componentParameters = {}
             self.logger.warning(f"[VLMP] ({componentClass}) Component parameters not specified, creating empty dictionary")
-        self.logger.debug(f"[VLMP] ({componentClass}) Component parameters \"{componentParameters}\"")
+        self.logger.debug("[VLMP] (%s) Component parameters \"%s\"",componentClass,componentParameters)
 
         #Check if component is already loaded
         if "_".join([componentClass,componentName]) in simulationBuffer.keys():
@@ -213,14 +322,62 @@ class VLMP:
 
         return componentType,componentName,componentParameters
 
-    def __processSimulationPoolSection(self,
-                                       simulationBuffer,
-                                       simulationInfo,
-                                       sectionName,
-                                       addToSimulationBuffer,
-                                       required,
-                                       unique,
-                                       units,types,ensemble,models):
+    def __initComponent(self,componentClass,sectionName,simulationInfo,args,param):
+
+        if self.cache is None or sectionName != "models":
+            return componentClass(**args,**param)
+
+        #Models only depend on their parameters, units, types, ensemble and seed
+        #(if they do not draw random numbers). They can be restored from the cache instead of being generated again
+        seed = [comp["parameters"]["seed"] for comp in simulationInfo["system"] if comp["type"] == "seed"]
+
+        key = self.cache.getKey(componentClass,args["name"],param,
+                                simulationInfo.get("units",None),
+                                simulationInfo.get("types",None),
+                                simulationInfo.get("ensemble",None),
+                                seed)
+
+        initComp,declaredTypes = self.cache.load(key,componentClass,
+                                                 _units    = args["units"],
+                                                 _types    = args["types"],
+                                                 _ensemble = args["ensemble"])
+
+        if initComp is not None:
+            self.logger.debug(f"[VLMP] ({sectionName}) Component \"{args['name']}\" loaded from cache")
+            #Types declared by the model when it was generated
+            for typeDecl in declaredTypes:
+                args["types"].addType(**typeDecl)
+            return initComp
+
+        #Models which draw random numbers while they are generated are not cached,
+        #restoring them would change the generated models (and the random numbers drawn later)
+        randomState = getRandomState()
+
+        args["types"].startTypesRecording()
+        try:
+            initComp = componentClass(**args,**param)
+        finally:
+            declaredTypes = args["types"].stopTypesRecording()
+
+        if randomStatesEqual(randomState,getRandomState()):
+            self.cache.store(key,initComp,declaredTypes)
+        else:
+            self.logger.debug(f"[VLMP] ({sectionName}) Component \"{args['name']}\" uses random numbers, it is not cached")
+
+        return initComp
+
+    def __processSimulationPoolSection(self,sectionName,**kwargs):
+        with self.profiler.phase(f"section/{sectionName}"):
+            return self.__loadSimulationPoolSection(sectionName=sectionName,**kwargs)
+
+    def __loadSimulationPoolSection(self,
+                                    simulationBuffer,
+                                    simulationInfo,
+                                    sectionName,
+                                    addToSimulationBuffer,
+                                    required,
+                                    unique,
+                                    units,types,ensemble,models):
 
         sectionNameUpper  = sectionName[0].upper()+sectionName[1:]
 
@@ -275,7 +432,12 @@ class VLMP:
 
                     try:
 
-                        initComp = eval(f"_{sectionNamePlural}.{typ}")(**args, **param)
+                        with self.profiler.phase(f"import/{sectionName}/{typ}"):
+                            componentClass = eval(f"_{sectionNamePlural}.{typ}")
+
+                        with self.profiler.phase(f"component/{sectionName}/{typ}"+(f"/{name}" if name != typ else "")):
+                            initComp = self.__initComponent(componentClass,
+                                                            sectionName,simulationInfo,args,param)
 
                         if addToSimulationBuffer:
                             simulationBuffer[f"{sectionNamePlural}_{name}"] = initComp
@@ -288,7 +450,9 @@ class VLMP:
                 if isAdditionalComp:
                     try:
 
-                        initComp = eval(f"self.additional{sectionNameUpper}.{typ}")(**args,**param)
+                        with self.profiler.phase(f"component/{sectionName}/{typ}"+(f"/{name}" if name != typ else "")):
+                            initComp = self.__initComponent(eval(f"self.additional{sectionNameUpper}.{typ}"),
+                                                            sectionName,simulationInfo,args,param)
 
                         if addToSimulationBuffer:
                             simulationBuffer[f"{sectionName}_{name}"] = initComp
@@ -302,14 +466,57 @@ class VLMP:
 
     ########################################
 
-    def __init__(self,additionalComponets = None):
+    def __init__(self,additionalComponets = None,cacheDir = None,cacheMaxSize = 10*1024**3,validation = None,profile = None,profileMemory = None):
         self.logger = logging.getLogger("VLMP")
 
         self.logger.info("[VLMP] Starting VLMP")
 
+        #Profiling, if not given it is enabled by VLMP_PROFILE=1 (and memory tracing by VLMP_PROFILE_MEMORY=1)
+        if profile is None:
+            profile = PROFILE
+        if profileMemory is None:
+            profileMemory = PROFILE_MEMORY
+
+        self.profiler = profiler(profile,traceMemory = profileMemory)
+        if profile:
+            from . import IMPORT_TIME
+            self.profiler.addPhase("import",IMPORT_TIME)
+
+        #Validation level, if not given the one set by VLMP_VALIDATION is used
+        validationGiven = validation is not None
+        if not validationGiven:
+            validation = VALIDATION
+
+        if validation not in VALIDATION_LEVELS:
+            self.logger.error(f"[VLMP] Validation level \"{validation}\" not available, available levels are: {VALIDATION_LEVELS}")
+            raise Exception("Validation level not available")
+
+        self.validation = validation
+        self.debugMode  = (validation == "full")
+
+        #The level of the (global) VLMP logger is only changed if the validation level is given,
+        #otherwise the one set when VLMP is imported (or by the user) is kept
+        if validationGiven:
+            setDebugMode(self.debugMode)
+
+        #Arguments used to create the VLMP instances of the worker processes
+        self._workerArgs = {"additionalComponets":additionalComponets,
+                            "cacheDir":cacheDir,
+                            "cacheMaxSize":cacheMaxSize,
+                            "validation":validation,
+                            "profile":False}
+
+        if cacheDir is not None:
+            self.cache = componentsCache(cacheDir,cacheMaxSize)
+        else:
+            self.cache = None
+
         self.simulations    = OrderedDict()
         self.simulationSets = []
 
+        #Estimated costs, by simulation id
+        self.simulationsCost = {}
+
         self.availableComponents = ["system","units","types","ensemble",
                                     "models","modelOperations","modelExtensions",
                                     "integrators",
@@ -329,200 +536,449 @@ class VLMP:
 
         self.__setUpAdditionalComponents(additionalComponets)
 
-    def loadSimulationPool(self,simulationPool:list):
+    def __getSimulationName(self,simulationInfo):
 
-        self.simulationsInfo = {}
+        #Check all keys are available components
+        for key in simulationInfo.keys():
+            if key not in self.availableComponents and key != "replicas":
+                self.logger.error("[VLMP] Unknown component \"%s\"",key)
+                self.logger.error("[VLMP] Available components are: %s",self.availableComponents)
+                raise Exception("Unknown component")
+
+        # Check there is one (and only one) system component of type "simulationName"
+        simNameComponents = [component for component in simulationInfo["system"] if component["type"] == "simulationName"]
+        if len(simNameComponents) == 0:
+            self.logger.error("[VLMP] Simulation name not specified")
+            raise Exception("Simulation name not specified")
+        elif len(simNameComponents) > 1:
+            self.logger.error("[VLMP] More than one simulation name specified")
+            raise Exception("More than one simulation name specified")
+
+        for comp in simulationInfo["system"]:
 
+            typ, name, param = self.__checkComponent(comp,"system",{})
+
+            #Read simulationName
+            if typ == "simulationName":
+                simulationName = param["simulationName"]
+
+        return simulationName
+
+    def __getReplicasInfo(self,simulationInfo,simulationName):
+
+        replicas = simulationInfo["replicas"]
+
+        if isinstance(replicas,int) and not isinstance(replicas,bool):
+            replicasNames = [f"{simulationName}_{i}" for i in range(replicas)]
+        elif isinstance(replicas,list) and all([isinstance(r,str) for r in replicas]):
+            replicasNames = replicas.copy()
+        else:
+            self.logger.error(f"[VLMP] Replicas of simulation \"{simulationName}\" must be a number or a list of names")
+            raise Exception("Replicas not valid")
+
+        if len(replicasNames) == 0:
+            self.logger.error(f"[VLMP] No replicas given for simulation \"{simulationName}\"")
+            raise Exception("Replicas not valid")
+
+        #Each replica is the template with its own name
+        template = {key:value for key,value in simulationInfo.items() if key != "replicas"}
+
+        replicasInfo = []
+        for replicaName in replicasNames:
+            replicaInfo = copy.deepcopy(template)
+            for comp in replicaInfo["system"]:
+                if comp["type"] == "simulationName":
+                    comp["parameters"]["simulationName"] = replicaName
+            replicasInfo.append((replicaName,replicaInfo))
+
+        return template,replicasInfo
+
+    def __getSimulationPoolEntries(self,simulationPool):
+
+        #Each entry of the simulation pool is processed into a template (None if the entry has no replicas)
+        #and a list of (simulationName,simulationInfo) of the simulations generated by the entry.
+        #Simulation names are checked before building any simulation
+        simulationPoolEntries = []
+        simulationNames       = []
         for simulationInfo in simulationPool:
+            simulationName = self.__getSimulationName(simulationInfo)
 
-            #Check all keys are available components
-            for key in simulationInfo.keys():
-                if key not in self.availableComponents:
-                    self.logger.error("[VLMP] Unknown component \"%s\"",key)
-                    self.logger.error("[VLMP] Available components are: %s",self.availableComponents)
-                    raise Exception("Unknown component")
+            if "replicas" in simulationInfo.keys():
+                template,entrySimulations = self.__getReplicasInfo(simulationInfo,simulationName)
+            else:
+                #The simulation info is copied once here, the simulation pool entry owns it
+                template,entrySimulations = None,[(simulationName,copy.deepcopy(simulationInfo))]
 
-            simulationBuffer = OrderedDict()
+            for simulationName,_ in entrySimulations:
+                #Check if other simulation with the same name has been already created
+                if simulationName in self.simulations.keys() or simulationName in simulationNames:
+                    self.logger.error(f"[VLMP] Simulation with name \"{simulationName}\" already exists")
+                    raise Exception("Simulation already exists")
 
-            ############## SYSTEM ##############
+                simulationNames.append(simulationName)
 
-            #### Get simulation name ####
+            simulationPoolEntries.append((template,entrySimulations))
 
-            # Check there is one (and only one) system component of type "simulationName"
-            simNameComponents = [component for component in simulationInfo["system"] if component["type"] == "simulationName"]
-            if len(simNameComponents) == 0:
-                self.logger.error("[VLMP] Simulation name not specified")
-                raise Exception("Simulation name not specified")
-            elif len(simNameComponents) > 1:
-                self.logger.error("[VLMP] More than one simulation name specified")
-                raise Exception("More than one simulation name specified")
+        return simulationPoolEntries
 
-            for comp in simulationInfo["system"]:
+    def __loadSystem(self,simulationInfo,simulationBuffer):
 
-                typ, name, param = self.__checkComponent(comp,"system",simulationBuffer)
+        ############## SYSTEM ##############
 
-                #Read simulationName
-                if typ == "simulationName":
-                    simulationName = param["simulationName"]
+        _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                simulationInfo   = simulationInfo,
+                                                sectionName      = "system",
+                                                addToSimulationBuffer = True,
+                                                required = True,
+                                                unique   = False,
+                                                units    = None,
+                                                types    = None,
+                                                ensemble = None,
+                                                models   = None)
 
-                    #Check if other simulation with the same name has been already created
-                    if simulationName in self.simulations.keys():
-                        self.logger.error(f"[VLMP] Simulation with name \"{simulationName}\" already exists")
-                        raise Exception("Simulation already exists")
+    def __loadModels(self,simulationInfo,simulationBuffer):
 
-            #############################
+        ############## UNITS ##############
 
-            _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                    simulationInfo   = simulationInfo,
-                                                    sectionName      = "system",
+        units = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                    simulationInfo = simulationInfo,
+                                                    sectionName    = "units",
                                                     addToSimulationBuffer = True,
                                                     required = True,
-                                                    unique   = False,
+                                                    unique   = True,
                                                     units    = None,
                                                     types    = None,
                                                     ensemble = None,
                                                     models   = None)
 
-            ############## UNITS ##############
-
-            units = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                        simulationInfo = simulationInfo,
-                                                        sectionName    = "units",
-                                                        addToSimulationBuffer = True,
-                                                        required = True,
-                                                        unique   = True,
-                                                        units    = None,
-                                                        types    = None,
-                                                        ensemble = None,
-                                                        models   = None)
-
-            units = simulationBuffer[units[0]]
-
-            ############## TYPES ##############
-
-            types = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                        simulationInfo = simulationInfo,
-                                                        sectionName    = "types",
-                                                        addToSimulationBuffer = True,
-                                                        required = True,
-                                                        unique   = True,
-                                                        units    = units,
-                                                        types    = None,
-                                                        ensemble = None,
-                                                        models   = None)
-
-            types = simulationBuffer[types[0]]
-
-            ############## ENSEMBLE ##############
-
-            ensemble = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                           simulationInfo = simulationInfo,
-                                                           sectionName    = "ensemble",
-                                                           addToSimulationBuffer = True,
-                                                           required = True,
-                                                           unique   = True,
-                                                           units    = units,
-                                                           types    = types,
-                                                           ensemble = None,
-                                                           models   = None)
-
-            ensemble = simulationBuffer[ensemble[0]]
-
-            ############### MODEL ###############
-
-            models = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                         simulationInfo = simulationInfo,
-                                                         sectionName    = "models",
-                                                         addToSimulationBuffer = True,
-                                                         required = True,
-                                                         unique   = False,
-                                                         units    = units,
-                                                         types    = types,
-                                                         ensemble = ensemble,
-                                                         models   = None)
-
-            #Set idOffset for each model
-            idOffset = 0
-            for mdl in models:
-                simulationBuffer[mdl].setIdOffset(idOffset)
-                ids = simulationBuffer[mdl].getLocalIds()
-                if len(ids) != 0:
-                    idOffset += max(ids) + 1
-
-            models = [simulationBuffer[model] for model in models]
-
-            ############### MODEL OPERATIONS ###############
-
-            _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                    simulationInfo = simulationInfo,
-                                                    sectionName    = "modelOperations",
-                                                    addToSimulationBuffer = False,
-                                                    required = False,
-                                                    unique   = False,
-                                                    units    = units,
-                                                    types    = types,
-                                                    ensemble = ensemble,
-                                                    models   = models)
+        units = simulationBuffer[units[0]]
 
-            ############### MODEL EXTENSIONS ###############
+        ############## TYPES ##############
 
-            _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+        types = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
                                                     simulationInfo = simulationInfo,
-                                                    sectionName    = "modelExtensions",
+                                                    sectionName    = "types",
                                                     addToSimulationBuffer = True,
-                                                    required = False,
-                                                    unique   = False,
+                                                    required = True,
+                                                    unique   = True,
                                                     units    = units,
-                                                    types    = types,
-                                                    ensemble = ensemble,
-                                                    models   = models)
+                                                    types    = None,
+                                                    ensemble = None,
+                                                    models   = None)
 
-            ############## INTEGRATOR ##############
+        types = simulationBuffer[types[0]]
+
+        ############## ENSEMBLE ##############
+
+        ensemble = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                       simulationInfo = simulationInfo,
+                                                       sectionName    = "ensemble",
+                                                       addToSimulationBuffer = True,
+                                                       required = True,
+                                                       unique   = True,
+                                                       units    = units,
+                                                       types    = types,
+                                                       ensemble = None,
+                                                       models   = None)
+
+        ensemble = simulationBuffer[ensemble[0]]
+
+        ############### MODEL ###############
+
+        models = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                     simulationInfo = simulationInfo,
+                                                     sectionName    = "models",
+                                                     addToSimulationBuffer = True,
+                                                     required = True,
+                                                     unique   = False,
+                                                     units    = units,
+                                                     types    = types,
+                                                     ensemble = ensemble,
+                                                     models   = None)
+
+        #Set idOffset for each model
+        idOffset = 0
+        for mdl in models:
+            simulationBuffer[mdl].setIdOffset(idOffset)
+            ids = simulationBuffer[mdl].getLocalIdsArray()
+            if len(ids) != 0:
+                idOffset += int(ids.max()) + 1
+
+        models = [simulationBuffer[model] for model in models]
+
+        return units,types,ensemble,models
+
+    def __loadModelsComponents(self,simulationInfo,simulationBuffer,units,types,ensemble,models):
+
+        ############### MODEL OPERATIONS ###############
+
+        _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                simulationInfo = simulationInfo,
+                                                sectionName    = "modelOperations",
+                                                addToSimulationBuffer = False,
+                                                required = False,
+                                                unique   = False,
+                                                units    = units,
+                                                types    = types,
+                                                ensemble = ensemble,
+                                                models   = models)
+
+        #Transforms of the model operations not applied to the models yet
+        idsHandler.flushTransforms()
+
+        ############### MODEL EXTENSIONS ###############
+
+        _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                simulationInfo = simulationInfo,
+                                                sectionName    = "modelExtensions",
+                                                addToSimulationBuffer = True,
+                                                required = False,
+                                                unique   = False,
+                                                units    = units,
+                                                types    = types,
+                                                ensemble = ensemble,
+                                                models   = models)
+
+        ############## INTEGRATOR ##############
+
+        _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                simulationInfo = simulationInfo,
+                                                sectionName    = "integrators",
+                                                addToSimulationBuffer = True,
+                                                required = True,
+                                                unique   = False,
+                                                units    = units,
+                                                types    = types,
+                                                ensemble = ensemble,
+                                                models   = models)
+
+        ############### SIMULATION STEPS ###############
+
+        _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
+                                                simulationInfo = simulationInfo,
+                                                sectionName    = "simulationSteps",
+                                                addToSimulationBuffer = True,
+                                                required = False,
+                                                unique   = False,
+                                                units    = units,
+                                                types    = types,
+                                                ensemble = ensemble,
+                                                models   = models)
+
+    def __mergeSimulationBuffer(self,simulationBuffer,sim = None):
+
+        #Merge all components into a single simulation
+        self.logger.debug("[VLMP] Merging components into a single simulation")
+
+        with self.profiler.phase("merge"):
+            for componentName,component in simulationBuffer.items():
+                self.logger.debug("[VLMP] Merging component \"%s\"",componentName)
+                if sim is None:
+                    sim = component.getSimulation(self.debugMode)
+                else:
+                    sim.append(component.getSimulation(self.debugMode),mode="modelId")
+                self.logger.debug("[VLMP] Component \"%s\" merged",componentName)
+        #Simulation creation finished
+
+        return sim
+
+    def __validateSimulation(self,simulationName,sim):
+
+        #Validation of a finished simulation. It is used when the per merge checks
+        #are skipped (validation "fast"), all the checks are done in a single pass
+
+        def notValid(message):
+            self.logger.error(f"[VLMP] Simulation \"{simulationName}\" is not valid. {message}")
+            raise Exception("Simulation not valid")
+
+        N   = sim.getNumberOfParticles()
+        ids = set(range(N))
+
+        structureInSim = ("topology" in sim) and ("structure" in sim["topology"])
+
+        if "state" in sim:
+            if not structureInSim:
+                notValid("State added but not structure")
+            if len(sim["state"]["data"]) != N:
+                notValid("Number of particles in state and structure does not match")
+
+        #Particle ids must go from 0 to N-1 without repetitions
+        entries = [("structure",sim["topology"]["structure"])] if structureInSim else []
+        if "state" in sim:
+            entries.append(("state",sim["state"]))
+
+        for entryName,entry in entries:
+            if "id" not in entry["labels"]:
+                notValid(f"No ids in {entryName}")
+            idIndex = entry["labels"].index("id")
+            if set([d[idIndex] for d in entry["data"]]) != ids:
+                notValid(f"Ids in {entryName} are not consecutive or are repeated")
+
+        #Types used in the structure must be declared
+        if structureInSim and "type" in sim["topology"]["structure"]["labels"]:
+            declaredTypes = set()
+            if "global" in sim and "types" in sim["global"]:
+                nameIndex     = sim["global"]["types"]["labels"].index("name")
+                declaredTypes = set([d[nameIndex] for d in sim["global"]["types"]["data"]])
+
+            typeIndex = sim["topology"]["structure"]["labels"].index("type")
+            usedTypes = set([d[typeIndex] for d in sim["topology"]["structure"]["data"]])
+            if not usedTypes.issubset(declaredTypes):
+                notValid(f"Types {usedTypes.difference(declaredTypes)} are used but not declared")
+
+        #Ids in the force field must refer to existing particles
+        if "topology" in sim and "forceField" in sim["topology"]:
+            for entryName,entry in sim["topology"]["forceField"].items():
+                labels = entry.get("labels",[])
+                for label in labels:
+                    if label in simulation.id_labels:
+                        labelIndex = labels.index(label)
+                        entryIds   = [d[labelIndex] for d in entry.get("data",[])]
+                    elif label in simulation.id_list_labels:
+                        labelIndex = labels.index(label)
+                        entryIds   = [i for d in entry.get("data",[]) for i in d[labelIndex]]
+                    else:
+                        continue
+                    if not set(entryIds).issubset(ids):
+                        notValid(f"Force field entry \"{entryName}\" refers to particles which do not exist")
 
-            _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                    simulationInfo = simulationInfo,
-                                                    sectionName    = "integrators",
-                                                    addToSimulationBuffer = True,
-                                                    required = True,
-                                                    unique   = False,
-                                                    units    = units,
-                                                    types    = types,
-                                                    ensemble = ensemble,
-                                                    models   = models)
+    def _buildSimulation(self,simulationInfo):
 
-            ############### SIMULATION STEPS ###############
+        #idsHandler caches the models of the simulation being built,
+        #it is reset to avoid keeping references to models of other simulations
+        idsHandler.reset()
 
-            _ = self.__processSimulationPoolSection(simulationBuffer = simulationBuffer,
-                                                    simulationInfo = simulationInfo,
-                                                    sectionName    = "simulationSteps",
-                                                    addToSimulationBuffer = True,
-                                                    required = False,
-                                                    unique   = False,
-                                                    units    = units,
-                                                    types    = types,
-                                                    ensemble = ensemble,
-                                                    models   = models)
+        simulationBuffer = OrderedDict()
 
-            ###############################################
+        self.__loadSystem(simulationInfo,simulationBuffer)
+        units,types,ensemble,models = self.__loadModels(simulationInfo,simulationBuffer)
+        self.__loadModelsComponents(simulationInfo,simulationBuffer,units,types,ensemble,models)
 
-            #Merge all components into a single simulation
-            self.logger.debug("[VLMP] Merging components into a single simulation")
+        sim = self.__mergeSimulationBuffer(simulationBuffer)
 
-            sim = None
-            for componentName,component in simulationBuffer.items():
-                self.logger.debug(f"[VLMP] Merging component \"{componentName}\"")
-                if sim is None:
-                    sim = component.getSimulation(DEBUG_MODE)
-                else:
-                    sim.append(component.getSimulation(DEBUG_MODE),mode="modelId")
-                self.logger.debug(f"[VLMP] Component \"{componentName}\" merged")
-            #Simulation creation finished
+        idsHandler.reset()
+
+        return sim
+
+    def _buildReplicas(self,template,replicasInfo):
+
+        #Models are built only once for all the replicas
+        idsHandler.reset()
+
+        modelsBuffer = OrderedDict()
+        units,types,ensemble,models = self.__loadModels(template,modelsBuffer)
 
-            ###############################################
+        replicas = []
+        if "modelOperations" not in template.keys():
+            #Nothing depends on the replica but the system,
+            #the rest of the simulation is merged once and appended to each replica
+            self.__loadModelsComponents(template,modelsBuffer,units,types,ensemble,models)
+            templateSim = self.__mergeSimulationBuffer(modelsBuffer)
+
+            for replicaName,replicaInfo in replicasInfo:
+                self.logger.debug(f"[VLMP] Generating replica \"{replicaName}\"")
+                simulationBuffer = OrderedDict()
+                self.__loadSystem(replicaInfo,simulationBuffer)
+
+                #A new simulation (with its own id) is created from a copy of the template
+                sim = simulation(templateSim.sim,self.debugMode)
+                replicas.append(self.__mergeSimulationBuffer(simulationBuffer,sim))
+        else:
+            #Model operations can be random (distributeRandomly, ...),
+            #they are applied again for each replica starting from the models state
+            modelsState = [copy.deepcopy(mdl.getState()) if mdl.getNumberOfParticles() > 0 else None for mdl in models]
+
+            for replicaName,replicaInfo in replicasInfo:
+                self.logger.debug(f"[VLMP] Generating replica \"{replicaName}\"")
+                idsHandler.reset()
+                for mdl,state in zip(models,modelsState):
+                    if state is not None:
+                        mdl.setState(copy.deepcopy(state))
+
+                simulationBuffer = OrderedDict()
+                self.__loadSystem(replicaInfo,simulationBuffer)
+                simulationBuffer.update(modelsBuffer)
+                self.__loadModelsComponents(replicaInfo,simulationBuffer,units,types,ensemble,models)
+
+                replicas.append(self.__mergeSimulationBuffer(simulationBuffer))
+
+        idsHandler.reset()
+
+        return replicas
+
+    def _buildSimulationPoolEntry(self,template,entrySimulations):
+        if template is None:
+            _,simulationInfo = entrySimulations[0]
+            return [self._buildSimulation(simulationInfo)]
+        return self._buildReplicas(template,entrySimulations)
+
+    def __iterSimulationPool(self,simulationPoolEntries,workers):
+
+        #Each entry is built with its own seed. Otherwise all the workers
+        #would share the random state inherited from the main process.
+        #The seeds are drawn also when no workers are used, so the pool does not depend on the number of workers
+        seeds = np.random.randint(0,2**31-1,size=len(simulationPoolEntries))
+
+        if workers is None or workers <= 1:
+            for (template,entrySimulations),seed in zip(simulationPoolEntries,seeds):
+                #As in a worker, the entry is built from its seed and the random state of the caller is kept
+                randomState   = random.getstate()
+                npRandomState = np.random.get_state()
+
+                random.seed(int(seed))
+                np.random.seed(int(seed))
+                sims = self._buildSimulationPoolEntry(template,entrySimulations)
+
+                random.setstate(randomState)
+                np.random.set_state(npRandomState)
+
+                for (simulationName,simulationInfo),sim in zip(entrySimulations,sims):
+                    yield simulationName,simulationInfo,sim
+            return
+
+        self.logger.info(f"[VLMP] Loading simulation pool using {workers} workers")
+
+        #The number of entries submitted but not yet gathered is bounded,
+        #finished simulations are gathered in pool order
+        with ProcessPoolExecutor(max_workers = workers,
+                                 initializer = _initSimulationWorker,
+                                 initargs    = (self._workerArgs,)) as executor:
+            pending = deque()
+            for (template,entrySimulations),seed in zip(simulationPoolEntries,seeds):
+                pending.append((entrySimulations,
+                                executor.submit(_buildSimulationWorker,template,entrySimulations,int(seed))))
+                if len(pending) >= 2*workers:
+                    entrySimulations,future = pending.popleft()
+                    for (simulationName,simulationInfo),sim in zip(entrySimulations,future.result()):
+                        yield simulationName,simulationInfo,sim
+
+            while len(pending) > 0:
+                entrySimulations,future = pending.popleft()
+                for (simulationName,simulationInfo),sim in zip(entrySimulations,future.result()):
+                    yield simulationName,simulationInfo,sim
+
+    def loadSimulationPool(self,simulationPool:list,workers:int = 1):
+
+        self.simulationsInfo = {}
 
-            #Store the simulation
-            self.simulationsInfo[simulationName] = copy.deepcopy(simulationInfo)
-            self.simulations[simulationName]     = sim
+        simulationPoolEntries = self.__getSimulationPoolEntries(simulationPool)
+
+        loadedSimulations = []
+        with self.profiler.phase("loadSimulationPool"):
+            for simulationName,simulationInfo,sim in self.__iterSimulationPool(simulationPoolEntries,workers):
+
+                #Store the simulation
+                self.simulationsInfo[simulationName] = simulationInfo
+                self.simulations[simulationName]     = sim
+
+                loadedSimulations.append(simulationName)
+
+        #If the per merge checks have been skipped, all the loaded simulations are validated at the end
+        if not self.debugMode:
+            self.logger.info(f"[VLMP] Validating {len(loadedSimulations)} simulations")
+            with self.profiler.phase("validation"):
+                for simulationName in loadedSimulations:
+                    self.__validateSimulation(simulationName,self.simulations[simulationName])
 
         ###############################################
 
@@ -531,9 +987,53 @@ class VLMP:
         #Create default simulation set, all simulations in one set
         self.simulationSets = [list(self.simulations.keys())]
 
+    def __getSimulationCost(self,sim):
+        simId = sim.getID()
+        if simId not in self.simulationsCost:
+            self.simulationsCost[simId] = estimateSimulationCost(sim)
+        return self.simulationsCost[simId]
+
+    def estimateCost(self):
+        #Estimated cost of each loaded simulation and of each simulation set (if the pool has been distributed).
+        #The cost is relative, the unit is the integration of one particle during one step
+
+        if len(self.simulations) == 0:
+            self.logger.error("[VLMP] No simulations loaded")
+            raise Exception("No simulations loaded")
+
+        with self.profiler.phase("estimateCost"):
+            report = {"simulations":OrderedDict(),"simulationSets":[]}
+            for simName,sim in self.simulations.items():
+                report["simulations"][simName] = self.__getSimulationCost(sim).copy()
+
+            for simSet in self.simulationSets:
+                report["simulationSets"].append({"simulations":simSet.copy(),
+                                                 "numberOfParticles":sum([report["simulations"][simName]["numberOfParticles"] for simName in simSet]),
+                                                 "cost":sum([report["simulations"][simName]["cost"] for simName in simSet])})
+
+        nameWidth = max([len(simName) for simName in report["simulations"].keys()] + [len("Simulation")])
+
+        lines = []
+        lines.append(f"{'Simulation':<{nameWidth}} {'Particles':>10} {'Bonds':>10} {'Pairs':>12} {'Steps':>10} {'Cost':>12}")
+        lines.append("-"*len(lines[0]))
+        for simName,cost in report["simulations"].items():
+            lines.append(f"{simName:<{nameWidth}} {cost['numberOfParticles']:>10} {cost['bonds']:>10} "
+                         f"{cost['nonBondedPairs']:>12.0f} {cost['integrationSteps']:>10} {cost['cost']:>12.4g}")
+        for i,simSet in enumerate(report["simulationSets"]):
+            lines.append(f"Simulation set {i}: {len(simSet['simulations'])} simulations, "
+                         f"{simSet['numberOfParticles']} particles, cost {simSet['cost']:.4g}")
+
+        self.logger.info("[VLMP] Estimated cost:\n"+"\n".join(lines))
+
+        return report
+
     def distributeSimulationPool(self,*mode):
+        with self.profiler.phase("distributeSimulationPool"):
+            self.__distributeSimulationPool(*mode)
+
+    def __distributeSimulationPool(self,*mode):
 
-        availableModes = ["none","one","upperLimit","size","property"]
+        availableModes = ["none","one","upperLimit","size","property","balanced"]
 
         #Check at least one simulations has been loaded
         if len(self.simulations) == 0:
@@ -559,31 +1059,11 @@ class VLMP:
                 self.simulationSets = [[i] for i in self.simulations.keys()]
             elif modeName == "upperLimit":
                 self.logger.debug("[VLMP] Distributing simulation pool using upper limit")
-                availableScoringProperties = ["numberOfParticles"]
 
-                if len(mode) >= 2:
-                    scoringPropertyName = mode[1]
-                else:
-                    self.logger.error("[VLMP] No scoring property specified")
-                    raise Exception("No scoring property specified")
+                getScore,scoreName,upperLimit = self.__getUpperLimitMode(mode)
 
-                if scoringPropertyName not in availableScoringProperties:
-                    self.logger.error("[VLMP] Scoring property \"%s\" not available, available properties are: %s",
-                                      scoringPropertyName,availableScoringProperties)
-                    raise Exception("Scoring property not available")
-                else:
-                    #Switch to the selected scoring property
-                    if scoringPropertyName == "numberOfParticles":
-                        self.logger.debug("[VLMP] Distributing simulation pool using number of particles")
-                        if len(mode) >= 3:
-                            maxNumberOfParticles = mode[2]
-                        else:
-                            self.logger.error("[VLMP] No particle limit specified")
-                            raise Exception("No upper limit specified")
-
-                        #Distribute the simulation pool
-                        self.simulationSets = self.__distributeSimulationPoolByMaxNumberOfParticles(maxNumberOfParticles)
-                    #Scoring property switch finished
+                #Distribute the simulation pool
+                self.simulationSets = self.__distributeSimulationPoolByMaxScore(upperLimit,getScore,scoreName)
             elif modeName == "size":
                 self.logger.debug("[VLMP] Distributing simulation pool using size")
 
@@ -617,6 +1097,33 @@ class VLMP:
                 #Distribute the simulation pool
                 self.simulationSets = self.__distributeSimulationPoolByProperty(propertyPath)
 
+            elif modeName == "balanced":
+                self.logger.debug("[VLMP] Distributing simulation pool in balanced sets")
+
+                if len(mode) >= 2:
+                    nSets = mode[1]
+                else:
+                    self.logger.error("[VLMP] No number of sets specified")
+                    raise Exception("No number of sets specified")
+
+                if not isinstance(nSets,int) or isinstance(nSets,bool) or nSets < 1:
+                    self.logger.error("[VLMP] Number of sets must be a positive integer, but is: %s",nSets)
+                    raise Exception("Number of sets not valid")
+
+                #The cost of each simulation is given by a scoring property or by a function sim -> cost
+                if len(mode) >= 3:
+                    scoringProperty = mode[2]
+                else:
+                    scoringProperty = "numberOfParticles"
+
+                if callable(scoringProperty):
+                    getCost = scoringProperty
+                else:
+                    getCost,_ = self.__getScoringProperty(scoringProperty)
+
+                #Distribute the simulation pool
+                self.simulationSets = self.__distributeSimulationPoolBalanced(nSets,getCost)
+
 
         #Check all the simulations have been distributed.
         #simulationSets is a list of lists which contains the names of the simulations
@@ -630,14 +1137,11 @@ class VLMP:
             self.logger.error("[VLMP] Simulation distribution failed")
             raise Exception("Simulation distribution failed")
 
-    def setUpSimulation(self, sessionName):
-        self.logger.debug("[VLMP] Setting up simulation")
+    ########################################
 
-        if len(self.simulationSets) == 0:
-            self.logger.error("[VLMP] Simulation pool not distributed")
-            raise Exception("Simulation pool not distributed")
+    #Session writing functions
 
-        ################################################
+    def __createSessionFolders(self,sessionName):
 
         #Create folder named sessionName
         if not os.path.exists(sessionName):
@@ -656,90 +1160,211 @@ class VLMP:
         VLMPsession = {"name":sessionName}
         VLMPsession["simulations"] = []
         VLMPsession["simulationSets"] = []
-        for simSetIndex,simSet in enumerate(self.simulationSets):
-            #Create folder sessionName/simulationSets/simulationSet_i
-            simulationSetName   = f"simulationSet_{simSetIndex}"
-            simulationSetFolder = os.path.join(sessionName,"simulationSets",simulationSetName)
 
-            if not os.path.exists(simulationSetFolder):
-                os.makedirs(simulationSetFolder)
+        return VLMPsession
 
-            #For each simulation in the simulation set.
-            #Create a folder sessionName/simulationSets/simulationSetName/simulationName/
-            for simName in simSet:
+    def __writeSimulationSet(self,sessionName,VLMPsession,simSetIndex,simSet,simulations,simulationsInfo):
 
-                simulationFolder       = os.path.join(sessionName,"simulationSets",simulationSetName,simName)
-                simulationResultFolder = os.path.join(sessionName,"results",simName)
+        #Create folder sessionName/simulationSets/simulationSet_i
+        simulationSetName   = f"simulationSet_{simSetIndex}"
+        simulationSetFolder = os.path.join(sessionName,"simulationSets",simulationSetName)
 
-                if not os.path.exists(simulationFolder):
-                    os.makedirs(simulationFolder)
+        if not os.path.exists(simulationSetFolder):
+            os.makedirs(simulationSetFolder)
 
-                if not os.path.islink(simulationResultFolder):
-                    os.symlink(os.path.relpath(simulationFolder,
-                                               "/".join(simulationResultFolder.split("/")[:-1])),
-                               simulationResultFolder)
+        #For each simulation in the simulation set.
+        #Create a folder sessionName/simulationSets/simulationSetName/simulationName/
+        for simName in simSet:
 
-                #Update output files for each simulation in simSet
-                sim = self.simulations[simName]
+            simulationFolder       = os.path.join(sessionName,"simulationSets",simulationSetName,simName)
+            simulationResultFolder = os.path.join(sessionName,"results",simName)
+
+            if not os.path.exists(simulationFolder):
+                os.makedirs(simulationFolder)
 
-                #Write simulation file into results folder
+            if not os.path.islink(simulationResultFolder):
+                os.symlink(os.path.relpath(simulationFolder,
+                                           "/".join(simulationResultFolder.split("/")[:-1])),
+                           simulationResultFolder)
+
+            #Update output files for each simulation in simSet
+            sim = simulations[simName]
+
+            #Write simulation file into results folder
+            with self.profiler.phase("write/simulation"):
                 sim.write(os.path.join(simulationFolder,"simulation.json"))
 
-                #Relative path to the simulation folder
-                relativePath = os.path.relpath(simulationFolder,simulationSetFolder)
+            #Relative path to the simulation folder
+            relativePath = os.path.relpath(simulationFolder,simulationSetFolder)
+
+            VLMPsession["simulations"].append([simName,
+                                               os.path.join(*simulationFolder.split("/")[1:]),
+                                               os.path.join(*simulationResultFolder.split("/")[1:]),
+                                               simulationsInfo[simName]])
+
+            #Updating file path
+            def getValuesAndPaths(d, key, path=None):
+                """
+                Recursively search a nested dictionary
+                for all values associated with a given key,
+                along with the path to each value.
+                """
+                if path is None:
+                    path = ()
+
+                values = []
+                for k, v in d.items():
+                    new_path = path + (k,)
+                    if k == key:
+                        values.append((v, new_path))
+                    elif isinstance(v, dict):
+                        values.extend(getValuesAndPaths(v, key, new_path))
+
+                return values
+
+            outputFilePaths = getValuesAndPaths(sim,"outputFilePath")
+            for fName,fSimPath in outputFilePaths:
+                sim.setValue(fSimPath,os.path.join(relativePath,fName))
 
-                VLMPsession["simulations"].append([simName,
-                                                   os.path.join(*simulationFolder.split("/")[1:]),
-                                                   os.path.join(*simulationResultFolder.split("/")[1:]),
-                                                   self.simulationsInfo[simName]])
+        ################################################
+        #Aggregate simulations in simulation sets
 
-                #Updating file path
-                def getValuesAndPaths(d, key, path=None):
-                    """
-                    Recursively search a nested dictionary
-                    for all values associated with a given key,
-                    along with the path to each value.
-                    """
-                    if path is None:
-                        path = ()
+        self.logger.debug(f"[VLMP] Aggregating simulations in simulation set {simSetIndex}")
+        with self.profiler.phase("mergeSimulationsSet"):
+            aggregatedSimulation = mergeSimulationsSet([simulations[simName] for simName in simSet])
 
-                    values = []
-                    for k, v in d.items():
-                        new_path = path + (k,)
-                        if k == key:
-                            values.append((v, new_path))
-                        elif isinstance(v, dict):
-                            values.extend(getValuesAndPaths(v, key, new_path))
+        #Aggregated simulation is ready
+        ################################################
 
-                    return values
+        ################################################
+        #Write aggregated simulation to file
 
-                outputFilePaths = getValuesAndPaths(sim,"outputFilePath")
-                for fName,fSimPath in outputFilePaths:
-                    sim.setValue(fSimPath,os.path.join(relativePath,fName))
+        with self.profiler.phase("write/simulationSet"):
+            aggregatedSimulation.write(os.path.join(simulationSetFolder,f"simulationSet_{simSetIndex}.json"))
 
-            ################################################
-            #Aggregate simulations in simulation sets
+        #Relative path to the simulation folder
+        relativePath = os.path.relpath(simulationSetFolder,sessionName)
+        VLMPsession["simulationSets"].append([simulationSetName,
+                                              f"{relativePath}",
+                                              f"simulationSet_{simSetIndex}.json",
+                                              simSet.copy()])
 
-            self.logger.debug(f"[VLMP] Aggregating simulations in simulation set {simSetIndex}")
-            aggregatedSimulation = mergeSimulationsSet([self.simulations[simName] for simName in simSet])
+    def __writeSession(self,sessionName,VLMPsession):
 
-            #Aggregated simulation is ready
-            ################################################
+        with self.profiler.phase("write/session"):
+            with open(os.path.join(sessionName,"VLMPsession.json"),"w") as simSetsFile:
+                #Write simulation sets file using jsbeautifier
+                simSetsFile.write(jsbeautifier.beautify(json.dumps(VLMPsession)))
 
-            ################################################
-            #Write aggregated simulation to file
+    def __writeProfile(self,sessionName):
+        #Profile report (if profiling is enabled) is written into the session folder
+        self.profiler.write(os.path.join(sessionName,"profile.json"))
+        self.profiler.logSummary()
 
-            aggregatedSimulation.write(os.path.join(simulationSetFolder,f"simulationSet_{simSetIndex}.json"))
+    ########################################
 
-            #Relative path to the simulation folder
-            relativePath = os.path.relpath(simulationSetFolder,sessionName)
-            VLMPsession["simulationSets"].append([simulationSetName,
-                                                  f"{relativePath}",
-                                                  f"simulationSet_{simSetIndex}.json",
-                                                  simSet.copy()])
-
-        with open(os.path.join(sessionName,"VLMPsession.json"),"w") as simSetsFile:
-            #Write simulation sets file using jsbeautifier
-            simSetsFile.write(jsbeautifier.beautify(json.dumps(VLMPsession)))
+    def setUpSimulation(self, sessionName):
+        self.logger.debug("[VLMP] Setting up simulation")
+
+        if len(self.simulationSets) == 0:
+            self.logger.error("[VLMP] Simulation pool not distributed")
+            raise Exception("Simulation pool not distributed")
+
+        ################################################
+
+        VLMPsession = self.__createSessionFolders(sessionName)
+
+        with self.profiler.phase("setUpSimulation"):
+            for simSetIndex,simSet in enumerate(self.simulationSets):
+                self.__writeSimulationSet(sessionName,VLMPsession,
+                                          simSetIndex,simSet,
+                                          self.simulations,self.simulationsInfo)
+
+            self.__writeSession(sessionName,VLMPsession)
+
+        self.__writeProfile(sessionName)
+
+        self.logger.debug("[VLMP] Simulation set up finished")
+
+    def streamSimulationPool(self,sessionName,simulationPool:list,*mode,workers:int = 1):
+        #Load, distribute and set up the simulation pool in a single pass.
+        #Each simulation set is written (and released) as soon as it is complete,
+        #so only the simulations of the current set are kept in memory.
+        #Only distribution modes which can be applied in pool order are available.
+
+        self.logger.debug("[VLMP] Streaming simulation pool")
+
+        availableModes = ["one","upperLimit","size"]
+
+        if len(mode) == 0:
+            self.logger.error("[VLMP] No mode specified. Available modes for streaming are: %s",availableModes)
+            raise Exception("No mode specified")
+
+        modeName = mode[0]
+        if modeName not in availableModes:
+            self.logger.error("[VLMP] Distribute mode \"%s\" not available for streaming, available modes are: %s",modeName,availableModes)
+            raise Exception("Distribute mode not available")
+
+        if modeName == "one":
+            setLimit = 1
+            getScore = lambda sim: 1
+        elif modeName == "size":
+            if len(mode) < 2:
+                self.logger.error("[VLMP] No size specified")
+                raise Exception("No size specified")
+            setLimit = mode[1]
+            getScore = lambda sim: 1
+        elif modeName == "upperLimit":
+            getScore,_,setLimit = self.__getUpperLimitMode(mode)
+
+        simulationPoolEntries = self.__getSimulationPoolEntries(simulationPool)
+
+        VLMPsession = self.__createSessionFolders(sessionName)
+
+        self.simulationSets = []
+
+        currentSet      = OrderedDict()
+        currentSetInfo  = {}
+        currentSetScore = 0
+
+        def writeCurrentSet():
+            simSet = list(currentSet.keys())
+            self.logger.debug("[VLMP] Simulation set %d has %d simulations",len(self.simulationSets),len(simSet))
+            self.__writeSimulationSet(sessionName,VLMPsession,
+                                      len(self.simulationSets),simSet,
+                                      currentSet,currentSetInfo)
+            self.simulationSets.append(simSet)
+            #Estimated costs of the written simulations are not needed anymore
+            for sim in currentSet.values():
+                self.simulationsCost.pop(sim.getID(),None)
+
+        with self.profiler.phase("streamSimulationPool"):
+            for simulationName,simulationInfo,sim in self.__iterSimulationPool(simulationPoolEntries,workers):
+
+                #Simulations are released once written, so they are validated as they are built
+                if not self.debugMode:
+                    with self.profiler.phase("validation"):
+                        self.__validateSimulation(simulationName,sim)
+
+                score = getScore(sim)
+                if currentSetScore + score > setLimit and len(currentSet) > 0:
+                    writeCurrentSet()
+                    #Release the simulations of the written set
+                    currentSet.clear()
+                    currentSetInfo.clear()
+                    currentSetScore = 0
+
+                currentSet[simulationName]     = sim
+                currentSetInfo[simulationName] = simulationInfo
+                currentSetScore += score
+
+            if len(currentSet) > 0:
+                writeCurrentSet()
+                currentSet.clear()
+                currentSetInfo.clear()
+
+        self.__writeSession(sessionName,VLMPsession)
+
+        self.__writeProfile(sessionName)
 
         self.logger.debug("[VLMP] Simulation set up finished")
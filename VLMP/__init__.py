@@ -1,5 +1,8 @@
 import sys,os
 
+import time
+_importStart = time.perf_counter()
+
 import logging
 
 from colorama import init  as colorama_init
@@ -11,9 +14,31 @@ colorama_init()
 
 import json
 
+################### VALIDATION ##################
+
+# Validation level, it can be set with the environment variable VLMP_VALIDATION
+# or for each VLMP instance, VLMP(validation = "fast").
+#  - "full": components are checked each time they are merged and debug messages are logged.
+#  - "fast": per merge checks and debug messages are skipped,
+#            each simulation is validated once, when it has been built.
+
+VALIDATION_LEVELS = ["full","fast"]
+
+VALIDATION = os.environ.get("VLMP_VALIDATION","full")
+
 ################### DEBUG MODE ##################
 
-DEBUG_MODE = True
+# Kept for compatibility, it is not read by VLMP. The debug mode of each VLMP instance
+# follows its validation level (debug messages are logged with the "full" level)
+DEBUG_MODE = (VALIDATION == "full")
+
+##################### PROFILE ###################
+
+# Profiling of VLMP sessions, enabled with VLMP_PROFILE=1 or VLMP(profile = True).
+# Tracing of the memory allocated by Python, enabled with VLMP_PROFILE_MEMORY=1 or VLMP(profileMemory = True)
+
+PROFILE        = (os.environ.get("VLMP_PROFILE","0") == "1")
+PROFILE_MEMORY = (os.environ.get("VLMP_PROFILE_MEMORY","0") == "1")
 
 ################# SET UP LOGGER #################
 
@@ -43,17 +68,27 @@ class CustomFormatter(logging.Formatter):
 
 logger = logging.getLogger("VLMP")
 logger.handlers = []
-logger.setLevel(logging.DEBUG)
 
 clogger = logging.StreamHandler()
-if DEBUG_MODE:
-    clogger.setLevel(logging.DEBUG) #<----
-else:
-    clogger.setLevel(logging.INFO) #<----
+
+def setDebugMode(debug):
+    #If debug is False the logger level is set to INFO, so debug messages are not even created
+    if debug:
+        logger.setLevel(logging.DEBUG)
+        clogger.setLevel(logging.DEBUG) #<----
+    else:
+        logger.setLevel(logging.INFO)
+        clogger.setLevel(logging.INFO) #<----
+
+setDebugMode(VALIDATION == "full")
 
 clogger.setFormatter(CustomFormatter())
 logger.addHandler(clogger)
 
+if VALIDATION not in VALIDATION_LEVELS:
+    logger.error(f"Validation level \"{VALIDATION}\" (VLMP_VALIDATION) not available, available levels are: {VALIDATION_LEVELS}")
+    raise Exception("Validation level not available")
+
 #################################################
 
 if "-m" not in sys.argv:
@@ -88,3 +123,5 @@ if "-m" not in sys.argv:
     logger.info("Starting VLMP...")
 
     from .VLMP  import VLMP
+
+    IMPORT_TIME = time.perf_counter() - _importStart
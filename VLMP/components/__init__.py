@@ -1,8 +1,123 @@
+import os
+import sys
+import re
+import glob
 import logging
 
+import importlib
+
+import numpy as np
+
 ########################################################
 
+from pyUAMMD import simulation
+
 from ..utils.input import getLabelIndex
+from ..utils.selections import processSelections
+from ..utils.selections import spatialSelectionsData
+
+def componentSimulation(sim,DEBUG_MODE = False):
+    # Creates a pyUAMMD simulation that takes ownership of sim, without the deep copy
+    # done by the simulation constructor. The simulation is expected to be appended
+    # (pyUAMMD copies the appended data into the reference simulation).
+    # When appending, pyUAMMD modifies some entries of the appended simulation
+    # (state and structure labels/data are padded, force field entries are reordered).
+    # Only these containers are copied, so the data of the component is not modified
+    # and the component can be reused (replicas, cache).
+
+    logger = logging.getLogger("VLMP")
+
+    if "state" in sim:
+        sim["state"] = sim["state"].copy()
+        sim["state"]["labels"] = sim["state"]["labels"].copy()
+        sim["state"]["data"]   = [d.copy() for d in sim["state"]["data"]]
+
+    if "topology" in sim:
+        sim["topology"] = sim["topology"].copy()
+        if "structure" in sim["topology"]:
+            sim["topology"]["structure"] = sim["topology"]["structure"].copy()
+            sim["topology"]["structure"]["labels"] = sim["topology"]["structure"]["labels"].copy()
+            sim["topology"]["structure"]["data"]   = [d.copy() for d in sim["topology"]["structure"]["data"]]
+        if "forceField" in sim["topology"]:
+            sim["topology"]["forceField"] = sim["topology"]["forceField"].copy()
+
+    #Same checks done by the simulation constructor.
+    #They are skipped if not in debug mode (validation "fast"), the merged simulation is validated instead
+    if DEBUG_MODE:
+        stateInSim     = ("state" in sim)
+        structureInSim = ("topology" in sim) and ("structure" in sim["topology"])
+
+        if stateInSim and not structureInSim:
+            logger.error("Added state but not structure")
+            raise Exception("Added state but not structure")
+
+        if stateInSim and structureInSim:
+            if len(sim["state"]["data"]) != len(sim["topology"]["structure"]["data"]):
+                logger.error("Number of particles in state and structure does not match")
+                raise Exception("Number of particles in state and structure does not match")
+
+    compSim = simulation(None,DEBUG_MODE)
+    compSim.sim = sim
+
+    return compSim
+
+class componentsRegistry:
+    # Registry of the components of a components package (models, modelOperations, ...).
+    # The components (classes) defined in each module of the package are recorded
+    # reading the source files, without importing them. A module is imported the first
+    # time one of its components is requested, so only the modules used are imported.
+
+    def __init__(self,packageName,componentClass):
+
+        self.logger = logging.getLogger("VLMP")
+
+        self.packageName    = packageName
+        self.componentClass = componentClass
+
+        packagePath = os.path.dirname(os.path.abspath(sys.modules[packageName].__file__))
+
+        self.components = {}
+        for modulePath in sorted(glob.glob(os.path.join(packagePath,"*.py"))):
+            moduleName = os.path.basename(modulePath).split(".")[0]
+            if "__" in moduleName:
+                continue
+            with open(modulePath,"r") as f:
+                for className in re.findall(r"^class\s+(\w+)",f.read(),re.MULTILINE):
+                    self.components[className] = moduleName
+
+    def getComponentsNames(self):
+        return list(self.components.keys())
+
+    def __contains__(self,componentName):
+        return componentName in self.components
+
+    def __bindImported(self):
+        # Importing a module binds it to the package with its own name (also when a module
+        # imports another one of the same package). The components of all the imported
+        # modules are bound to the package, replacing the modules.
+        package = sys.modules[self.packageName]
+        for componentName,moduleName in self.components.items():
+            module = sys.modules.get(f"{self.packageName}.{moduleName}",None)
+            if module is not None and hasattr(module,componentName):
+                setattr(package,componentName,getattr(module,componentName))
+
+    def getComponent(self,componentName):
+
+        if componentName not in self.components:
+            raise AttributeError(f"module \"{self.packageName}\" has no attribute \"{componentName}\"")
+
+        moduleName = self.components[componentName]
+        try:
+            self.logger.debug("[%s] Importing %s type component %s",self.componentClass,self.componentClass,moduleName)
+            importlib.import_module(f".{moduleName}",self.packageName)
+        except Exception as e:
+            self.logger.error(e)
+            self.logger.error(f"[{self.componentClass}] Error importing {self.componentClass} type component {moduleName}")
+            raise
+
+        self.__bindImported()
+
+        return getattr(sys.modules[f"{self.packageName}.{moduleName}"],componentName)
 
 class idsHandler:
 
@@ -11,8 +126,80 @@ class idsHandler:
     _id2model   = None
     _id2localId = None
 
-    def __getModelLocalId(self, i):
-        return idsHandler._id2model[i], idsHandler._id2localId[i]
+    #Structure label -> global id to structure value table, built on demand
+    _id2struct  = {}
+    #Selection expression -> selected ids, shared by all the components of the simulation
+    _selections = {}
+    #Positions (and KD-tree) used by spatial selections, dropped when positions change
+    _spatial    = None
+    #Transform of the positions (and orientations) of some ids not applied to the models yet,
+    #consecutive transforms of the same ids are composed and applied at once
+    _pendingTransform = None
+
+    @staticmethod
+    def reset():
+        idsHandler._models     = None
+        idsHandler._id2model   = None
+        idsHandler._id2localId = None
+        idsHandler._id2struct  = {}
+        idsHandler._selections = {}
+        idsHandler._spatial    = None
+        idsHandler._pendingTransform = None
+
+    @staticmethod
+    def flushTransforms():
+        #Applies the pending transform to the models. It has to be called
+        #before the state of the models is accessed without the idsHandler
+        pending = idsHandler._pendingTransform
+        if pending is None:
+            return
+        idsHandler._pendingTransform = None
+
+        transform = pending["transform"]
+        pending["handler"].__scatterState(pending["ids"],"position",
+                                          transform.applyPositions(pending["positions"]))
+        if len(pending["directionIds"]) > 0 and transform.rotation is not None:
+            pending["handler"].__scatterState(pending["directionIds"],"direction",
+                                              transform.applyDirections(pending["directions"]))
+
+    @staticmethod
+    def _isHandled(model):
+        return idsHandler._models is not None and any([mdl is model for mdl in idsHandler._models])
+
+    @staticmethod
+    def _structureChanged(model):
+        #Called by the models when their structure is set (modelBase.setStructure),
+        #if the model is handled the structure tables and the selections are computed again
+        if not idsHandler._isHandled(model):
+            return
+        idsHandler._id2struct  = {}
+        idsHandler._selections = {}
+        idsHandler._spatial    = None
+
+    @staticmethod
+    def _stateChanged(model):
+        #Called by the models before their state is set (modelBase.setState, modelBase.setStateColumns),
+        #if the model is handled the ids may change, the idsHandler is initialized again when it is used
+        if not idsHandler._isHandled(model):
+            return
+        idsHandler.flushTransforms()
+        idsHandler.reset()
+
+    def __groupByModel(self,globalIds):
+        # Splits the global ids by model. For each model returns the model index,
+        # the positions of its ids in globalIds and their local ids
+        globalIds = np.asarray(globalIds,dtype=int).reshape(-1)
+
+        mdlIndices = idsHandler._id2model[globalIds]
+        localIds   = idsHandler._id2localId[globalIds]
+
+        order = np.argsort(mdlIndices,kind="stable")
+        mdls,starts = np.unique(mdlIndices[order],return_index=True)
+        ends = np.append(starts[1:],len(order))
+
+        for mdlIndex,start,end in zip(mdls,starts,ends):
+            positions = order[start:end]
+            yield int(mdlIndex),positions,localIds[positions]
 
     def __init__(self,
                  models):
@@ -23,20 +210,20 @@ class idsHandler:
 
             logger.debug("Initializing idsHandler")
 
-            idsHandler._models = models
+            idsHandler.flushTransforms()
 
-            N = sum([mdl.getNumberOfParticles() for mdl in idsHandler._models])
+            idsHandler._models = models
 
-            idsHandler._id2model   = [None]*N
-            idsHandler._id2localId = [None]*N
+            nParticles = np.asarray([mdl.getNumberOfParticles() for mdl in idsHandler._models],dtype=int)
+            N = int(np.sum(nParticles))
 
-            offset = 0
-            for mdlIndex,mdl in enumerate(idsHandler._models):
-                for i in range(mdl.getNumberOfParticles()):
-                    idsHandler._id2model[i+offset]   = mdlIndex
-                    idsHandler._id2localId[i+offset] = i
+            #Global id -> (model index, local id)
+            idsHandler._id2model   = np.repeat(np.arange(len(nParticles)),nParticles)
+            idsHandler._id2localId = np.arange(N) - np.repeat(np.cumsum(nParticles)-nParticles,nParticles)
 
-                offset += mdl.getNumberOfParticles()
+            idsHandler._id2struct  = {}
+            idsHandler._selections = {}
+            idsHandler._spatial    = None
 
             logger.debug("Done initializing idsHandler")
         else:
@@ -45,68 +232,126 @@ class idsHandler:
     ######################## GETTERS #######################
 
     def _getIdsProperty(self,globalIds,propertyName):
-        idsProperty = []
+        idsProperty = [None]*len(globalIds)
 
-        for i in globalIds:
-            mdlIndex, localId = self.__getModelLocalId(i)
+        for mdlIndex,positions,localIds in self.__groupByModel(globalIds):
 
             mdl = idsHandler._models[mdlIndex]
 
             typeIndex = getLabelIndex("type",mdl.getStructure()["labels"])
-            itype     = mdl.getStructure()["data"][localId][typeIndex]
+            structure = mdl.getStructure()["data"]
+            types     = mdl.getTypes().getTypes()
 
-            idsProperty.append(mdl.getTypes().getTypes()[itype][propertyName])
+            for pos,localId in zip(positions.tolist(),localIds.tolist()):
+                idsProperty[pos] = types[structure[localId][typeIndex]][propertyName]
 
         return idsProperty
 
+    def __gatherState(self,globalIds,stateName,width):
+        # State of the ids as an array, (len(globalIds),width)
+        values = np.zeros((len(globalIds),width),dtype=float)
+        for mdlIndex,positions,localIds in self.__groupByModel(globalIds):
+            mdl = idsHandler._models[mdlIndex]
+
+            if mdl.hasStateColumns():
+                values[positions] = mdl.getStateColumn(stateName)[localIds]
+                continue
+
+            stateIndex = getLabelIndex(stateName,mdl.getState()["labels"])
+            state      = mdl.getState()["data"]
+            values[positions] = [state[localId][stateIndex] for localId in localIds.tolist()]
+
+        return values
+
+    def __scatterState(self,globalIds,stateName,values):
+        # Inverse of __gatherState, values are not checked
+        for mdlIndex,positions,localIds in self.__groupByModel(globalIds):
+            mdl = idsHandler._models[mdlIndex]
+
+            if mdl.hasStateColumns():
+                mdl.getStateColumn(stateName)[localIds] = values[positions]
+                continue
+
+            stateIndex = getLabelIndex(stateName,mdl.getState()["labels"])
+            state      = mdl.getState()["data"]
+            for localId,value in zip(localIds.tolist(),values[positions].tolist()):
+                state[localId][stateIndex] = value
+
     def _getIdsState(self,globalIds,stateName):
-        idsState = []
 
-        for i in globalIds:
-            mdlIndex, localId = self.__getModelLocalId(i)
+        pending = idsHandler._pendingTransform
+        if pending is not None:
+            #Positions of the transformed ids are given without applying the transform to the models
+            if stateName == "position" and np.array_equal(pending["ids"],np.asarray(globalIds,dtype=int).reshape(-1)):
+                return pending["transform"].applyPositions(pending["positions"]).tolist()
+            idsHandler.flushTransforms()
+
+        idsState = [None]*len(globalIds)
+
+        for mdlIndex,positions,localIds in self.__groupByModel(globalIds):
 
             mdl = idsHandler._models[mdlIndex]
 
+            if mdl.hasStateColumns():
+                values = mdl.getStateColumn(stateName)[localIds].tolist()
+                for pos,value in zip(positions.tolist(),values):
+                    idsState[pos] = value
+                continue
+
             stateIndex = getLabelIndex(stateName,mdl.getState()["labels"])
-            stateValue = mdl.getState()["data"][localId][stateIndex]
+            state      = mdl.getState()["data"]
 
-            idsState.append(stateValue)
+            for pos,localId in zip(positions.tolist(),localIds.tolist()):
+                idsState[pos] = state[localId][stateIndex]
 
         return idsState
 
-    def _getIdsStructure(self,globalIds,structureName):
+    def __getId2Struct(self,structureName):
 
-        totalParticles = sum([mdl.getNumberOfParticles() for mdl in idsHandler._models])
+        if structureName not in idsHandler._id2struct:
 
-        id2struct = [None]*totalParticles
-        structOffset = 0
-        for mdl in idsHandler._models:
-            structLabels = mdl.getStructure()["labels"]
-            for i in mdl.getGlobalIds():
-                mdlIndex, localId = self.__getModelLocalId(i)
-                mdl = idsHandler._models[mdlIndex]
+            logger = logging.getLogger("VLMP")
+            logger.debug("[idsHandler] Building id to \"%s\" table",structureName)
 
-                maxStruct = structOffset
-                if structureName in structLabels:
-                    structIndex  = getLabelIndex(structureName,structLabels)
-                    structValue  = mdl.getStructure()["data"][localId][structIndex]
+            # Structure values of each model are shifted, so different models
+            # never share a structure value
+            id2struct    = []
+            structOffset = 0
+            for mdl in idsHandler._models:
+                structLabels = mdl.getStructure()["labels"]
 
-                    id2struct[i] = structValue+structOffset
+                if structureName in structLabels:
+                    structIndex = getLabelIndex(structureName,structLabels)
+                    structValue = np.asarray([s[structIndex] for s in mdl.getStructure()["data"]],dtype=int)
                 else:
-                    id2struct[i] = structOffset
+                    structValue = np.zeros(mdl.getNumberOfParticles(),dtype=int)
 
-                maxStruct = max(maxStruct,id2struct[i])
+                id2struct.append(structValue+structOffset)
 
-            structOffset += maxStruct+1
-
-        ########################################################
+                if len(structValue) > 0:
+                    structOffset += int(np.max(structValue))+1
+                else:
+                    structOffset += 1
 
-        idsStructure = []
+            if len(id2struct) > 0:
+                idsHandler._id2struct[structureName] = np.concatenate(id2struct)
+            else:
+                idsHandler._id2struct[structureName] = np.zeros(0,dtype=int)
 
-        for i in globalIds:
-            idsStructure.append(id2struct[i])
+        return idsHandler._id2struct[structureName]
 
-        return idsStructure
+    def _getIdsStructure(self,globalIds,structureName):
+        id2struct = self.__getId2Struct(structureName)
+        return id2struct[np.asarray(globalIds,dtype=int).reshape(-1)].tolist()
+
+    def _processSelections(self,selections):
+        if idsHandler._spatial is None:
+            #Positions are read only if a spatial selection is evaluated
+            idsHandler._spatial = spatialSelectionsData(idsHandler._models,
+                                                        beforeLoading=idsHandler.flushTransforms)
+        return processSelections(idsHandler._models,selections,
+                                 cache=idsHandler._selections,
+                                 spatialData=idsHandler._spatial)
 
     ######################## SETTERS #######################
 
@@ -118,21 +363,76 @@ class idsHandler:
             logger.error(f"[ModelOperation] Number of ids and states ({stateName}) do not match")
             raise Exception(f"Number of ids and states do not match")
 
-        for i,s in zip(globalIds,states):
-            mdlIndex, localId = self.__getModelLocalId(i)
+        idsHandler.flushTransforms()
+
+        #Spatial selections have to be evaluated again
+        if stateName == "position":
+            idsHandler._spatial = None
+
+        for mdlIndex,positions,localIds in self.__groupByModel(globalIds):
             mdl = idsHandler._models[mdlIndex]
 
+            if mdl.hasStateColumns():
+                #Columnar state, all the values are set at once
+                column = mdl.getStateColumn(stateName)
+                try:
+                    values = np.asarray([states[pos] for pos in positions.tolist()],dtype=column.dtype)
+                except (TypeError,ValueError):
+                    values = None
+
+                if values is None or values.shape != (len(localIds),)+column.shape[1:]:
+                    logger.error(f"[ModelOperation] State values for state \"{stateName}\" are not valid."
+                                 f" Each value should have shape {column.shape[1:]} and type {column.dtype}")
+                    raise Exception(f"State is not valid")
+
+                column[localIds] = values
+                continue
+
             stateIndex = getLabelIndex(stateName,mdl.getState()["labels"])
+            state      = mdl.getState()["data"]
 
-            #Check if state is valid
-            if type(s) != type(mdl.getState()["data"][localId][stateIndex]):
-                logger.error(f"[ModelOperation] State value {s} for state \"{stateName}\" is not valid."
-                             f" State value type is {type(s)} but should be {type(mdl.getState()['data'][localId][stateIndex])}")
-                raise Exception(f"State is not valid")
-            else:
-                if type(s) == list:
-                    if len(s) != len(mdl.getState()["data"][localId][stateIndex]):
-                        logger.error(f"[ModelOperation] State value {s} for state \"{stateName}\" is not valid, length does not match")
-                        raise Exception(f"State is not valid")
+            for pos,localId in zip(positions.tolist(),localIds.tolist()):
+                s       = states[pos]
+                current = state[localId][stateIndex]
+
+                #Check if state is valid
+                if type(s) != type(current):
+                    logger.error(f"[ModelOperation] State value {s} for state \"{stateName}\" is not valid."
+                                 f" State value type is {type(s)} but should be {type(current)}")
+                    raise Exception(f"State is not valid")
+                else:
+                    if type(s) == list:
+                        if len(s) != len(current):
+                            logger.error(f"[ModelOperation] State value {s} for state \"{stateName}\" is not valid, length does not match")
+                            raise Exception(f"State is not valid")
 
-                mdl.getState()["data"][localId][stateIndex] = s
+                    state[localId][stateIndex] = s
+
+    def _transformIds(self,globalIds,transform):
+        # Applies an affineTransform to the positions (and orientations, if the models have them) of the ids.
+        # The positions are gathered once and the transform is kept pending, transforms of the same ids
+        # are composed, until the state is accessed in another way (then it is applied to the models)
+
+        globalIds = np.asarray(globalIds,dtype=int).reshape(-1)
+
+        pending = idsHandler._pendingTransform
+        if pending is not None and np.array_equal(pending["ids"],globalIds):
+            pending["transform"] = pending["transform"].then(transform)
+        else:
+            idsHandler.flushTransforms()
+
+            directionIds = []
+            for mdlIndex,positions,localIds in self.__groupByModel(globalIds):
+                if "direction" in idsHandler._models[mdlIndex].getStateLabels():
+                    directionIds.append(globalIds[positions])
+            directionIds = np.concatenate(directionIds) if len(directionIds) > 0 else np.zeros(0,dtype=int)
+
+            idsHandler._pendingTransform = {"handler"      : self,
+                                            "ids"          : globalIds,
+                                            "positions"    : self.__gatherState(globalIds,"position",3),
+                                            "directionIds" : directionIds,
+                                            "directions"   : self.__gatherState(directionIds,"direction",4),
+                                            "transform"    : transform}
+
+        #Spatial selections have to be evaluated again
+        idsHandler._spatial = None
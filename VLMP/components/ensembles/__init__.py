@@ -138,17 +138,17 @@ class ensembleBase:
                                     }
                            },DEBUG_MODE)
 
-############### IMPORT ALL ENSEMBLES ###############
+############### REGISTER ALL ENSEMBLES ###############
 
-import glob
+#The ensemble modules are not imported here, they are registered and
+#imported the first time one of their components is requested
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-ensembles_ = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-ensembles_ = [x.split(".")[0] for x in ensembles_ if "__" not in x]
+from .. import componentsRegistry
 
-for e in ensembles_:
-    try:
-        exec(f"from .{e} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[Ensemble] Error importing ensemble type component \"{e}\"")
+_registry = componentsRegistry(__name__,"Ensemble")
+
+def __getattr__(name):
+    return _registry.getComponent(name)
+
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
@@ -7,6 +7,8 @@ import logging
 
 from pyUAMMD import simulation
 
+from .. import componentSimulation
+
 class integratorBase:
 
     def __init__(self,
@@ -106,19 +108,19 @@ class integratorBase:
             "data":[[1,self._name,self.getIntegrationSteps()]]
         }
 
-        return simulation(copy.deepcopy(sim),DEBUG_MODE)
+        return componentSimulation(sim,DEBUG_MODE)
+
+############### REGISTER ALL INTEGRATORS ###############
+
+#The integrator modules are not imported here, they are registered and
+#imported the first time one of their components is requested
 
-############### IMPORT ALL INTEGRATORS ###############
+from .. import componentsRegistry
 
-import glob
+_registry = componentsRegistry(__name__,"Integrator")
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-integrators = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-integrators = [x.split(".")[0] for x in integrators if "__" not in x]
+def __getattr__(name):
+    return _registry.getComponent(name)
 
-for i in integrators:
-    try:
-        exec(f"from .{i} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[Integrator] Error importing integrator type component {i}")
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
@@ -8,8 +8,7 @@ import logging
 from pyUAMMD import simulation
 
 from .. import idsHandler
-
-from ...utils.selections import processSelections
+from .. import componentSimulation
 
 class modelExtensionBase(idsHandler):
 
@@ -35,9 +34,10 @@ class modelExtensionBase(idsHandler):
 
         self._models = models
 
-        self.logger.debug(f"[ModelExtension] ({self._type}) Extending models: "+
-                          " ".join([m.getName() for m in self._models])+
-                          ". For model extension: "+self._name)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"[ModelExtension] ({self._type}) Extending models: "+
+                              " ".join([m.getName() for m in self._models])+
+                              ". For model extension: "+self._name)
 
         self.availableParameters =  availableParameters.copy()
         self.availableParameters.update({"startStep","endStep"})
@@ -88,8 +88,7 @@ class modelExtensionBase(idsHandler):
         #Process selections
         selections = [sel for sel in params if sel in self.availableSelections]
         selections = {sel:params[sel] for sel in selections if sel in params.keys()}
-        self._selection = processSelections(self._models,
-                                            copy.deepcopy(selections))
+        self._selection = self._processSelections(selections)
 
         ########################################################
 
@@ -166,6 +165,12 @@ class modelExtensionBase(idsHandler):
     ########################################################
 
     def getSelection(self,selectionName):
+        #Particles selections are given as lists of ids,
+        #selections of pairs, triples, ... as lists of lists of ids
+        return self._selection[selectionName].tolist()
+
+    def getSelectionArray(self,selectionName):
+        #Selection as a (read only) array, of shape (n,) or (n,k)
         return self._selection[selectionName]
 
     ########################################################
@@ -193,19 +198,19 @@ class modelExtensionBase(idsHandler):
                 sim["topology"]["forceField"][ext]["parameters"]["group"] = self.getName()
             sim["topology"]["forceField"]["group_"+self.getName()] = self._group
 
-        return simulation(copy.deepcopy(sim),DEBUG_MODE)
+        return componentSimulation(sim,DEBUG_MODE)
+
+############### REGISTER ALL MODEL EXTENSIONS ###############
+
+#The model extension modules are not imported here, they are registered and
+#imported the first time one of their components is requested
 
-############### IMPORT ALL MODEL EXTENSIONS ###############
+from .. import componentsRegistry
 
-import glob
+_registry = componentsRegistry(__name__,"ModelExtension")
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-extensions = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-extensions = [x.split(".")[0] for x in extensions if "__" not in x]
+def __getattr__(name):
+    return _registry.getComponent(name)
 
-for e in extensions:
-    try:
-        exec(f"from .{e} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[ModelExtension] Error importing model extension type component {e}")
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
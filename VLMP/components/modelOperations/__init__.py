@@ -9,8 +9,6 @@ from pyUAMMD import simulation
 
 from .. import idsHandler
 
-from ...utils.selections import processSelections
-
 class modelOperationBase(idsHandler):
 
     def __init__(self,
@@ -35,9 +33,10 @@ class modelOperationBase(idsHandler):
 
         self._models = models
 
-        self.logger.debug(f"[ModelOperation] ({self._type}) Operating on models: "+
-                          " ".join([m.getName() for m in self._models])+
-                          ". For model operation: "+self._name)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"[ModelOperation] ({self._type}) Operating on models: "+
+                              " ".join([m.getName() for m in self._models])+
+                              ". For model operation: "+self._name)
 
         self.availableParameters  = availableParameters.copy()
         self.requiredParameters   = requiredParameters.copy()
@@ -81,8 +80,7 @@ class modelOperationBase(idsHandler):
         #Process selections
         selections = [sel for sel in params if sel in self.availableSelections]
         selections = {sel:params[sel] for sel in selections if sel in params.keys()}
-        self._selection = processSelections(self._models,
-                                            copy.deepcopy(selections))
+        self._selection = self._processSelections(selections)
 
     ########################################################
 
@@ -109,6 +107,12 @@ class modelOperationBase(idsHandler):
     ########################################################
 
     def getSelection(self,selectionName):
+        #Particles selections are given as lists of ids,
+        #selections of pairs, triples, ... as lists of lists of ids
+        return self._selection[selectionName].tolist()
+
+    def getSelectionArray(self,selectionName):
+        #Selection as a (read only) array, of shape (n,) or (n,k)
         return self._selection[selectionName]
 
     ########################################################
@@ -125,18 +129,22 @@ class modelOperationBase(idsHandler):
     def setIdsState(self,ids,stateName,states):
         self._setIdsState(ids,stateName,states)
 
+    def transformIds(self,ids,transform):
+        #Applies an affineTransform to the positions (and orientations) of the ids
+        self._transformIds(ids,transform)
+
+
+############### REGISTER ALL MODEL OPERATIONS ###############
+
+#The model operation modules are not imported here, they are registered and
+#imported the first time one of their components is requested
 
-############### IMPORT ALL MODEL OPERATIONS ###############
+from .. import componentsRegistry
 
-import glob
+_registry = componentsRegistry(__name__,"ModelOperation")
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-operations = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-operations = [x.split(".")[0] for x in operations if "__" not in x]
+def __getattr__(name):
+    return _registry.getComponent(name)
 
-for o in operations:
-    try:
-        exec(f"from .{o} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[ModelOperation] Error importing model operation type component {o}")
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
@@ -4,6 +4,8 @@ import numpy as np
 
 from scipy.spatial.transform import Rotation as R
 
+from VLMP.utils.geometry import affineTransform
+
 class alignInertiaMomentAlongVector(modelOperationBase):
     """
     {
@@ -58,7 +60,7 @@ class alignInertiaMomentAlongVector(modelOperationBase):
         selectedIds = self.getSelection("selection")
 
         if len(selectedIds) == 0:
-            self.error("No elements selected.")
+            self.logger.error("No elements selected.")
             raise Exception("No elements selected.")
 
         if len(selectedIds) > 1:
@@ -66,10 +68,7 @@ class alignInertiaMomentAlongVector(modelOperationBase):
             masses = np.asarray(self.getIdsProperty(selectedIds,"mass"))
             pos    = np.asarray(self.getIdsState(selectedIds,"position"))
 
-            inertia = np.zeros((3,3))
-            for i in range(len(selectedIds)):
-                inertia += masses[i]*np.outer(pos[i],pos[i])
-
+            inertia = (masses[:,np.newaxis]*pos).T @ pos
             inertia /= np.sum(masses)
 
             # Find the largest inertia moment
@@ -92,8 +91,5 @@ class alignInertiaMomentAlongVector(modelOperationBase):
 
                 # Rotate the model, create rotation matrix using scipy
                 center = np.sum(pos*masses[:,np.newaxis],axis=0)/np.sum(masses)
-                pos -= center
-                pos = rot.apply(pos)
-                pos += center
 
-                self.setIdsState(selectedIds,"position",pos.tolist())
+                self.transformIds(selectedIds,affineTransform.fromRotation(rot,center))
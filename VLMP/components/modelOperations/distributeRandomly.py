@@ -10,6 +10,10 @@ from . import modelOperationBase
 from ...utils.selections import splitStateAccordingStructure
 from ...utils.input import getSubParameters
 from ...utils.geometry import distributeRandomlyGeneratorChecker
+from ...utils.geometry import distributeRandomlyCellList
+from ...utils.geometry import distributeRandomlyCellListBatched
+from ...utils.geometry import distributeOnLattice
+from ...utils.geometry import availableLattices
 
 from scipy.spatial.transform import Rotation
 
@@ -22,15 +26,25 @@ class distributeRandomly(modelOperationBase):
         "description": "Distributes selected particles randomly within specified bounds.",
         "parameters": {
             "mode": {
-                "description": "Distribution mode, either 'box' or 'sphere'.",
+                "description": "Distribution mode, either 'box', 'sphere' or 'lattice'. In 'lattice' mode models are placed on the sites of a lattice ('lattice': 'cubic', 'fcc' (default) or 'hcp') whose spacing (by default) keeps them clash free in any orientation, optionally displaced randomly ('jitter', between 0 and 1, the fraction of the room left between neighbour models, which is almost none with the default spacing) and restricted to a sphere ('center' and 'radius'). It fails only if there are not enough sites.",
                 "type": "str",
                 "default": "box"
             },
             "avoidClashes": {
-                "description": "Number of attempts to avoid particle clashes. If 0, clashes are not avoided.",
+                "description": "Number of attempts to avoid particle clashes. If 0, clashes are not avoided. Not used in 'lattice' mode, whose sites are clash free.",
                 "type": "int",
                 "default": 0
             },
+            "engine": {
+                "description": "Engine used to avoid clashes. 'tree' builds a KD-tree of the added particles for each new model, 'grid' uses a cell list updated as models are added (faster for many models). Not used in 'lattice' mode.",
+                "type": "str",
+                "default": "tree"
+            },
+            "batchSize": {
+                "description": "Number of candidate positions (and rotations, if randomRotation) checked at once for each model (only for the 'grid' engine). If larger than 1, after several failed batches candidates are sampled from the free space, with increasing resolution. Not used in 'lattice' mode.",
+                "type": "int",
+                "default": 1
+            },
             "randomRotation": {
                 "description": "Whether to apply random rotations to the particles.",
                 "type": "bool",
@@ -55,16 +69,23 @@ class distributeRandomly(modelOperationBase):
     }
     """
 
-    availableParameters = {"mode","avoidClashes","randomRotation"}
+    availableParameters = {"mode","avoidClashes","engine","batchSize","randomRotation"}
     requiredParameters  = set()
     availableSelections = {"selection"}
     requiredSelections  = {"selection"}
 
+    availableEngines = ["tree","grid"]
+
     def __randomBoxPoint(self):
         mp = np.random.uniform(low  = [-self.boxX,-self.boxY,-self.boxZ],
                                high = [ self.boxX, self.boxY, self.boxZ])
         return mp
 
+    def __randomBoxPoints(self,n):
+        return np.random.uniform(low  = [-self.boxX,-self.boxY,-self.boxZ],
+                                 high = [ self.boxX, self.boxY, self.boxZ],
+                                 size = (n,3))
+
     def __boxCheckDistance(self,p1,p2,r1,r2):
         # Check if the distance between two points is larger than the sum of the radius
         # of the particles, taking into account the periodicity of the box
@@ -88,10 +109,8 @@ class distributeRandomly(modelOperationBase):
         # Generate a random point in a sphere
         # of center self.center and radius self.radius
 
-        maxRad = np.max([np.max(r) for r in self.modelsRads])
-
         # Generate random radius
-        rho = (self.radius-maxRad)*(random.random() ** (1/3))
+        rho = (self.radius-self.modelsMaxRad)*(random.random() ** (1/3))
 
         # Generate random angles
         theta = math.acos(2 * random.random() - 1)  # Polar angle
@@ -106,6 +125,23 @@ class distributeRandomly(modelOperationBase):
 
         return mp
 
+    def __randomSpherePoints(self,n):
+        # Generate n random points in a sphere
+        # of center self.center and radius self.radius
+
+        rho   = (self.radius-self.modelsMaxRad)*(np.random.uniform(size=n) ** (1/3))
+        theta = np.arccos(2 * np.random.uniform(size=n) - 1)
+        phi   = 2 * np.pi * np.random.uniform(size=n)
+
+        mp = np.stack([rho * np.sin(theta) * np.cos(phi),
+                       rho * np.sin(theta) * np.sin(phi),
+                       rho * np.cos(theta)],axis=-1) + np.asarray(self.center)
+
+        return mp
+
+    def __insideSphere(self,points):
+        return np.linalg.norm(points - np.asarray(self.center),axis=1) <= self.radius-self.modelsMaxRad
+
     def __sphereCheckDistance(self,p1,p2,r1,r2):
         # Check if the distance between two points is larger than the sum of the radius
         # of the particles
@@ -140,8 +176,10 @@ class distributeRandomly(modelOperationBase):
             self.box  = self.getEnsemble().getEnsembleComponent("box")
             self.boxX,self.boxY,self.boxZ = [b/2.0 for b in self.box]
 
-            self.getRandomPoint = self.__randomBoxPoint
-            self.checkDistance  = self.__boxCheckDistance
+            self.getRandomPoint  = self.__randomBoxPoint
+            self.getRandomPoints = self.__randomBoxPoints
+            self.insideDomain    = None
+            self.checkDistance   = self.__boxCheckDistance
 
         elif self.mode == "sphere":
 
@@ -179,15 +217,59 @@ class distributeRandomly(modelOperationBase):
                 self.logger.error(f"Sphere is outside the box in Z")
                 raise Exception("Sphere outside box")
 
-            self.getRandomPoint = self.__randomSpherePoint
-            self.checkDistance  = self.__sphereCheckDistance
+            self.getRandomPoint  = self.__randomSpherePoint
+            self.getRandomPoints = self.__randomSpherePoints
+            self.insideDomain    = self.__insideSphere
+            self.checkDistance   = self.__sphereCheckDistance
+
+        elif self.mode == "lattice":
+
+            self.box = self.getEnsemble().getEnsembleComponent("box")
+
+            self.lattice = self.modeParams.get("lattice","fcc")
+            if self.lattice not in availableLattices:
+                self.logger.error(f"Lattice {self.lattice} not recognized, available lattices are: {list(availableLattices.keys())}")
+                raise Exception(f"Lattice not recognized")
+
+            self.latticeSpacing = self.modeParams.get("spacing",None)
+            self.latticeJitter  = self.modeParams.get("jitter",0.0)
+
+            if self.latticeJitter < 0.0 or self.latticeJitter > 1.0:
+                self.logger.error(f"Lattice jitter has to be between 0 and 1, but it is {self.latticeJitter}")
+                raise Exception(f"Lattice jitter not valid")
+
+            if ("center" in self.modeParams) != ("radius" in self.modeParams):
+                self.logger.error(f"Both center and radius have to be given to restrict the lattice to a sphere")
+                raise Exception("Missing parameters")
+
+            self.center = self.modeParams.get("center",None)
+            self.radius = self.modeParams.get("radius",None)
 
         else:
-            self.logger.error(f"Mode {self.mode} not recognized, available modes are 'box' and 'sphere'")
+            self.logger.error(f"Mode {self.mode} not recognized, available modes are 'box', 'sphere' and 'lattice'")
             raise Exception(f"Mode not recognized")
 
+        if self.mode == "lattice":
+            notUsed = [p for p in ["avoidClashes","engine","batchSize"] if p in params]
+            if len(notUsed) > 0:
+                self.logger.error(f"Parameters {notUsed} are not used in 'lattice' mode, lattice sites are clash free")
+                raise Exception(f"Parameters not valid")
+
         avoidClashes = params.get("avoidClashes",0)
 
+        self.engine = params.get("engine","tree")
+        if self.engine not in self.availableEngines:
+            self.logger.error(f"Engine {self.engine} not recognized, available engines are: {self.availableEngines}")
+            raise Exception(f"Engine not recognized")
+
+        self.batchSize = params.get("batchSize",1)
+        if self.batchSize < 1:
+            self.logger.error(f"Batch size has to be at least 1, but it is {self.batchSize}")
+            raise Exception(f"Batch size not valid")
+        if self.batchSize > 1 and self.engine != "grid":
+            self.logger.error(f"Batched candidates (batchSize {self.batchSize}) are only available for the 'grid' engine")
+            raise Exception(f"Batch size not valid")
+
         ############################################################
 
         selectedIds = self.getSelection("selection")
@@ -202,6 +284,8 @@ class distributeRandomly(modelOperationBase):
         self.modelsRads = splitStateAccordingStructure(state=rads,
                                                        structure=mods)
 
+        self.modelsMaxRad = np.max([np.max(r) for r in self.modelsRads])
+
         if self.randomRotation:
             for i in range(len(self.modelsPos)):
 
@@ -219,7 +303,16 @@ class distributeRandomly(modelOperationBase):
 
                 self.modelsPos[i] = mp
 
-        if not avoidClashes:
+        if self.mode == "lattice":
+            newPositions = distributeOnLattice(self.box,
+                                               self.modelsPos,self.modelsRads,
+                                               self.lattice,
+                                               1.05,
+                                               spacing = self.latticeSpacing,
+                                               jitter  = self.latticeJitter,
+                                               center  = self.center,
+                                               radius  = self.radius)
+        elif not avoidClashes:
             newPositions = []
             for i in range(len(self.modelsPos)):
                 center = np.mean(self.modelsPos[i],axis=0)
@@ -231,6 +324,23 @@ class distributeRandomly(modelOperationBase):
                 newPositions.append([list(p+transVec) for p in self.modelsPos[i]])
 
             newPositions = [p for mp in newPositions for p in mp]
+        elif self.engine == "grid" and self.batchSize > 1:
+            newPositions = distributeRandomlyCellListBatched(self.box,
+                                                             self.modelsPos,self.modelsRads,
+                                                             self.getRandomPoints,
+                                                             avoidClashes,
+                                                             1.05,
+                                                             periodic = (self.mode != "sphere"),
+                                                             batchSize = self.batchSize,
+                                                             randomRotation = self.randomRotation,
+                                                             insideDomain = self.insideDomain)
+        elif self.engine == "grid":
+            newPositions = distributeRandomlyCellList(self.box,
+                                                      self.modelsPos,self.modelsRads,
+                                                      self.getRandomPoint,
+                                                      avoidClashes,
+                                                      1.05,
+                                                      periodic = (self.mode != "sphere"))
         else:
             newPositions = distributeRandomlyGeneratorChecker(self.box,
                                                               self.modelsPos,self.modelsRads,
@@ -4,6 +4,8 @@ import numpy as np
 
 from scipy.spatial.transform import Rotation as R
 
+from VLMP.utils.geometry import affineTransform
+
 class rotation(modelOperationBase):
     """
     {
@@ -64,7 +66,7 @@ class rotation(modelOperationBase):
         selectedIds = self.getSelection("selection")
 
         if len(selectedIds) == 0:
-            self.error("No elements selected.")
+            self.logger.error("No elements selected.")
             raise Exception("No elements selected.")
 
         if len(selectedIds) > 1:
@@ -72,14 +74,10 @@ class rotation(modelOperationBase):
             pos    = np.asarray(self.getIdsState(selectedIds,"position"))
 
             center = np.mean(pos,axis=0)
-            pos    = pos - center
 
-            rotAxis = np.asarray(rotAxis)
+            rotAxis = np.asarray(rotAxis,dtype=float)
             rotAxis = rotAxis/np.linalg.norm(rotAxis)
 
             r = R.from_rotvec(angle*rotAxis)
-            pos = r.apply(pos)
-
-            pos = pos + center
 
-            self.setIdsState(selectedIds,"position",pos.tolist())
+            self.transformIds(selectedIds,affineTransform.fromRotation(r,center))
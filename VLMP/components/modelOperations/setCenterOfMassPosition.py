@@ -6,6 +6,8 @@ from . import modelOperationBase
 
 import numpy as np
 
+from VLMP.utils.geometry import affineTransform
+
 class setCenterOfMassPosition(modelOperationBase):
     """
     {
@@ -62,8 +64,5 @@ class setCenterOfMassPosition(modelOperationBase):
 
         translation = np.asarray(params.get("position")) - com
 
-        pos += translation
-        pos = pos.tolist()
-
-        self.setIdsState(selectedIds,"position",pos)
+        self.transformIds(selectedIds,affineTransform.fromTranslation(translation))
 
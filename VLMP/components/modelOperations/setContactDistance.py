@@ -7,6 +7,8 @@ from . import modelOperationBase
 import numpy as np
 from scipy.spatial import cKDTree
 
+from VLMP.utils.geometry import affineTransform
+
 class setContactDistance(modelOperationBase):
     """
     {
@@ -19,7 +21,7 @@ class setContactDistance(modelOperationBase):
                 "default": null
             },
             "resolution": {
-                "description": "Resolution for the contact distance adjustment.",
+                "description": "Resolution for the contact distance adjustment. Not used, the contact distance is computed exactly, kept for compatibility.",
                 "type": "float",
                 "default": 0.1
             },
@@ -53,7 +55,7 @@ class setContactDistance(modelOperationBase):
     """
 
     availableParameters = {"distance","resolution","inverse"}
-    requiredParameters  = {"distance","resolution"}
+    requiredParameters  = {"distance"}
     availableSelections = {"reference","mobile"}
     requiredSelections  = {"reference","mobile"}
 
@@ -71,17 +73,16 @@ class setContactDistance(modelOperationBase):
         ############################################################
 
         dst = params["distance"]
-        res = params["resolution"]
         inv = params.get("inverse",False)
 
-        referenceIds = self.getSelection("reference")
-        mobileIds    = self.getSelection("mobile")
+        referenceIds = self.getSelectionArray("reference")
+        mobileIds    = self.getSelectionArray("mobile")
 
-        referencePos  = np.asarray(self.getIdsState(referenceIds,"position"))
-        referenceRads = np.asarray(self.getIdsProperty(referenceIds,"radius"))
+        referencePos  = np.asarray(self.getIdsState(referenceIds,"position"),dtype=float)
+        referenceRads = np.asarray(self.getIdsProperty(referenceIds,"radius"),dtype=float)
 
-        mobilePos  = np.asarray(self.getIdsState(mobileIds,"position"))
-        mobileRads = np.asarray(self.getIdsProperty(mobileIds,"radius"))
+        mobilePos  = np.asarray(self.getIdsState(mobileIds,"position"),dtype=float)
+        mobileRads = np.asarray(self.getIdsProperty(mobileIds,"radius"),dtype=float)
 
         # Compute the total radius of each selection
         refCenter = np.mean(referencePos,axis=0)
@@ -90,64 +91,46 @@ class setContactDistance(modelOperationBase):
         # Compute the vector between the centers
         centersVec = mobCenter-refCenter
         if inv:
-            for i in range(mobilePos.shape[0]):
-                mobilePos[i] = mobCenter-2.0*centersVec
+            # The mobile selection is moved to the other side of the reference
+            mobilePos  = mobilePos-2.0*centersVec
             centersVec = -centersVec
-        centersVec = centersVec/np.linalg.norm(centersVec)
-
-        stepSize = res
-        prevDist = None
-        while True:
-
-            minDst,minDstIndex = cKDTree(referencePos).query(mobilePos, 1)
-
-            ############################################################
-
-            mobileClosestIndex = np.argmin(minDst)
-            mobileClosestDst   = minDst[mobileClosestIndex]
-
-            mobileClosestPos = mobilePos[mobileClosestIndex]
-            mobileClosestRad = mobileRads[mobileClosestIndex]
-
-            ############################################################
-
-            referenceClosestIndex = minDstIndex[mobileClosestIndex]
-            referenceClosestDst   = minDst[mobileClosestIndex]
+        u = centersVec/np.linalg.norm(centersVec)
 
-            referenceClosestPos = referencePos[referenceClosestIndex]
-            referenceClosestRad = referenceRads[referenceClosestIndex]
+        # The mobile selection is translated by t*u. The contact distance of a pair (i mobile, j reference)
+        # is |r_ij + t*u| - (R_i + R_j), with r_ij = p_i - q_j. It is equal to the target distance at
+        # t = -r_ij.u +- sqrt(S_ij^2 - b_ij^2), S_ij = R_i + R_j + distance and b_ij the distance of the pair
+        # in the plane perpendicular to u. Coming from far away along u, the first contact is at the
+        # largest of these solutions, at that translation the contact distance of the selections
+        # (minimum over pairs) is the target distance.
+        # Only pairs with b_ij <= S_ij have a solution, they are found with a single query of
+        # the tree of the reference positions projected on the plane perpendicular to u.
 
-            ############################################################
-
-            currentDst = mobileClosestDst - (mobileClosestRad + referenceClosestRad)
-
-            if np.abs(currentDst-dst) < res:
-                break
-
-            if prevDist is not None:
-                if np.abs(currentDst-dst) > np.abs(prevDist-dst):
-                    stepSize = stepSize/2
-
-            if (currentDst < dst):
-                for i in range(mobilePos.shape[0]):
-                    mobilePos[i] = mobilePos[i] + centersVec * stepSize
-                prevDist = currentDst
-
-            if (currentDst > dst):
-                for i in range(mobilePos.shape[0]):
-                    mobilePos[i] = mobilePos[i] - centersVec * stepSize
-                prevDist = currentDst
-
-        newPos = []
-        for i in range(len(mobileIds)):
-            newPos.append(list(mobilePos[i]))
-
-        self.setIdsState(mobileIds,"position",newPos)
+        def project(pos):
+            return pos - np.outer(pos @ u,u)
 
+        maxSum = np.max(mobileRads) + np.max(referenceRads) + dst
 
+        neighbours = cKDTree(project(referencePos)).query_ball_point(project(mobilePos),max(maxSum,0.0))
 
+        nNeighbours = np.asarray([len(n) for n in neighbours],dtype=int)
+        i = np.repeat(np.arange(len(mobilePos)),nNeighbours)
+        j = np.concatenate([np.asarray(n,dtype=int) for n in neighbours]) if len(i) > 0 else np.zeros(0,dtype=int)
 
+        r  = mobilePos[i] - referencePos[j]
+        ru = r @ u
+        b2 = np.einsum("ij,ij->i",r,r) - ru*ru
+        S  = mobileRads[i] + referenceRads[j] + dst
 
+        valid = (S >= 0.0) & (b2 <= S*S)
+        if not np.any(valid):
+            self.logger.error(f"[setContactDistance] The mobile selection can not reach the contact distance {dst} "
+                              f"moving along the line joining the centers of the selections")
+            raise Exception("Contact distance can not be set")
 
+        t = np.max(-ru[valid] + np.sqrt(np.maximum(S[valid]**2 - b2[valid],0.0)))
 
+        translation = t*u
+        if inv:
+            translation = translation - 2.0*(mobCenter-refCenter)
 
+        self.transformIds(mobileIds,affineTransform.fromTranslation(translation))
@@ -2,6 +2,8 @@ from VLMP.components.modelOperations import modelOperationBase
 
 import numpy as np
 
+from VLMP.utils.geometry import affineTransform
+
 class setParticleLowestPosition(modelOperationBase):
     """
     {
@@ -81,7 +83,4 @@ class setParticleLowestPosition(modelOperationBase):
 
         translation = np.asarray([0,0,params["position"] - lowestPos + offset])
 
-        for i in range(len(selectedIds)):
-            pos[i] = pos[i] + translation
-
-        self.setIdsState(selectedIds,"position",pos.tolist())
+        self.transformIds(selectedIds,affineTransform.fromTranslation(translation))
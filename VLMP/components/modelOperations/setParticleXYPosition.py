@@ -2,6 +2,8 @@ from VLMP.components.modelOperations import modelOperationBase
 
 import numpy as np
 
+from VLMP.utils.geometry import affineTransform
+
 class setParticleXYPosition(modelOperationBase):
     """
     {
@@ -56,10 +58,9 @@ class setParticleXYPosition(modelOperationBase):
         targetPosition = params["position"]
 
         selectedIds = self.getSelection("selection")
-        pos = np.asarray(self.getIdsState(selectedIds,"position"))
 
-        for i in range(len(selectedIds)):
-            pos[i][0] = targetPosition[0]
-            pos[i][1] = targetPosition[1]
+        # x and y are replaced by the target position, z is kept (orientations are not changed)
+        transform = affineTransform(matrix      = np.diag([0.0,0.0,1.0]),
+                                    translation = [targetPosition[0],targetPosition[1],0.0])
 
-        self.setIdsState(selectedIds,"position",pos.tolist())
+        self.transformIds(selectedIds,transform)
@@ -649,18 +649,14 @@ class CORONAVIRUS(modelBase):
             tpy2radius[t[0]]=tRadius
             types.addType(name=tName,mass=tMass,radius=tRadius,charge=tCharge)
 
+        #State is stored as columns (id,position,direction)
         state = {}
-
-        state = {}
-        state["labels"]=["id","position","direction"]
-        state["data"]  =[]
-
-        for i,p,q in zip(self.lipidsIds,self.lipidsPositions,self.lipidsOrientations):
-            p=np.around(p,2)
-            state["data"].append([int(i),list(p),list(q)])
-        for i,p,q in zip(self.spikeIds,self.spikePositions,self.spikeOrientations):
-            p=np.around(p,2)
-            state["data"].append([int(i),list(p),list(q)])
+        state["id"]        = np.concatenate([np.asarray(self.lipidsIds).reshape(-1),
+                                             np.asarray(self.spikeIds).reshape(-1)])
+        state["position"]  = np.around(np.concatenate([np.asarray(self.lipidsPositions).reshape(-1,3),
+                                                       np.asarray(self.spikePositions).reshape(-1,3)]),2)
+        state["direction"] = np.concatenate([np.asarray(self.lipidsOrientations).reshape(-1,4),
+                                             np.asarray(self.spikeOrientations).reshape(-1,4)])
 
         structure={}
         structure["labels"] = ["id", "type", "modelId"]
@@ -807,7 +803,7 @@ class CORONAVIRUS(modelBase):
         #############################################################
         #############################################################
 
-        self.setState(state)
+        self.setStateColumns(state)
         self.setStructure(structure)
         self.setForceField(forceField)
 
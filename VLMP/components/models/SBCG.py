@@ -4,7 +4,6 @@ import copy
 
 import logging
 
-from ... import DEBUG_MODE
 from . import modelBase
 
 import pyGrained.models.SBCG as proteinModel
@@ -118,7 +117,7 @@ class SBCG(modelBase):
         sbcg = proteinModel.SBCG(name = name,
                                  inputPDBfilePath = inputPDBfilePath,
                                  params = sbcgParams,
-                                 debug = DEBUG_MODE)
+                                 debug = logging.getLogger("VLMP").isEnabledFor(logging.DEBUG))
 
         ########################################################
 
@@ -3,11 +3,16 @@ import copy
 
 import logging
 
+import numpy as np
+
 ################ MODEL INTERFACE ################
 
 import abc
 from pyUAMMD import simulation
 
+from .. import componentSimulation
+from .. import idsHandler
+
 from ...utils.input import getLabelIndex
 
 class modelBase(metaclass=abc.ABCMeta):
@@ -63,6 +68,16 @@ class modelBase(metaclass=abc.ABCMeta):
         self._structure  = None
         self._forceField = None
 
+        #Columnar state (label -> array), see setStateColumns
+        self._stateColumns = None
+
+        #Local and global ids (arrays), computed on demand
+        self._localIds  = None
+        self._globalIds = None
+
+        #Structure label -> inverted index, built on demand
+        self._structureIndex = {}
+
     ########################################################
 
     def getName(self):
@@ -85,20 +100,78 @@ class modelBase(metaclass=abc.ABCMeta):
     ########################################################
 
     def setState(self,state):
-        self._state = state
+        idsHandler._stateChanged(self)
+
+        self._state        = state
+        self._stateColumns = None
+
+        self._localIds  = None
+        self._globalIds = None
+
+    def setStateColumns(self,columns):
+        # Sets the state as a dictionary label -> array, with one row per particle,
+        # for example {"id":ids,"position":positions,"direction":directions} with shapes (N,), (N,3) and (N,4).
+        # The state is kept in this (compact) format until getState is called,
+        # then it is converted to the usual format (labels and list of lists) and stored in that format.
+        stateColumns = {}
+        for label,column in columns.items():
+            if label == "id":
+                stateColumns[label] = np.asarray(column,dtype=np.int32).reshape(-1)
+            elif label in ["position","direction"]:
+                stateColumns[label] = np.asarray(column,dtype=np.float64).reshape(len(column),-1)
+            else:
+                stateColumns[label] = np.asarray(column)
+
+        if "id" not in stateColumns:
+            self.logger.error(f"[Model] ({self._type}) Columnar state has no \"id\" column")
+            raise Exception(f"State is not valid")
+
+        N = len(stateColumns["id"])
+        for label,column in stateColumns.items():
+            if len(column) != N:
+                self.logger.error(f"[Model] ({self._type}) Column \"{label}\" of the state has {len(column)} rows, but there are {N} ids")
+                raise Exception(f"State is not valid")
+
+        idsHandler._stateChanged(self)
+
+        self._state        = None
+        self._stateColumns = stateColumns
+
+        self._localIds  = None
+        self._globalIds = None
+
+    def hasStateColumns(self):
+        return self._stateColumns is not None
 
     def setStructure(self,structure):
-        self._structure = structure
+        self._structure      = structure
+        self._structureIndex = {}
+
+        idsHandler._structureChanged(self)
 
     def setForceField(self,forceField):
         self._forceField = forceField
 
     def getState(self):
+        if self._stateColumns is not None:
+            #Conversion to the list of lists format, the state is stored in this format from here
+            labels  = list(self._stateColumns.keys())
+            columns = [column.tolist() for column in self._stateColumns.values()]
+
+            self._state        = {"labels":labels,"data":[list(row) for row in zip(*columns)]}
+            self._stateColumns = None
+
         if self._state is None:
             self.logger.error(f"[Model] ({self._type}) State not set")
             raise Exception(f"State not set")
         return self._state
 
+    def getStateLabels(self):
+        # Labels of the state, without converting a columnar state
+        if self._stateColumns is not None:
+            return list(self._stateColumns.keys())
+        return self.getState()["labels"]
+
     def getStructure(self):
         if self._structure is None:
             self.logger.error(f"[Model] ({self._type}) Structure not set")
@@ -111,24 +184,78 @@ class modelBase(metaclass=abc.ABCMeta):
             raise Exception(f"Force field not set")
         return self._forceField
 
+    def getStateColumn(self,label):
+        # Returns the state label as an array (one row per particle).
+        # If the state is columnar the array is the state itself, not a copy
+        if self._stateColumns is not None:
+            if label not in self._stateColumns:
+                self.logger.error(f"[Model] ({self._type}) Label \"{label}\" not in state")
+                raise Exception(f"Label not in state")
+            return self._stateColumns[label]
+
+        state      = self.getState()
+        labelIndex = getLabelIndex(label,state["labels"])
+        return np.asarray([s[labelIndex] for s in state["data"]])
+
+    def getStructureIndex(self,label):
+        # Returns a dictionary which maps each value of the structure label
+        # ("type","resId","chainId","modelId",...) to the (local) ids of the particles
+        # with that value, as a sorted array. The index is built the first time it is requested.
+        # It is meant for labels with few different values, not for "id" (one entry per particle)
+        if label not in self._structureIndex:
+
+            structure = self.getStructure()
+
+            idIndex    = getLabelIndex("id",structure["labels"])
+            labelIndex = getLabelIndex(label,structure["labels"])
+
+            ids    = np.asarray([s[idIndex]    for s in structure["data"]],dtype=int)
+            values = np.asarray([s[labelIndex] for s in structure["data"]])
+
+            index = {}
+            if len(ids) > 0:
+                uniqueValues,inverse = np.unique(values,return_inverse=True)
+                order  = np.argsort(inverse,kind="stable")
+                splits = np.cumsum(np.bincount(inverse,minlength=len(uniqueValues)))[:-1]
+                for value,valueIds in zip(uniqueValues.tolist(),np.split(ids[order],splits)):
+                    index[value] = np.sort(valueIds)
+
+            self._structureIndex[label] = index
+
+        return self._structureIndex[label]
+
     ########################################################
 
     def getNumberOfParticles(self):
+        if self._stateColumns is not None:
+            return len(self._stateColumns["id"])
         if self._state is None:
             return 0
         return len(self.getState()["data"])
 
+    def getLocalIdsArray(self):
+        # Local ids as a (read only) array, computed once for each state
+        if self._localIds is None:
+            if self._stateColumns is not None:
+                localIds = np.array(self._stateColumns["id"],dtype=int)
+            elif self._state is None:
+                localIds = np.zeros(0,dtype=int)
+            else:
+                state   = self.getState()
+                idIndex = getLabelIndex("id",state["labels"])
+                localIds = np.fromiter((entry[idIndex] for entry in state["data"]),dtype=int,count=len(state["data"]))
+
+            localIds.flags.writeable = False
+            self._localIds = localIds
+
+        return self._localIds
+
     def getLocalIds(self):
-        if self._state is None:
-            return []
-        ids = []
-        idIndex = getLabelIndex("id",self.getState()["labels"])
-        for entry in self.getState()["data"]:
-            ids.append(entry[idIndex])
-        return ids
+        return self.getLocalIdsArray().tolist()
 
     def setIdOffset(self,offset):
-        self._idOffset = offset
+        self._idOffset  = offset
+        self._globalIds = None
 
     def getIdOffset(self):
         if self._idOffset is None:
@@ -136,11 +263,18 @@ class modelBase(metaclass=abc.ABCMeta):
             raise Exception(f"Id offset not set")
         return self._idOffset
 
+    def getGlobalIdsArray(self):
+        # Global ids (local ids plus offset) as a (read only) array, computed once for each state and offset
+        if self._globalIds is None:
+            globalIds = self.getLocalIdsArray() + self.getIdOffset()
+
+            globalIds.flags.writeable = False
+            self._globalIds = globalIds
+
+        return self._globalIds
+
     def getGlobalIds(self):
-        globalIds = []
-        for localId in self.getLocalIds():
-            globalIds.append(localId + self.getIdOffset())
-        return globalIds
+        return self.getGlobalIdsArray().tolist()
 
     ########################################################
 
@@ -150,7 +284,7 @@ class modelBase(metaclass=abc.ABCMeta):
 
         sim = {}
 
-        if self._state is not None:
+        if self._state is not None or self._stateColumns is not None:
             sim["state"]  = self.getState()
 
         sim["topology"] = {}
@@ -159,7 +293,7 @@ class modelBase(metaclass=abc.ABCMeta):
         if self._forceField is not None:
             sim["topology"]["forceField"] = self.getForceField()
 
-        return simulation(copy.deepcopy(sim),DEBUG_MODE)
+        return componentSimulation(sim,DEBUG_MODE)
 
     @classmethod
     def __subclasshook__(cls, subclass):
@@ -172,17 +306,17 @@ class modelBase(metaclass=abc.ABCMeta):
         """ Return a index of the particles that are selected """
         raise NotImplementedError
 
-############### IMPORT ALL MODELS ###############
+############### REGISTER ALL MODELS ###############
+
+#The model modules are not imported here, they are registered and
+#imported the first time one of their components is requested
+
+from .. import componentsRegistry
 
-import glob
+_registry = componentsRegistry(__name__,"Model")
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-models = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-models = [x.split(".")[0] for x in models if "__" not in x]
+def __getattr__(name):
+    return _registry.getComponent(name)
 
-for m in models:
-    try:
-        exec(f"from .{m} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[Model] Error importing model type component {m}")
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
@@ -8,8 +8,7 @@ import logging
 from pyUAMMD import simulation
 
 from .. import idsHandler
-
-from ...utils.selections import processSelections
+from .. import componentSimulation
 
 class simulationStepBase(idsHandler):
 
@@ -87,8 +86,7 @@ class simulationStepBase(idsHandler):
         #Process selections
         selections = [sel for sel in params if sel in self.availableSelections]
         selections = {sel:params[sel] for sel in selections if sel in params.keys()}
-        self._selection = processSelections(self._models,
-                                            copy.deepcopy(selections))
+        self._selection = self._processSelections(selections)
 
         ########################################################
 
@@ -167,6 +165,12 @@ class simulationStepBase(idsHandler):
     ########################################################
 
     def getSelection(self,selectionName):
+        #Particles selections are given as lists of ids,
+        #selections of pairs, triples, ... as lists of lists of ids
+        return self._selection[selectionName].tolist()
+
+    def getSelectionArray(self,selectionName):
+        #Selection as a (read only) array, of shape (n,) or (n,k)
         return self._selection[selectionName]
 
     ########################################################
@@ -191,19 +195,19 @@ class simulationStepBase(idsHandler):
                 simulationStep["simulationStep"][sim]["parameters"]["group"] = self.getName()
             simulationStep["simulationStep"]["group"+self.getName()] = self._group
 
-        return simulation(copy.deepcopy(simulationStep),DEBUG_MODE)
+        return componentSimulation(simulationStep,DEBUG_MODE)
+
+############### REGISTER ALL SIMULATION STEPS ###############
+
+#The simulation step modules are not imported here, they are registered and
+#imported the first time one of their components is requested
 
-############### IMPORT ALL SIMULATION STEPS ###############
+from .. import componentsRegistry
 
-import glob
+_registry = componentsRegistry(__name__,"SimulationStep")
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-simulationSteps = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-simulationSteps = [x.split(".")[0] for x in simulationSteps if "__" not in x]
+def __getattr__(name):
+    return _registry.getComponent(name)
 
-for s in simulationSteps:
-    try:
-        exec(f"from .{s} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[SimulationStep] Error importing simulationStep type {s}")
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
@@ -56,19 +56,10 @@ class anglesMeasurement(simulationStepBase):
 
         parameters["outputFilePath"] = params["outputFilePath"]
 
-        selIds = self.getSelection("selection")
+        selIds = self.getSelectionArray("selection")
 
         #Check if selIds is a list of list of size 3
-        if isinstance(selIds,list):
-            for selId in selIds:
-                if isinstance(selId,list):
-                    if len(selId) != 3:
-                        self.logger.error("[anglesMeasurement] selection must be a list of list of size 3")
-                        raise Exception("Selection error")
-                else:
-                    self.logger.error("[anglesMeasurement] selection must be a list of list of size 3")
-                    raise Exception("Selection error")
-        else:
+        if selIds.size > 0 and (selIds.ndim != 2 or selIds.shape[1] != 3):
             self.logger.error("[anglesMeasurement] selection must be a list of list of size 3")
             raise Exception("Selection error")
 
@@ -77,7 +68,7 @@ class anglesMeasurement(simulationStepBase):
               "type":["ParticlesListMeasure","AnglesMeasure"],
               "parameters":{**parameters},
               "labels":["id_i","id_j","id_k"],
-              "data":selIds.copy()
+              "data":selIds.tolist()
             }
         }
 
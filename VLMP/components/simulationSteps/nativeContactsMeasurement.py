@@ -56,10 +56,14 @@ class nativeContactsMeasurement(simulationStepBase):
 
         parameters["outputFilePath"] = params["outputFilePath"]
 
-        selIds = self.getSelection("selection")
-        data = []
-        for i,j in selIds:
-            data.append([i,j])
+        selIds = self.getSelectionArray("selection")
+
+        #Check if selIds is a list of pairs
+        if selIds.size > 0 and (selIds.ndim != 2 or selIds.shape[1] != 2):
+            self.logger.error("[nativeContactsMeasurement] selection must be a list of pairs")
+            raise Exception("Selection error")
+
+        data = selIds.tolist()
 
         simulationStep = {
             name:{
@@ -71,19 +71,17 @@ class systemBase:
     def getSimulation(self,DEBUG_MODE = False):
         return simulation({"system":copy.deepcopy(self.getSystem())},DEBUG_MODE)
 
-############### IMPORT ALL SYSTEMS ###############
+############### REGISTER ALL SYSTEMS ###############
 
-import glob
+#The system modules are not imported here, they are registered and
+#imported the first time one of their components is requested
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-#Get file name, without full path
-systems = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-systems = [x.split(".")[0] for x in systems if "__" not in x]
+from .. import componentsRegistry
 
-for s in systems:
-    try:
-        exec(f"from .{s} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[System] Error importing system type component \"{s}\"")
+_registry = componentsRegistry(__name__,"System")
 
+def __getattr__(name):
+    return _registry.getComponent(name)
+
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
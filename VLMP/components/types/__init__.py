@@ -52,6 +52,8 @@ class typesBase:
         self._typesComp  = None
         self._typesDecl  = None
 
+        self._typesRecord = None
+
     ########################################################
 
     def getName(self):
@@ -106,7 +108,18 @@ class typesBase:
             raise Exception(f"Types components not set")
         return self._typesComp
 
+    def startTypesRecording(self):
+        self._typesRecord = []
+
+    def stopTypesRecording(self):
+        #Return all the types added since recording started
+        record = self._typesRecord
+        self._typesRecord = None
+        return record
+
     def addType(self, **components):
+        if self._typesRecord is not None:
+            self._typesRecord.append(copy.deepcopy(components))
         if self._typesComp is None:
             self.logger.error(f"[Types] ({self._type}) Types components not set for types {self._name}")
             raise Exception(f"Types components not set")
@@ -144,7 +157,7 @@ class typesBase:
                         raise Exception(f"Component not the same")
 
         if addT:
-            self.logger.debug(f"[Types] ({self._type}) Adding type {typeDecl['name']} for types {self._name}. Declaration: {typeDecl}")
+            self.logger.debug("[Types] (%s) Adding type %s for types %s. Declaration: %s",self._type,typeDecl['name'],self._name,typeDecl)
             self._typesDecl.append(copy.deepcopy(typeDecl))
 
     ########################################################
@@ -167,17 +180,17 @@ class typesBase:
                                      "labels":copy.deepcopy(labels),
                                      "data":copy.deepcopy(data)}}},DEBUG_MODE)
 
-############### IMPORT ALL TYPES ###############
+############### REGISTER ALL TYPES ###############
+
+#The types modules are not imported here, they are registered and
+#imported the first time one of their components is requested
+
+from .. import componentsRegistry
 
-import glob
+_registry = componentsRegistry(__name__,"Types")
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-types = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-types = [x.split(".")[0] for x in types if "__" not in x]
+def __getattr__(name):
+    return _registry.getComponent(name)
 
-for t in types:
-    try:
-        exec(f"from .{t} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[Types] Error importing types type component {t}")
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
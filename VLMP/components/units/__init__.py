@@ -89,17 +89,17 @@ class unitsBase:
     def getSimulation(self,DEBUG_MODE = False):
         return simulation({"global":{"units":{"type":["Units",self.getUnitsName()]}}},DEBUG_MODE)
 
-############### IMPORT ALL UNITS ###############
+############### REGISTER ALL UNITS ###############
 
-import glob
+#The units modules are not imported here, they are registered and
+#imported the first time one of their components is requested
 
-currentPath = os.path.dirname(os.path.abspath(__file__))
-units = [os.path.basename(x) for x in glob.glob(currentPath+"/*.py")]
-units = [x.split(".")[0] for x in units if "__" not in x]
+from .. import componentsRegistry
 
-for u in units:
-    try:
-        exec(f"from .{u} import *")
-    except Exception as e:
-        logging.getLogger("VLMP").error(e)
-        logging.getLogger("VLMP").error(f"[Units] Error importing units type component {u}")
+_registry = componentsRegistry(__name__,"Units")
+
+def __getattr__(name):
+    return _registry.getComponent(name)
+
+def __dir__():
+    return sorted(list(globals().keys()) + _registry.getComponentsNames())
@@ -0,0 +1,197 @@
+import os
+import logging
+
+import json
+import pickle
+import hashlib
+import inspect
+
+import tempfile
+
+import random
+import numpy as np
+
+#Packages used while the components are built, their versions are part of the key
+dependencies = ["pyVLMP","pyGrained","pyUAMMD","JFIO","numpy","scipy"]
+
+def getPackageVersion(packageName = "pyVLMP"):
+    try:
+        from importlib.metadata import version
+        return version(packageName)
+    except Exception:
+        return "unknown"
+
+def hashPackageTree(packagePath):
+    # Hash of all the files of the package (sources and data), except the compiled ones
+    h = hashlib.sha256()
+    for root,dirs,files in os.walk(packagePath):
+        dirs[:] = sorted([d for d in dirs if d != "__pycache__"])
+        for fileName in sorted(files):
+            if fileName.endswith((".pyc",".pyo")):
+                continue
+            filePath = os.path.join(root,fileName)
+            h.update(os.path.relpath(filePath,packagePath).encode())
+            h.update(hashFile(filePath).encode())
+    return h.hexdigest()
+
+def hashFile(filePath,blockSize=1<<20):
+    h = hashlib.sha256()
+    with open(filePath,"rb") as f:
+        for block in iter(lambda: f.read(blockSize),b""):
+            h.update(block)
+    return h.hexdigest()
+
+def getRandomState():
+    # State of the random number generators used by the components (random and np.random)
+    return (random.getstate(),np.random.get_state())
+
+def randomStatesEqual(state1,state2):
+    (py1,np1),(py2,np2) = state1,state2
+    if py1 != py2:
+        return False
+    return all([np.array_equal(v1,v2) for v1,v2 in zip(np1,np2)])
+
+class componentsCache:
+    """
+    On-disk cache of built components. Each entry is stored in its own file,
+    named after a hash of everything the component depends on:
+    component class (and its source), name, parameters, units, types, ensemble,
+    seed, the files of the VLMP package (sources and data) and the versions of VLMP
+    and its dependencies. Files given as parameters are hashed by content.
+    The types declared by the component when it was built are stored with it,
+    so they can be declared again when it is restored.
+    Only components which draw no random numbers while they are built are cached,
+    so using the cache does not change the generated components.
+    When the cache grows over maxSize (bytes) the least recently used entries are removed.
+    """
+
+    #Attributes which are not stored, they are given when the component is restored
+    notStoredAttributes = ["logger","_units","_types","_ensemble"]
+
+    def __init__(self,cacheDir,maxSize=10*1024**3):
+
+        self.logger = logging.getLogger("VLMP")
+
+        self.cacheDir = cacheDir
+        self.maxSize  = maxSize
+
+        if not os.path.isdir(self.cacheDir):
+            self.logger.info(f"[Cache] Creating cache folder \"{self.cacheDir}\"")
+            os.makedirs(self.cacheDir,exist_ok=True)
+
+        self.version      = {packageName:getPackageVersion(packageName) for packageName in dependencies}
+        self.packageHash  = hashPackageTree(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+        self.sourceHashes = {}
+
+        self.logger.info(f"[Cache] Using cache folder \"{self.cacheDir}\" (max size {self.maxSize/1024**2:.1f} MB)")
+
+    def __getSourceHash(self,componentClass):
+        if componentClass not in self.sourceHashes:
+            try:
+                self.sourceHashes[componentClass] = hashFile(inspect.getsourcefile(componentClass))
+            except Exception:
+                self.sourceHashes[componentClass] = "unknown"
+        return self.sourceHashes[componentClass]
+
+    def __getEntryPath(self,key):
+        return os.path.join(self.cacheDir,key+".pkl")
+
+    def getKey(self,componentClass,name,parameters,units,types,ensemble,seed):
+
+        def serialize(obj):
+            #Files given as parameters are identified by their content
+            if isinstance(obj,str) and os.path.isfile(obj):
+                return {"file":obj,"hash":hashFile(obj)}
+            if isinstance(obj,dict):
+                return {str(k):serialize(v) for k,v in obj.items()}
+            if isinstance(obj,(list,tuple)):
+                return [serialize(v) for v in obj]
+            return obj
+
+        keyInfo = {"class"     :f"{componentClass.__module__}.{componentClass.__qualname__}",
+                   "source"    :self.__getSourceHash(componentClass),
+                   "version"   :self.version,
+                   "package"   :self.packageHash,
+                   "name"      :name,
+                   "parameters":serialize(parameters),
+                   "units"     :units,
+                   "types"     :types,
+                   "ensemble"  :ensemble,
+                   "seed"      :seed}
+
+        keyInfo = json.dumps(keyInfo,sort_keys=True,default=repr)
+
+        return hashlib.sha256(keyInfo.encode()).hexdigest()
+
+    def load(self,key,componentClass,**attributes):
+
+        entryPath = self.__getEntryPath(key)
+
+        try:
+            with open(entryPath,"rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None,None
+        except Exception as e:
+            self.logger.warning(f"[Cache] Error loading cache entry {key} ({e}), ignoring it")
+            return None,None
+
+        #Mark the entry as recently used
+        try:
+            os.utime(entryPath)
+        except OSError:
+            pass
+
+        component = componentClass.__new__(componentClass)
+        component.__dict__.update(entry["state"])
+        component.logger = logging.getLogger("VLMP")
+        for attr,value in attributes.items():
+            setattr(component,attr,value)
+
+        return component,entry["declaredTypes"]
+
+    def store(self,key,component,declaredTypes):
+
+        entry = {"state":{k:v for k,v in component.__dict__.items() if k not in self.notStoredAttributes},
+                 "declaredTypes":declaredTypes}
+
+        try:
+            data = pickle.dumps(entry,protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            self.logger.warning(f"[Cache] Component \"{component.getName()}\" ({component.getType()}) can not be cached: {e}")
+            return
+
+        #Write to a temporary file and rename it, several processes can share the cache
+        fd,tmpPath = tempfile.mkstemp(dir=self.cacheDir,suffix=".tmp")
+        with os.fdopen(fd,"wb") as f:
+            f.write(data)
+        os.replace(tmpPath,self.__getEntryPath(key))
+
+        self.__evict()
+
+    def __evict(self):
+
+        entries = []
+        for entry in os.scandir(self.cacheDir):
+            if entry.name.endswith(".pkl"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime,stat.st_size,entry.path))
+
+        totalSize = sum([size for _,size,_ in entries])
+        if totalSize <= self.maxSize:
+            return
+
+        #Remove least recently used entries first
+        for _,size,path in sorted(entries):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            totalSize -= size
+            self.logger.debug(f"[Cache] Removed cache entry \"{path}\"")
+            if totalSize <= self.maxSize:
+                break
@@ -0,0 +1,157 @@
+import logging
+
+import numpy as np
+
+#Relative cost of the different terms, the unit is the integration of one particle during one step
+particleCost  = 1.0
+bondCost      = {"Bond1":1.0,"Bond2":1.0,"Bond3":1.5,"Bond4":2.0}
+pairCost      = 1.0
+setCost       = 1.0
+externalCost  = 1.0
+measureCost   = 1.0
+
+#Force field entries which do not add interactions
+ignoredForceFieldClasses = ["Groups","VerletConditionalListSet"]
+
+#Number of particles used to estimate the number of neighbours
+neighboursSampleSize = 1000
+#Used when the cut-off of a non-bonded potential can not be determined
+defaultNeighbours    = 32
+defaultCutOffFactor  = 2.5
+
+def getEntryData(entry,label):
+    if "labels" not in entry or label not in entry["labels"]:
+        return []
+    index = entry["labels"].index(label)
+    return [d[index] for d in entry.get("data",[])]
+
+def getNonBondedCutOff(entry):
+
+    parameters = entry.get("parameters",{})
+
+    if "cutOff" in parameters:
+        return parameters["cutOff"]
+
+    cutOff = getEntryData(entry,"cutOff")
+    if len(cutOff) > 0:
+        return max(cutOff)
+
+    cutOffFactor = parameters.get("cutOffFactor",defaultCutOffFactor)
+
+    sigma = getEntryData(entry,"sigma")
+    if len(sigma) > 0:
+        return cutOffFactor*max(sigma)
+    if "sigma" in parameters:
+        return cutOffFactor*parameters["sigma"]
+
+    radius = getEntryData(entry,"radius")
+    if len(radius) > 0:
+        return cutOffFactor*2.0*max(radius)
+
+    return None
+
+def getMeanNeighbours(positions,cutOff,seed = 0):
+
+    #Neighbours are counted for a sample of particles using the particles positions,
+    #which takes into account that particles are usually clustered (models) and not spread over the box.
+    #scipy is imported here, it is not needed if costs are not estimated
+    from scipy.spatial import cKDTree
+
+    N = positions.shape[0]
+    if N < 2:
+        return 0.0
+
+    tree = cKDTree(positions)
+
+    if N > neighboursSampleSize:
+        sample = np.random.default_rng(seed).choice(N,neighboursSampleSize,replace=False)
+    else:
+        sample = np.arange(N)
+
+    neighbours = tree.query_ball_point(positions[sample],cutOff,return_length=True)
+    #The particle itself is not a neighbour
+    return float(np.mean(neighbours)) - 1.0
+
+def estimateSimulationCost(sim):
+    """
+    Estimates the computational cost of a simulation from its merged topology.
+    The cost of one integration step is the sum of the cost of integrating the particles,
+    the bonded interactions (number of Bond1/2/3/4 entries), the non-bonded interactions
+    (particles times the mean number of neighbours within the cut-off), the sets and external potentials
+    and the simulation steps (particles divided by intervalStep). The total cost is the cost
+    of one step times the number of integration steps.
+    The estimation is relative, the unit is the integration of one particle during one step.
+    """
+
+    logger = logging.getLogger("VLMP")
+
+    N = sim.getNumberOfParticles()
+
+    cost = {"numberOfParticles":N,
+            "integrationSteps" :0,
+            "bonds"            :0,
+            "nonBondedPairs"   :0.0,
+            "sets"             :0,
+            "external"         :0,
+            "measures"         :0.0}
+
+    ################################################
+
+    positions = None
+    if "state" in sim and "position" in sim["state"]["labels"]:
+        positions = np.asarray(getEntryData(sim["state"],"position"),dtype=float)
+
+    forceField = sim["topology"].get("forceField",{}) if "topology" in sim else {}
+
+    bondsCost = 0.0
+    for entryName,entry in forceField.items():
+        entryClass = entry["type"][0]
+
+        if entryClass in ignoredForceFieldClasses:
+            continue
+
+        if entryClass in bondCost:
+            nBonds = len(entry.get("data",[]))
+            cost["bonds"] += nBonds
+            bondsCost     += bondCost[entryClass]*nBonds
+        elif entryClass == "NonBonded":
+            cutOff = getNonBondedCutOff(entry)
+            if cutOff is not None and positions is not None:
+                neighbours = getMeanNeighbours(positions,cutOff)
+            else:
+                logger.debug("[Cost] Cut-off of \"%s\" not found, using %d neighbours per particle",entryName,defaultNeighbours)
+                neighbours = min(defaultNeighbours,max(N-1,0))
+            cost["nonBondedPairs"] += N*neighbours
+        elif entryClass.startswith("Set"):
+            for label in entry.get("labels",[]):
+                if label.startswith("idSet"):
+                    cost["sets"] += sum([len(s) for s in getEntryData(entry,label)])
+        else:
+            #External, Surface, ... act over all the particles
+            cost["external"] += N
+
+    ################################################
+
+    if "integrator" in sim:
+        for integratorName,integrator in sim["integrator"].items():
+            if integrator["type"] == ["Schedule","Integrator"]:
+                cost["integrationSteps"] += sum(getEntryData(integrator,"steps"))
+
+    if "simulationStep" in sim:
+        for stepName,step in sim["simulationStep"].items():
+            intervalStep = step.get("parameters",{}).get("intervalStep",None)
+            if intervalStep is not None and intervalStep > 0:
+                cost["measures"] += N/intervalStep
+
+    ################################################
+
+    cost["costPerStep"] = (particleCost*N +
+                           bondsCost +
+                           pairCost*cost["nonBondedPairs"] +
+                           setCost*cost["sets"] +
+                           externalCost*cost["external"] +
+                           measureCost*cost["measures"])
+
+    cost["cost"] = cost["costPerStep"]*max(cost["integrationSteps"],1)
+
+    return cost
@@ -8,6 +8,8 @@ from pyquaternion import Quaternion
 
 from .bounds import *
 from .particlesDistribution import *
+from .cellList import *
+from .affineTransform import *
 
 #Geometry utils
 
@@ -0,0 +1,53 @@
+import numpy as np
+
+from scipy.spatial.transform import Rotation
+
+class affineTransform:
+    """
+    Affine transform of the positions of a set of particles, x -> matrix*x + translation.
+    If the transform rotates the particles (rotation is not None) their orientations
+    (direction quaternions, scalar first) are rotated too.
+    Transforms are composed with then, so several transforms are applied at once.
+    """
+
+    def __init__(self,matrix = None,translation = None,rotation = None):
+        self.matrix      = np.eye(3) if matrix is None else np.asarray(matrix,dtype=float)
+        self.translation = np.zeros(3) if translation is None else np.asarray(translation,dtype=float)
+        #scipy Rotation applied to the orientations, None if orientations are not changed
+        self.rotation    = rotation
+
+    @staticmethod
+    def fromTranslation(translation):
+        return affineTransform(translation = translation)
+
+    @staticmethod
+    def fromRotation(rotation,center):
+        #Rotation (scipy Rotation) around center
+        center = np.asarray(center,dtype=float)
+        matrix = rotation.as_matrix()
+        return affineTransform(matrix = matrix,translation = center - matrix @ center,rotation = rotation)
+
+    def then(self,other):
+        #Transform equivalent to applying self and then other
+        if self.rotation is None:
+            rotation = other.rotation
+        elif other.rotation is None:
+            rotation = self.rotation
+        else:
+            rotation = other.rotation*self.rotation
+
+        return affineTransform(matrix      = other.matrix @ self.matrix,
+                               translation = other.matrix @ self.translation + other.translation,
+                               rotation    = rotation)
+
+    def applyPositions(self,positions):
+        positions = np.asarray(positions,dtype=float).reshape(-1,3)
+        return positions @ self.matrix.T + self.translation
+
+    def applyDirections(self,directions):
+        directions = np.asarray(directions,dtype=float).reshape(-1,4)
+        if self.rotation is None or len(directions) == 0:
+            return directions
+        #scipy quaternions are scalar last
+        q = (self.rotation*Rotation.from_quat(directions[:,[1,2,3,0]])).as_quat()
+        return q[:,[3,0,1,2]]
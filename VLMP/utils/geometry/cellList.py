@@ -0,0 +1,307 @@
+import logging
+
+import numpy as np
+
+#Maximum number of (particle,neighbour slot) entries processed at once in a query
+cellListQueryChunk = 2**20
+#Maximum number of cells of the free space grid
+freeSpaceMaxCells  = 2**24
+#Maximum number of free space subcells, in each direction, marked around a particle
+freeSpaceMaxSpan   = 8
+
+class cellList:
+    """
+    Uniform cell list over the box (centered at the origin) used to pack particles without overlaps.
+    Particles are added in place, each cell stores the indices of its particles in a row of a
+    fixed width array, which is widened when a cell gets full. Overlap queries for a set of
+    particles are vectorized: the particles of the 27 neighbour cells are gathered and their
+    distances computed at once.
+    The cell side is at least cutOff, the total number of cells is bounded by the number of particles.
+    Optionally it keeps a finer grid (each cell divided in level^3 subcells) marking the subcells
+    which are completely inside a sphere of radius clearance around a particle, used to sample points in the free space.
+    """
+
+    def __init__(self,box,cutOff,nParticles,periodic = True):
+
+        self.logger = logging.getLogger("VLMP")
+
+        self.box      = np.asarray(box,dtype=float)
+        self.cutOff   = float(cutOff)
+        self.periodic = periodic
+
+        if not np.all(np.isfinite(self.box)) or np.any(self.box <= 0.0):
+            self.logger.error(f"[cellList] The box {box} is not valid, the cell list needs a finite box")
+            raise Exception("Box not valid")
+
+        nCells = np.maximum(np.floor(self.box/max(self.cutOff,np.finfo(float).tiny)),1).astype(int)
+
+        #Bound the total number of cells
+        maxCells = max(int(nParticles),27)
+        if np.prod(nCells.astype(float)) > maxCells:
+            scale  = (np.prod(nCells.astype(float))/maxCells)**(1.0/3.0)
+            nCells = np.maximum(np.floor(nCells/scale),1).astype(int)
+
+        self.nCells   = nCells
+        self.cellSize = self.box/self.nCells
+
+        #Neighbour cell offsets, without repetitions when there are less than 3 cells in a direction
+        offsets = [np.unique(np.mod([-1,0,1],n)) for n in self.nCells]
+        self.offsets = np.stack(np.meshgrid(*offsets,indexing="ij"),axis=-1).reshape(-1,3)
+
+        self.capacity = 8
+        self.cells    = np.full((int(np.prod(self.nCells)),self.capacity),-1,dtype=np.intp)
+        self.counts   = np.zeros(int(np.prod(self.nCells)),dtype=np.intp)
+
+        self.positions = np.zeros((max(int(nParticles),1),3),dtype=float)
+        self.radii     = np.zeros(max(int(nParticles),1),dtype=float)
+        self.n         = 0
+
+        self.freeSpaceLevel     = 0
+        self.freeSpaceClearance = 0.0
+        self.freeSpaceCells     = None
+        self.freeSpaceOffsets   = None
+        self.freeSpaceOccupied  = None
+
+        self.logger.debug(f"[cellList] Cell list with {self.nCells.tolist()} cells of size {self.cellSize.tolist()}")
+
+    def __cellCoordinates(self,positions):
+        #Positions are wrapped into the box, also in the non periodic case (distances are not wrapped then)
+        frac   = np.mod(positions/self.box + 0.5,1.0)
+        coords = np.floor(frac*self.nCells).astype(np.intp)
+        return np.minimum(coords,self.nCells-1)
+
+    def __linearIndex(self,coords,nCells = None):
+        if nCells is None:
+            nCells = self.nCells
+        return (coords[...,0]*nCells[1] + coords[...,1])*nCells[2] + coords[...,2]
+
+    def __grow(self,capacity):
+        cells = np.full((self.cells.shape[0],capacity),-1,dtype=np.intp)
+        cells[:,:self.capacity] = self.cells
+        self.cells    = cells
+        self.capacity = capacity
+
+    def __minimumImage(self,dr):
+        if self.periodic:
+            dr -= self.box*np.floor(dr/self.box + 0.5)
+        return dr
+
+    def __chunkSize(self):
+        return max(1,cellListQueryChunk//(len(self.offsets)*self.capacity))
+
+    def __clashes(self,positions,radii,radiusFactor):
+        #Clashing particles, positions has to be smaller than the query chunk
+        clashes = np.zeros(positions.shape[0],dtype=bool)
+
+        coords     = self.__cellCoordinates(positions)
+        neighbours = self.__linearIndex(np.mod(coords[:,None,:] + self.offsets[None,:,:],self.nCells))
+
+        members = self.cells[neighbours].reshape(positions.shape[0],-1)
+        rows,cols = np.nonzero(members >= 0)
+        if len(rows) == 0:
+            return clashes
+        others = members[rows,cols]
+
+        dr = self.__minimumImage(positions[rows] - self.positions[others])
+        d2 = np.einsum("ij,ij->i",dr,dr)
+
+        limit = radiusFactor*(radii[rows] + self.radii[others])
+        clashes[rows[d2 <= limit*limit]] = True
+
+        return clashes
+
+    def __markFreeSpace(self,positions):
+        if positions.shape[0] == 0 or len(self.freeSpaceOffsets) == 0:
+            return
+
+        frac   = np.mod(positions/self.box + 0.5,1.0)*self.freeSpaceCells
+        coords = np.minimum(np.floor(frac).astype(np.intp),self.freeSpaceCells-1)
+
+        chunk = max(1,cellListQueryChunk//len(self.freeSpaceOffsets))
+        for start in range(0,coords.shape[0],chunk):
+            marked = np.mod(coords[start:start+chunk,None,:] + self.freeSpaceOffsets[None,:,:],self.freeSpaceCells)
+            self.freeSpaceOccupied[self.__linearIndex(marked,self.freeSpaceCells).reshape(-1)] = True
+
+    ########################################################
+
+    def getNumberOfParticles(self):
+        return self.n
+
+    def getPositions(self):
+        return self.positions[:self.n]
+
+    def add(self,positions,radii):
+        """
+        Adds the particles with the given positions, (n,3), and radii, (n,), to the cell list.
+        """
+
+        positions = np.asarray(positions,dtype=float).reshape(-1,3)
+        radii     = np.asarray(radii,dtype=float).reshape(-1)
+
+        m = positions.shape[0]
+        if m == 0:
+            return
+
+        if self.n + m > self.positions.shape[0]:
+            size = max(2*self.positions.shape[0],self.n + m)
+            self.positions = np.concatenate([self.positions,np.zeros((size-self.positions.shape[0],3))])
+            self.radii     = np.concatenate([self.radii,np.zeros(size-self.radii.shape[0])])
+
+        indices = np.arange(self.n,self.n+m)
+
+        self.positions[indices] = positions
+        self.radii[indices]     = radii
+        self.n += m
+
+        cellIds = self.__linearIndex(self.__cellCoordinates(positions))
+
+        #Slot of each particle in its cell, particles sharing a cell take consecutive slots
+        order   = np.argsort(cellIds,kind="stable")
+        sortIds = cellIds[order]
+        starts  = np.flatnonzero(np.concatenate([[True],sortIds[1:] != sortIds[:-1]]))
+        rank    = np.arange(m) - np.repeat(starts,np.diff(np.append(starts,m)))
+        slots   = self.counts[sortIds] + rank
+
+        if slots.max() >= self.capacity:
+            self.__grow(max(2*self.capacity,int(slots.max())+1))
+
+        self.cells[sortIds,slots] = indices[order]
+        self.counts[sortIds[starts]] += np.diff(np.append(starts,m))
+
+        if self.freeSpaceOccupied is not None:
+            self.__markFreeSpace(positions)
+
+    def overlaps(self,positions,radii,radiusFactor = 1.0):
+        """
+        Returns True if any of the given particles, positions (n,3) and radii (n,),
+        is at a distance smaller or equal than radiusFactor*(r1+r2) of a particle of the cell list.
+        Only distances up to the cut-off of the cell list are checked.
+        """
+
+        if self.n == 0:
+            return False
+
+        positions = np.asarray(positions,dtype=float).reshape(-1,3)
+        radii     = np.asarray(radii,dtype=float).reshape(-1)
+
+        chunk = self.__chunkSize()
+        for start in range(0,positions.shape[0],chunk):
+            if np.any(self.__clashes(positions[start:start+chunk],radii[start:start+chunk],radiusFactor)):
+                return True
+
+        return False
+
+    def firstFree(self,candidates,radii,radiusFactor = 1.0):
+        """
+        Given several candidate placements of the same set of particles, candidates (K,n,3),
+        with radii (n,), returns the index of the first candidate which does not overlap
+        (see overlaps) with the particles of the cell list, or -1 if all of them overlap.
+        The candidates are checked together, in groups of increasing size up to the query chunk.
+        """
+
+        candidates = np.asarray(candidates,dtype=float)
+        radii      = np.asarray(radii,dtype=float).reshape(-1)
+
+        K,n = candidates.shape[0],candidates.shape[1]
+        if K == 0:
+            return -1
+        if self.n == 0:
+            return 0
+
+        maxGroup = self.__chunkSize()//max(n,1)
+        if maxGroup < 2:
+            for k in range(K):
+                if not self.overlaps(candidates[k],radii,radiusFactor):
+                    return k
+            return -1
+
+        #Groups grow geometrically, few candidates are checked when the first ones are free
+        start = 0
+        group = 1
+        while start < K:
+            cand = candidates[start:start+group]
+            g    = cand.shape[0]
+
+            clashes = self.__clashes(cand.reshape(-1,3),np.tile(radii,g),radiusFactor).reshape(g,n)
+            free    = np.flatnonzero(~np.any(clashes,axis=1))
+            if len(free) > 0:
+                return start + int(free[0])
+
+            start += g
+            group  = min(2*group,maxGroup)
+
+        return -1
+
+    ########################################################
+
+    def getMaxFreeSpaceLevel(self):
+        #Largest power of two level such that the free space grid is not larger than freeSpaceMaxCells
+        level = 1
+        while np.prod(self.nCells.astype(float))*(2*level)**3 <= freeSpaceMaxCells:
+            level *= 2
+        return level
+
+    def getFreeSpaceLevel(self):
+        return self.freeSpaceLevel
+
+    def setFreeSpace(self,level,clearance):
+        """
+        Divides each cell in level^3 subcells and marks as occupied the ones whose points are all
+        at a distance smaller than clearance of a particle of the cell list (up to freeSpaceMaxSpan subcells
+        away from the particle). The particles added later are marked as they are added.
+        The grid is only rebuilt if the level or the clearance change, level 0 removes it.
+        """
+
+        level = int(level)
+        if level == self.freeSpaceLevel and clearance == self.freeSpaceClearance:
+            return
+
+        self.freeSpaceLevel     = max(level,0)
+        self.freeSpaceClearance = clearance
+
+        if level <= 0:
+            self.freeSpaceCells    = None
+            self.freeSpaceOffsets  = None
+            self.freeSpaceOccupied = None
+            return
+
+        self.freeSpaceCells = self.nCells*level
+
+        #The particle can be anywhere in its subcell, a subcell at offset o is completely inside
+        #the clearance sphere if (|o|+sqrt(3))*subcellSize <= clearance
+        subcellSize = np.max(self.box/self.freeSpaceCells)
+        span    = max(min(int(np.floor(clearance/subcellSize)),freeSpaceMaxSpan),0)
+        offsets = np.stack(np.meshgrid(*[np.arange(-span,span+1)]*3,indexing="ij"),axis=-1).reshape(-1,3)
+        self.freeSpaceOffsets = offsets[(np.linalg.norm(offsets,axis=1)+np.sqrt(3.0))*subcellSize <= clearance]
+
+        self.freeSpaceOccupied = np.zeros(int(np.prod(self.freeSpaceCells)),dtype=bool)
+        self.__markFreeSpace(self.getPositions())
+
+        self.logger.debug(f"[cellList] Free space grid with {self.freeSpaceCells.tolist()} cells (clearance {clearance}), "
+                          f"{np.count_nonzero(~self.freeSpaceOccupied)} free")
+
+    def getFreeSpacePoints(self,n):
+        """
+        Returns n random points (in the box) in subcells of the free space grid not occupied by any particle,
+        none if all the subcells are occupied. The free space level has to be set first.
+        """
+
+        if self.freeSpaceOccupied is None:
+            self.logger.error(f"[cellList] Free space points requested but the free space level is not set")
+            raise Exception("Free space level not set")
+
+        nFine = self.freeSpaceOccupied.shape[0]
+
+        #Random subcells are tried first, if most of them are occupied the free ones are listed
+        subcells = np.random.randint(0,nFine,size=8*n)
+        subcells = subcells[~self.freeSpaceOccupied[subcells]][:n]
+        if len(subcells) < n:
+            free = np.flatnonzero(~self.freeSpaceOccupied)
+            if len(free) == 0:
+                return np.zeros((0,3),dtype=float)
+            subcells = free[np.random.randint(0,len(free),size=n)]
+
+        coords = np.stack(np.unravel_index(subcells,self.freeSpaceCells),axis=-1)
+        frac   = (coords + np.random.uniform(size=coords.shape))/self.freeSpaceCells
+
+        return (frac - 0.5)*self.box
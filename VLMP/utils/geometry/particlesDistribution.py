@@ -4,6 +4,8 @@ from MDAnalysis.lib.pkdtree import PeriodicKDTree
 
 import numpy as np
 
+from .cellList import cellList
+
 def distributeRandomlyGeneratorChecker(box,posSets,radSets,newPosGenerator,distanceChecker,nMaxTries,radiusFactor):
 
     logger = logging.getLogger("VLMP")
@@ -23,7 +25,7 @@ def distributeRandomlyGeneratorChecker(box,posSets,radSets,newPosGenerator,dista
 
             transVec = mp - center
             newPositions += [list(p + transVec) for p in posSets[i]]
-            addedRads+=radSets[i]
+            addedRads.extend(radSets[i])
             logger.debug(f"Added particle 1/{len(posSets)}")
             continue
 
@@ -61,7 +63,7 @@ def distributeRandomlyGeneratorChecker(box,posSets,radSets,newPosGenerator,dista
                     break
             if toAdd:
                 newPositions += [list(p) for p in tentativePos]
-                addedRads    += radSets[i]
+                addedRads.extend(radSets[i])
                 added = True
                 logger.debug(f"Added particle {i+1}/{len(posSets)} at try {tries}/{nMaxTries}")
             else:
@@ -73,3 +75,293 @@ def distributeRandomlyGeneratorChecker(box,posSets,radSets,newPosGenerator,dista
 
     return newPositions.copy()
 
+
+def distributeRandomlyCellList(box,posSets,radSets,newPosGenerator,nMaxTries,radiusFactor,periodic = True):
+    #Same as distributeRandomlyGeneratorChecker, but the accepted particles are stored in a cell list
+    #which is updated as the sets are added, and each tentative set is checked at once against it.
+    #Two particles clash if their distance is smaller or equal than radiusFactor*(r1+r2)
+    #(minimum image convention if periodic).
+
+    logger = logging.getLogger("VLMP")
+
+    nParticles = sum([len(p) for p in posSets])
+    maxRadius  = np.max([np.max(r) for r in radSets])
+
+    grid = cellList(box,radiusFactor*2.0*maxRadius,nParticles,periodic)
+
+    for i in range(len(posSets)):
+        #Trying to find a new position for the particle set i
+
+        pos = np.asarray(posSets[i],dtype=float)
+        rad = np.asarray(radSets[i],dtype=float)
+
+        center = np.mean(pos,axis=0)
+
+        added = False
+        tries = 0
+        while not added and tries < nMaxTries:
+            # Generate a random position
+            mp = newPosGenerator()
+
+            tentativePos = pos + (mp - center)
+
+            if not grid.overlaps(tentativePos,rad,radiusFactor):
+                grid.add(tentativePos,rad)
+                added = True
+                logger.debug(f"Added particle {i+1}/{len(posSets)} at try {tries}/{nMaxTries}")
+            else:
+                tries += 1
+
+        if not added:
+            logger.error("The number of tries to avoid clashes has been reached.")
+            raise Exception("Clash avoidance failed")
+
+    return grid.getPositions().tolist()
+
+def distributeRandomlyCellListBatched(box,posSets,radSets,newPosBatchGenerator,nMaxTries,radiusFactor,
+                                      periodic = True,batchSize = 64,randomRotation = False,
+                                      insideDomain = None,fallbackBatches = 4):
+    #Batched version of distributeRandomlyCellList. For each set, batchSize candidate positions
+    #(newPosBatchGenerator(batchSize) returns a (batchSize,3) array), and random rotations around
+    #the center of the set if randomRotation, are checked at once against the cell list,
+    #the first candidate without clashes is accepted. Each candidate counts as a try.
+    #
+    #Adaptive fallback: after fallbackBatches consecutive failed batches the candidate positions are sampled
+    #from the free space grid of the cell list, points farther than a clearance from all the added particles.
+    #The clearance goes, in successive fallback stages, from the one at which any set fits in any orientation,
+    #the largest max_j(radiusFactor*(maxRadius+r_j)+|x_j-center|) over the sets, to the one that any position
+    #where a set fits has, the smallest max_j(radiusFactor*(minRadius+r_j)-|x_j-center|) over the sets.
+    #The clearances are the same for all the sets, so the free space grid is built once per stage.
+    #The subcells of the free space grid are a fraction of the clearance,
+    #so the grid gets finer as the clearance decreases. A stage is skipped if it has no free space.
+    #Free space points are filtered by insideDomain (function returning a boolean mask for an array of points), if given.
+    #The stage reached is kept for the next sets.
+
+    from scipy.spatial.transform import Rotation
+
+    logger = logging.getLogger("VLMP")
+
+    nParticles = sum([len(p) for p in posSets])
+    maxRadius  = np.max([np.max(r) for r in radSets])
+    minRadius  = np.min([np.min(r) for r in radSets])
+
+    grid = cellList(box,radiusFactor*2.0*maxRadius,nParticles,periodic)
+
+    cellSize = np.min(grid.cellSize)
+    maxLevel = grid.getMaxFreeSpaceLevel()
+
+    def getLevel(clearance):
+        #Subcells smaller than a quarter of the clearance, if possible
+        level = 1
+        while level < maxLevel and cellSize/level > clearance/4.0:
+            level *= 2
+        return level
+
+    #Clearances of the fallback stages, common to all the sets
+    maxClearance = 0.0
+    minClearance = np.inf
+    for pos,rad in zip(posSets,radSets):
+        pos = np.asarray(pos,dtype=float)
+        rad = np.asarray(rad,dtype=float)
+        dst = np.linalg.norm(pos - np.mean(pos,axis=0),axis=1)
+
+        maxClearance = max(maxClearance,float(np.max(radiusFactor*(maxRadius+rad) + dst)))
+        minClearance = min(minClearance,float(np.max(radiusFactor*(minRadius+rad) - dst)))
+    minClearance = max(minClearance,0.0)
+
+    #Fraction of the way from the largest to the smallest clearance of each fallback stage
+    stages     = [0.0,0.5,0.75,1.0]
+    clearances = [maxClearance + f*(minClearance - maxClearance) for f in stages]
+    stage      = 0 # 0 means no fallback
+
+    for i in range(len(posSets)):
+        #Trying to find a new position for the particle set i
+
+        pos = np.asarray(posSets[i],dtype=float)
+        rad = np.asarray(radSets[i],dtype=float)
+
+        relPos = pos - np.mean(pos,axis=0)
+
+        added  = False
+        tries  = 0
+        failed = 0
+        while not added and tries < nMaxTries:
+
+            K = min(batchSize,nMaxTries-tries)
+
+            points = None
+            if stage > 0:
+                clearance = clearances[stage-1]
+                grid.setFreeSpace(getLevel(clearance),clearance)
+                points = grid.getFreeSpacePoints(K)
+                if insideDomain is not None and len(points) > 0:
+                    points = points[insideDomain(points)]
+
+                if len(points) == 0 and stage < len(stages):
+                    stage += 1
+                    logger.debug(f"Set {i+1}/{len(posSets)}, no free space, sampling the free space at stage {stage}")
+                    continue
+
+            if points is None or len(points) == 0:
+                points = np.asarray(newPosBatchGenerator(K),dtype=float).reshape(-1,3)
+
+            if randomRotation:
+                R = Rotation.random(len(points)).as_matrix()
+                candidates = np.einsum("kij,nj->kni",R,relPos) + points[:,None,:]
+            else:
+                candidates = relPos[None,:,:] + points[:,None,:]
+
+            k = grid.firstFree(candidates,rad,radiusFactor)
+            if k >= 0:
+                grid.add(candidates[k],rad)
+                added = True
+                logger.debug(f"Added particle {i+1}/{len(posSets)} at try {tries+k}/{nMaxTries} (fallback stage {stage})")
+            else:
+                tries  += len(points)
+                failed += 1
+                if failed >= fallbackBatches and stage < len(stages):
+                    stage += 1
+                    failed = 0
+                    logger.debug(f"Set {i+1}/{len(posSets)}, sampling the free space at stage {stage}")
+
+        if not added:
+            logger.error("The number of tries to avoid clashes has been reached.")
+            raise Exception("Clash avoidance failed")
+
+    return grid.getPositions().tolist()
+
+#Lattices: side of the conventional cell (in units of the nearest neighbour distance) and fractional basis
+availableLattices = {"cubic":(np.array([1.0,1.0,1.0]),
+                              np.array([[0.0,0.0,0.0]])),
+                     "fcc"  :(np.array([1.0,1.0,1.0])*np.sqrt(2.0),
+                              np.array([[0.0,0.0,0.0],[0.5,0.5,0.0],[0.5,0.0,0.5],[0.0,0.5,0.5]])),
+                     "hcp"  :(np.array([1.0,np.sqrt(3.0),2.0*np.sqrt(2.0/3.0)]),
+                              np.array([[0.0,0.0,0.0],[0.5,0.5,0.0],[0.5,1.0/6.0,0.5],[0.0,2.0/3.0,0.5]]))}
+
+def latticeNearestDistance(cellSide,basis):
+    #Distance between the nearest sites of a lattice with the given (per axis) cell side,
+    #sites of the cell are compared with the sites of the cell and its neighbour cells
+    offsets = np.stack(np.meshgrid(*[np.arange(-1,2)]*3,indexing="ij"),axis=-1).reshape(-1,1,3)
+    sites   = ((offsets + basis[None,:,:])*cellSide).reshape(-1,3)
+    dist    = np.linalg.norm(basis[:,None,:]*cellSide - sites[None,:,:],axis=2)
+    return float(np.min(dist[dist > 0.0]))
+
+def latticeCellsInBox(box,cellSide,basis):
+    #Number of cells of the lattice along each axis of the box and the basis used. Along the axes where the box
+    #is smaller than a cell a single layer of cells is used, with only the sites of the basis in that layer
+    nCells = np.floor(box/cellSide).astype(int)
+    layer  = nCells < 1
+    return np.maximum(nCells,1),basis[np.all(basis[:,layer] == 0.0,axis=1)],layer
+
+def sampleWithoutReplacement(n,k):
+    #k different random integers in [0,n), O(k) when n is much larger than k
+    if n <= 4*k:
+        return np.random.permutation(n)[:k]
+
+    chosen = np.unique(np.random.randint(0,n,size=2*k))
+    while len(chosen) < k:
+        chosen = np.unique(np.concatenate([chosen,np.random.randint(0,n,size=2*k)]))
+    return np.random.permutation(chosen)[:k]
+
+def distributeOnLattice(box,posSets,radSets,lattice,radiusFactor,
+                        spacing = None,jitter = 0.0,center = None,radius = None):
+    #Places the center of each set on a site of a cubic, fcc or hcp lattice, randomly chosen among the available ones.
+    #The nearest neighbour distance of the lattice is, by default, twice the largest bounding radius of the sets,
+    #so sets do not clash whatever their orientation. Each set is displaced randomly (uniformly in a ball) up to
+    #jitter times half the room left between neighbour sets (nearest sites distance minus twice the largest
+    #bounding radius), which keeps them clash free. The default spacing leaves almost no room, jitter
+    #only has effect if the spacing is larger or the cell is stretched.
+    #If center and radius are not given the lattice fills the (periodic) box, its cell is stretched to fit the box.
+    #Along the axes where the box is smaller than a cell, a single layer of the lattice is used, only the sites
+    #of the basis in that layer are kept and the cell side is the box side (a cubic lattice is used instead if it has
+    #more sites). Otherwise only the sites whose sets (displaced by the jitter) are completely inside the sphere are used.
+    #Fails only if there are not enough sites. Cost is linear in the number of particles.
+
+    logger = logging.getLogger("VLMP")
+
+    if lattice not in availableLattices:
+        logger.error(f"Lattice {lattice} not recognized, available lattices are: {list(availableLattices.keys())}")
+        raise Exception("Lattice not recognized")
+
+    nSets = len(posSets)
+
+    sizes  = np.asarray([len(p) for p in posSets])
+    starts = np.concatenate([[0],np.cumsum(sizes)[:-1]])
+
+    pos = np.concatenate([np.asarray(p,dtype=float).reshape(-1,3) for p in posSets])
+    rad = np.concatenate([np.asarray(r,dtype=float).reshape(-1) for r in radSets])
+
+    centers = np.add.reduceat(pos,starts,axis=0)/sizes[:,None]
+
+    #Two sets whose centers are farther than the sum of their bounding radii do not clash, in any orientation
+    relPos = pos - np.repeat(centers,sizes,axis=0)
+    boundingRadius    = np.maximum.reduceat(np.linalg.norm(relPos,axis=1) + radiusFactor*rad,starts)
+    maxBoundingRadius = float(np.max(boundingRadius))
+
+    if spacing is None:
+        #Slightly larger, sets placed exactly at the bounding distance would touch
+        spacing = 2.0*maxBoundingRadius*(1.0+1e-6)
+    elif spacing < 2.0*maxBoundingRadius:
+        logger.warning(f"Lattice spacing {spacing} is smaller than twice the largest bounding radius of the sets "
+                       f"({2.0*maxBoundingRadius}), sets could clash")
+
+    cellSide,basis = availableLattices[lattice]
+    cellSide = cellSide*spacing
+
+    if center is None or radius is None:
+        box = np.asarray(box,dtype=float)
+
+        nCells,basis,layer = latticeCellsInBox(box,cellSide,basis)
+        if np.any(layer):
+            logger.debug(f"The box {box.tolist()} is smaller than a cell of the {lattice} lattice "
+                         f"with spacing {spacing} ({cellSide.tolist()}), using a single layer of sites along "
+                         f"{[axis for axis,l in zip('xyz',layer) if l]}")
+
+            cubicCellSide,cubicBasis = availableLattices["cubic"]
+            cubicCells,cubicBasis,layer = latticeCellsInBox(box,cubicCellSide*spacing,cubicBasis)
+            if np.prod(cubicCells) > np.prod(nCells)*len(basis):
+                logger.debug("Using a cubic lattice, it has more sites")
+                nCells,basis = cubicCells,cubicBasis
+
+            if np.any(box[layer] < 2.0*maxBoundingRadius):
+                logger.warning(f"The box {box.tolist()} is smaller than twice the largest bounding radius of the sets "
+                               f"({2.0*maxBoundingRadius}), sets could clash with their periodic images")
+        cellSide = box/nCells
+
+        maxDisplacement = jitter*max(latticeNearestDistance(cellSide,basis) - 2.0*maxBoundingRadius,0.0)/2.0
+
+        nSites = int(np.prod(nCells))*len(basis)
+        if nSets > nSites:
+            logger.error(f"The box can hold {nSites} sets in a {lattice} lattice with spacing {spacing}, "
+                         f"but there are {nSets} sets")
+            raise Exception("Not enough lattice sites")
+
+        sites = sampleWithoutReplacement(nSites,nSets)
+        cells = np.stack(np.unravel_index(sites//len(basis),nCells),axis=-1)
+        sites = (cells + basis[sites%len(basis)])*cellSide - box/2.0
+    else:
+        center = np.asarray(center,dtype=float)
+
+        maxDisplacement = jitter*max(latticeNearestDistance(cellSide,basis) - 2.0*maxBoundingRadius,0.0)/2.0
+
+        nCells = np.ceil(2.0*radius/cellSide).astype(int) + 1
+        cells  = np.stack(np.meshgrid(*[np.arange(n) for n in nCells],indexing="ij"),axis=-1).reshape(-1,1,3)
+        sites  = ((cells + basis[None,:,:])*cellSide).reshape(-1,3)
+        sites  = sites - np.mean(sites,axis=0) + center
+
+        sites = sites[np.linalg.norm(sites - center,axis=1) <= radius - maxBoundingRadius - maxDisplacement]
+        if nSets > len(sites):
+            logger.error(f"The sphere can hold {len(sites)} sets in a {lattice} lattice with spacing {spacing}, "
+                         f"but there are {nSets} sets")
+            raise Exception("Not enough lattice sites")
+
+        sites = sites[sampleWithoutReplacement(len(sites),nSets)]
+
+    if maxDisplacement > 0.0:
+        direction = np.random.normal(size=(nSets,3))
+        direction = direction/np.linalg.norm(direction,axis=1)[:,None]
+        sites = sites + direction*(maxDisplacement*np.random.uniform(size=nSets)**(1.0/3.0))[:,None]
+
+    logger.debug(f"Placing {nSets} sets on a {lattice} lattice with spacing {spacing}")
+
+    return (relPos + np.repeat(sites,sizes,axis=0)).tolist()
@@ -0,0 +1,147 @@
+import sys
+import time
+import logging
+
+import json
+import tracemalloc
+
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+def getMaxRSS():
+    #Peak resident memory of the process in bytes (ru_maxrss is given in kilobytes in Linux, bytes in macOS),
+    #None if it is not available (resource is not available in Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss
+    return maxrss*1024
+
+class profiler:
+    """
+    Records the wall time and the peak memory of the phases of a VLMP session.
+    Phases are identified by a name ("loadSimulationPool", "component/models/WLC/WLC", ...),
+    when a phase is executed several times its calls are accumulated.
+    The peak resident memory of the process at the end of the phase is always recorded.
+    If traceMemory is set, the peak of the memory allocated by Python during the phase is recorded too
+    (traced with tracemalloc, which slows down the phases). Tracing starts with the first phase
+    and it is stopped when the profile is reported. It requires Python 3.9 or later.
+    Phases can be nested, the time and memory of a phase include the ones of its subphases.
+    """
+
+    def __init__(self,enabled = False,traceMemory = False):
+
+        self.logger = logging.getLogger("VLMP")
+
+        self.enabled = enabled
+
+        self.traceMemory = enabled and traceMemory
+        if self.traceMemory and not hasattr(tracemalloc,"reset_peak"):
+            self.logger.warning("[Profiler] Memory tracing requires Python 3.9 or later, it is disabled")
+            self.traceMemory = False
+        #Whether tracemalloc has been started by the profiler (and then it has to stop it)
+        self.tracing = False
+
+        self.phases = {}
+        self.stack  = []
+
+    def addPhase(self,phaseName,wallTime,peakMemory = None):
+        if phaseName not in self.phases:
+            self.phases[phaseName] = {"calls":0,"wallTime":0.0,"peakMemory":None,"maxRSS":None}
+
+        phase = self.phases[phaseName]
+
+        phase["calls"]    += 1
+        phase["wallTime"] += wallTime
+        if peakMemory is not None:
+            phase["peakMemory"] = max(peakMemory,phase["peakMemory"] or 0)
+        phase["maxRSS"] = getMaxRSS()
+
+    def __getTracedPeak(self):
+        if not tracemalloc.is_tracing():
+            return 0
+        return tracemalloc.get_traced_memory()[1]
+
+    def stopMemoryTracing(self):
+        if self.tracing:
+            tracemalloc.stop()
+            self.tracing = False
+
+    @contextmanager
+    def __phase(self,phaseName):
+
+        if not self.traceMemory:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                self.addPhase(phaseName,time.perf_counter() - start)
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+
+        #The parent phase keeps its peak, the tracemalloc peak is reset for the new phase
+        if len(self.stack) > 0:
+            self.stack[-1] = max(self.stack[-1],self.__getTracedPeak())
+        tracemalloc.reset_peak()
+
+        self.stack.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            wallTime = time.perf_counter() - start
+            peak     = max(self.stack.pop(),self.__getTracedPeak())
+            if len(self.stack) > 0:
+                self.stack[-1] = max(self.stack[-1],peak)
+
+            self.addPhase(phaseName,wallTime,peak)
+
+    def phase(self,phaseName):
+        if not self.enabled:
+            return nullcontext()
+        return self.__phase(phaseName)
+
+    ########################################################
+
+    def getReport(self):
+        return {"phases":self.phases,
+                "maxRSS":getMaxRSS()}
+
+    def write(self,filePath):
+        if not self.enabled:
+            return
+
+        self.stopMemoryTracing()
+
+        with open(filePath,"w") as f:
+            json.dump(self.getReport(),f,indent=4)
+
+        self.logger.info(f"[Profiler] Profile written to \"{filePath}\"")
+
+    def logSummary(self):
+        if not self.enabled:
+            return
+
+        self.stopMemoryTracing()
+
+        def toMB(mem):
+            if mem is None:
+                return "-"
+            return f"{mem/1024**2:.1f}"
+
+        nameWidth = max([len(name) for name in self.phases.keys()] + [len("Phase")])
+
+        lines = []
+        lines.append(f"{'Phase':<{nameWidth}} {'Calls':>8} {'Time (s)':>10} {'Peak (MB)':>10} {'Max RSS (MB)':>13}")
+        lines.append("-"*len(lines[0]))
+        for name,phase in sorted(self.phases.items(),key=lambda p: -p[1]["wallTime"]):
+            lines.append(f"{name:<{nameWidth}} {phase['calls']:>8} {phase['wallTime']:>10.3f} "
+                         f"{toMB(phase['peakMemory']):>10} {toMB(phase['maxRSS']):>13}")
+
+        self.logger.info("[Profiler] Summary:\n"+"\n".join(lines))
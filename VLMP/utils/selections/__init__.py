@@ -1,9 +1,15 @@
+import re
 import logging
-import copy
+
+import numpy as np
 
 from .commonSelections import availableCommonSelections
 from .commonSelections import processCommonSelection
 
+from .spatialSelections import availableSpatialSelections
+from .spatialSelections import comparisonOperators
+from .spatialSelections import spatialSelectionsData
+
 def selectionListType(selectionList):
 
     logger = logging.getLogger("VLMP")
@@ -30,282 +36,412 @@ def selectionListType(selectionList):
         logger.error(f"[ProcessSelections] Selection list \"{selectionList}\" is not correct. Only lists of integers are allowed")
         raise Exception("Selection list is not correct")
 
-def extractDeepestParentheses(tokens):
+# Selection expressions are compiled into a tree, whose nodes are tuples:
+# ("all",), ("none",), ("not",node), ("and",node,node), ("or",node,node)
+# ("model",modelName,modifier,selectionType,selectionOptions) and the spatial selections:
+# ("within",distance,node), ("coordinate",axis,operator,value), ("sphere",center,radius),
+# ("box",lower,upper) and ("slab",axis,lower,upper).
+# "not" binds tighter than "and", which binds tighter than "or".
+# Spatial selections keywords (see spatialSelections) are only keywords if they are not the name of a model.
+# Comparison operators are only split from the token after an axis keyword ("z>10", "z >10").
+# Compiled expressions only depend on the models names that are spatial keywords,
+# they are cached by expression and those names
 
-    logger = logging.getLogger("VLMP")
+specialSelections = ["all","none"]
+modifiers         = ["not"]
+logicalOperators  = ["and","or","(",")"]
 
-    maxDepth     = 0
-    currentDepth = 0
+compiledSelections = {}
 
-    for tk in tokens:
-        if tk == '(':
-            currentDepth += 1
-            if currentDepth > maxDepth:
-                maxDepth = currentDepth
-        elif tk == ')':
-            currentDepth -= 1
+def tokenizeSelection(expr):
+    expr = expr.replace("("," ( ")
+    expr = expr.replace(")"," ) ")
+    return expr.split()
 
-    if currentDepth != 0:
-        logger.error("[ExtractDeepestParentheses] Parentheses are not balanced")
-        raise Exception("Parentheses are not balanced")
+def compileSelection(expr,modelNames = None):
 
-    currentDepth = 0
+    # Model names which are spatial keywords, they are used as model names
+    modelKeywords = tuple(sorted(set(modelNames or []).intersection(availableSpatialSelections)))
 
-    deepestStart = -1
-    deepestEnd   = -1
+    if (expr,modelKeywords) in compiledSelections:
+        return compiledSelections[(expr,modelKeywords)]
 
-    for i, tk in enumerate(tokens):
-        if tk == '(':
-            currentDepth += 1
-            if currentDepth == maxDepth:
-                deepestStart = i
-        elif tk == ')':
-            if currentDepth == maxDepth:
-                deepestEnd = i
-                break
-            currentDepth -= 1
+    logger = logging.getLogger("VLMP")
 
-    if deepestStart != -1 and deepestEnd != -1:
-        return tokens[deepestStart:deepestEnd+1], deepestStart, deepestEnd
+    spatialKeywords = [kw for kw in availableSpatialSelections if kw not in modelKeywords]
+    spatialAxes     = [kw for kw in ["x","y","z"] if kw in spatialKeywords]
+
+    tokens = tokenizeSelection(expr)
+    pos    = 0
+
+    def splitToken(pattern):
+        # Splits the current token in the groups of pattern (if it matches),
+        # comparison operators do not need to be surrounded by spaces
+        tk = peek()
+        match = re.fullmatch(pattern,tk) if tk is not None else None
+        if match is not None:
+            tokens[pos:pos+1] = [group for group in match.groups() if group]
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def syntaxError(msg):
+        logger.error(f"[CompileSelection] Selection expression \"{expr}\" has a syntax error: {msg}")
+        raise Exception("Selection syntax error")
+
+    def parseOr():
+        nonlocal pos
+        node = parseAnd()
+        while peek() == "or":
+            pos += 1
+            node = ("or",node,parseAnd())
+        return node
+
+    def parseAnd():
+        nonlocal pos
+        node = parseNot()
+        while peek() == "and":
+            pos += 1
+            node = ("and",node,parseNot())
+        return node
+
+    def parseNot():
+        nonlocal pos
+        if peek() == "not":
+            pos += 1
+            return ("not",parseNot())
+        return parseAtom()
+
+    def parseNumbers(n,name):
+        nonlocal pos
+        numbers = []
+        for _ in range(n):
+            try:
+                numbers.append(float(peek()))
+            except (TypeError,ValueError):
+                syntaxError(f"\"{name}\" expects {n} number(s)")
+            pos += 1
+        return numbers
+
+    def parseAxis(name):
+        nonlocal pos
+        axis = peek()
+        if axis not in ["x","y","z"]:
+            syntaxError(f"\"{name}\" expects an axis (x, y or z)")
+        pos += 1
+        return axis
+
+    def parseSpatial(tk):
+        nonlocal pos
+        if tk == "within":
+            distance = parseNumbers(1,tk)[0]
+            if peek() != "of":
+                syntaxError("\"within\" expects \"within D of <selection>\"")
+            pos += 1
+            return ("within",distance,parseNot())
+        if tk == "sphere":
+            numbers = parseNumbers(4,tk)
+            return ("sphere",tuple(numbers[:3]),numbers[3])
+        if tk == "box":
+            numbers = parseNumbers(6,tk)
+            return ("box",tuple(numbers[:3]),tuple(numbers[3:]))
+        if tk == "slab":
+            axis = parseAxis(tk)
+            lower,upper = parseNumbers(2,tk)
+            return ("slab",axis,lower,upper)
+        # tk in ["x","y","z"]
+        splitToken(r"(<=|>=|<|>)(.*)")
+        operator = peek()
+        if operator not in comparisonOperators:
+            syntaxError(f"\"{tk}\" expects a comparison ({', '.join(comparisonOperators)})")
+        pos += 1
+        return ("coordinate",tk,operator,parseNumbers(1,tk)[0])
+
+    def parseAtom():
+        nonlocal pos
+        if len(spatialAxes) > 0:
+            splitToken(f"({'|'.join(spatialAxes)})(<=|>=|<|>)(.*)")
+        tk = peek()
+        if tk is None:
+            syntaxError("unexpected end of expression")
+        pos += 1
+
+        if tk == "(":
+            node = parseOr()
+            if peek() != ")":
+                syntaxError("parentheses are not balanced")
+            pos += 1
+            return node
+        if tk in logicalOperators or tk in modifiers:
+            syntaxError(f"unexpected token \"{tk}\"")
+        if tk in specialSelections:
+            return (tk,)
+        if tk in spatialKeywords:
+            return parseSpatial(tk)
+
+        # Model selection: model name followed by all the tokens
+        # which are not logical operators nor special selections
+        modelSelection = []
+        while peek() is not None and peek() not in logicalOperators and peek() not in specialSelections:
+            modelSelection.append(peek())
+            pos += 1
+
+        if len(modelSelection) == 0:
+            # All model
+            return ("model",tk,None,None,None)
+
+        modifier = None
+        if modelSelection[0] in modifiers:
+            modifier       = modelSelection[0]
+            modelSelection = modelSelection[1:]
+            if len(modelSelection) == 0:
+                syntaxError(f"modifier \"{modifier}\" of model \"{tk}\" is not followed by a selection")
+
+        return ("model",tk,modifier,modelSelection[0]," ".join(modelSelection[1:]))
+
+    node = parseOr()
+    if peek() is not None:
+        syntaxError(f"unexpected token \"{peek()}\"")
+
+    compiledSelections[(expr,modelKeywords)] = node
+
+    return node
+
+########################################################
+
+# Selections are evaluated as NumPy arrays of global ids.
+# Particle selections are sorted 1D arrays without duplicates,
+# selections of n-tuples (pairs, triples, ...) are 2D arrays (one row per tuple)
+# with sorted rows and without duplicated rows. Empty selections are compatible with any type.
+
+def sortRows(rows):
+    # Sorts the rows lexicographically, returns the sorted rows and
+    # a mask which is True for the rows equal to the previous one
+    rows = rows[np.lexsort(rows.T[::-1])]
+    repeated = np.zeros(len(rows),dtype=bool)
+    repeated[1:] = np.all(rows[1:] == rows[:-1],axis=1)
+    return rows,repeated
+
+def uniqueSelection(ids):
+    if ids.ndim == 1:
+        return np.unique(ids)
+    rows,repeated = sortRows(np.sort(ids,axis=1))
+    return rows[~repeated]
+
+def checkSelectionTypes(op1,op2):
 
-    return None, -1, -1
+    logger = logging.getLogger("VLMP")
 
-def evaluateTokens(tokens,allIds):
+    if op1.size == 0 or op2.size == 0:
+        return
+    if op1.ndim != op2.ndim or (op1.ndim == 2 and op1.shape[1] != op2.shape[1]):
+        logger.error(f"[ProcessSelections] Logical operation between selections of different types")
+        raise Exception("Selection has different types of lists")
+
+def selectionAnd(op1,op2):
+    checkSelectionTypes(op1,op2)
+    if op1.size == 0:
+        return op1
+    if op2.size == 0:
+        return op2
+    if op1.ndim == 1:
+        return np.intersect1d(op1,op2,assume_unique=True)
+    # Rows present in both selections (both are unique)
+    rows,repeated = sortRows(np.concatenate([op1,op2]))
+    return rows[repeated]
+
+def selectionOr(op1,op2):
+    checkSelectionTypes(op1,op2)
+    if op1.size == 0:
+        return op2
+    if op2.size == 0:
+        return op1
+    if op1.ndim == 1:
+        return np.union1d(op1,op2)
+    rows,repeated = sortRows(np.concatenate([op1,op2]))
+    return rows[~repeated]
+
+def selectionNot(op,allIds):
 
     logger = logging.getLogger("VLMP")
 
-    logger.debug(f"[EvaluateTokens] Evaluating tokens: {tokens}")
+    if op.ndim != 1:
+        logger.error(f"[ProcessSelections] \"not\" modifier is only valid for particle selections (no pairs, triples, ...)")
+        raise Exception("Selection syntax error")
+    return np.setdiff1d(allIds,op,assume_unique=True)
 
-    evalTokens = []
-    if tokens[0] == "(" and tokens[-1] == ")":
-        evalTokens = tokens[1:-1]
-    else:
-        evalTokens = tokens
+def getModelIds(model):
+    return model.getGlobalIdsArray()
 
-    if len(evalTokens) == 1:
-        return evalTokens[0]
+def getAllIds(models):
+    if len(models) == 0:
+        return np.zeros(0,dtype=int)
+    return np.unique(np.concatenate([getModelIds(mdl) for mdl in models]))
 
-    # Apply global not modifier if present
-    for i in range(len(evalTokens)-1):
-        if evalTokens[i] == "not":
-            if not isinstance(evalTokens[i+1],list):
-                logger.error(f"[EvaluateTokens] \"not\" modifier is not valid for token \"{evalTokens[i+1]}\"")
-                raise Exception("Selection syntax error")
-            if selectionListType(evalTokens[i+1]) != 1:
-                logger.error(f"[EvaluateTokens] \"not\" modifier is only valid for particle selections (no pairs, triples, ...)")
-                raise Exception("Selection syntax error")
-            evalTokens[i+1] = list(set(allIds).difference(set(evalTokens[i+1])))
-    # Remove not modifiers
-    evalTokens = [tk for tk in evalTokens if tk != "not"]
+def evaluateModelSelection(model,modifier,selectionType,selectionOptions):
+
+    logger = logging.getLogger("VLMP")
 
-    if len(evalTokens) == 1:
-        return evalTokens[0]
+    mdlName = model.getName()
 
-    if len(evalTokens) > 3:
-        logger.error(f"[EvaluateTokens] Logical expression \"{evalTokens}\" is not correct, too many tokens")
-        raise Exception("Logical expression is not correct")
+    if selectionType is None:
+        # All model
+        return np.unique(getModelIds(model))
+
+    if selectionType not in model.definedSelections and selectionType not in availableCommonSelections:
+        logger.error(f"[ProcessSelections] Neither model \"{mdlName}\" nor common selections have selection \"{selectionType}\"")
+        raise Exception("Selection not recognized")
+
+    if selectionType in availableCommonSelections and selectionType not in model.definedSelections:
+        ids = processCommonSelection(model,selectionType,selectionOptions,applyOffset=False)
+        # Offset is applied after
     else:
-        op1 = evalTokens[0]
-        op2 = evalTokens[2]
-        op  = evalTokens[1]
-
-        if op == "and":
-            return list(set(op1).intersection(set(op2)))
-        elif op == "or":
-            return list(set(op1).union(set(op2)))
-        else:
-            logger.error(f"[EvaluateTokens] Operator \"{op}\" is not valid")
-            raise Exception("Operator is not valid")
+        if selectionType in availableCommonSelections:
+            logger.debug("[ProcessSelections] Model \"%s\" is overriding common selection \"%s\"",mdlName,selectionType)
+        ids = model.processSelection(selectionType,selectionOptions)
+
+    if ids is None:
+        logger.error(f"[ProcessSelections] Model \"{mdlName}\" does not process selection \"{selectionType}\" with options \"{selectionOptions}\"")
+        raise Exception("Selection not recognized")
+
+    # Selections can be given as lists or arrays
+    if isinstance(ids,np.ndarray):
+        ids = ids.astype(int,copy=False)
+    elif selectionListType(ids) == 0:
+        ids = np.zeros(0,dtype=int)
+    else:
+        ids = np.asarray(ids,dtype=int)
 
-    logger.error(f"[EvaluateTokens] Tokens are not correct, the following tokens are not valid: {tokens}")
-    raise Exception("Tokens are not correct")
+    if ids.ndim > 2:
+        logger.error(f"[ProcessSelections] Selection \"{selectionType}\" of model \"{mdlName}\" is not a list of particles or n-tuples")
+        raise Exception("Selection not recognized")
 
-def getAllIds(models):
-    allIds = [mdl.getGlobalIds() for mdl in models]
-    # Convert list of lists to a single list
-    allIds = [i for sublist in allIds for i in sublist]
+    #Apply offset
+    ids = uniqueSelection(ids + model.getIdOffset())
+
+    if modifier is not None:
+        if modifier == "not":
+            #Not modifier only works for particle selections
+            if ids.ndim != 1:
+                logger.error(f"[ProcessSelections] Modifier \"{modifier}\" only works for particle selections (no pairs, triples, ...)")
+                raise Exception("Selection syntax error")
+            ids = np.setdiff1d(getModelIds(model),ids)
+        else:
+            logger.error(f"[ProcessSelections] Modifier \"{modifier}\" is not recognized")
+            raise Exception("Selection syntax error")
+
+    return ids
 
-    return allIds
+def isSpatialSelection(node):
+    # True if the result of the selection depends on the positions of the particles
+    if node[0] in ["within","coordinate","sphere","box","slab"]:
+        return True
+    if node[0] in ["not","and","or"]:
+        return any([isSpatialSelection(child) for child in node[1:]])
+    return False
 
-def processSelections(models,selections):
+def evaluateSelection(node,availableModels,getAllIdsBuffered,spatialData):
 
     logger = logging.getLogger("VLMP")
 
-    specialSelections = ["all","none"]
-    modifiers         = ["not"]
-    logicalOperators  = ["and","or","(",")"]
+    def evaluate(child):
+        return evaluateSelection(child,availableModels,getAllIdsBuffered,spatialData)
+
+    nodeType = node[0]
+
+    if nodeType == "all":
+        return getAllIdsBuffered()
+    if nodeType == "none":
+        return np.zeros(0,dtype=int)
+    if nodeType == "not":
+        return selectionNot(evaluate(node[1]),getAllIdsBuffered())
+    if nodeType == "and":
+        return selectionAnd(evaluate(node[1]),evaluate(node[2]))
+    if nodeType == "or":
+        return selectionOr(evaluate(node[1]),evaluate(node[2]))
+
+    if nodeType == "within":
+        return spatialData.within(node[1],evaluate(node[2]))
+    if nodeType == "coordinate":
+        return spatialData.coordinate(*node[1:])
+    if nodeType == "sphere":
+        return spatialData.sphere(*node[1:])
+    if nodeType == "box":
+        return spatialData.box(*node[1:])
+    if nodeType == "slab":
+        return spatialData.slab(*node[1:])
+
+    # nodeType == "model"
+    _,mdlName,modifier,selectionType,selectionOptions = node
+    if mdlName not in availableModels:
+        logger.error(f"[ProcessSelections] Selection refers to an unknown model \"{mdlName}\"")
+        raise Exception("Model not recognized")
+
+    try:
+        return evaluateModelSelection(availableModels[mdlName],modifier,selectionType,selectionOptions)
+    except Exception as e:
+        failedSelection = " ".join([tk for tk in [mdlName,modifier,selectionType,selectionOptions] if tk])
+        logger.error(f"[ProcessSelections] Error processing model selection \"{failedSelection}\"")
+        raise Exception("Selection syntax error")
+
+def processSelections(models,selections,cache = None,spatialData = None):
+
+    # Returns the selected ids of each selection as a (read only) array,
+    # of shape (n,) for particles selections and (n,k) for selections of pairs, triples, ...
+    # If cache (dict) is given, evaluated selections are stored in it by expression
+    # and reused, it has to be discarded when the models change.
+    # Spatial selections are evaluated using spatialData (spatialSelectionsData),
+    # and stored in it, it has to be discarded when the positions change
 
-    availableModels     = {mdl.getName():mdl for mdl in models}
-    availableSelections = {mdl.getName():mdl.definedSelections for mdl in models}
+    logger = logging.getLogger("VLMP")
+
+    availableModels = {mdl.getName():mdl for mdl in models}
 
     # Buffering for allIds
     allIds = None
+    def getAllIdsBuffered():
+        nonlocal allIds
+        if allIds is None:
+            allIds = getAllIds(models)
+        return allIds
+
+    if spatialData is None:
+        spatialData = spatialSelectionsData(models)
 
-    #Statr selection processing
     processedSelections = {}
     for sel,expr in selections.items():
 
-        if sel in processedSelections.keys():
-            logger.error(f"[ProcessSelections] Selection \"{sel}\" already processed")
-            raise Exception("Selection already processed")
-        else:
-            processedSelections[sel] = []
-
-        procExpr = expr
-        procExpr = procExpr.replace("("," ( ")
-        procExpr = procExpr.replace(")"," ) ")
-
-        tokens = procExpr.split()
-        procTokens = []
-        ignoreTokens = 0
-        for tk in tokens:
-            tk = tk.strip()
-            if ignoreTokens > 0:
-                ignoreTokens -= 1
-                continue
-            if tk in logicalOperators or tk in modifiers:
-                procTokens.append(tk)
-            elif tk in specialSelections:
-                if tk == "all":
-                    if allIds is None:
-                        allIds = getAllIds(models)
-                    procTokens.append(allIds)
-                elif tk == "none":
-                    procTokens.append([])
-            elif tk in availableModels.keys():
-
-                try:
-                    # Get all next tokens which are not logical operators nor special selections
-                    currentModelSelection = []
-                    for i in range(tokens.index(tk)+1,len(tokens)):
-                        if tokens[i] in logicalOperators or tokens[i] in specialSelections:
-                            break
-                        else:
-                            currentModelSelection.append(tokens[i])
-
-                    if len(currentModelSelection) == 0:
-                        # All model
-                        procTokens.append(availableModels[tk].getGlobalIds())
-                        continue
-
-                    ignoreTokens = len(currentModelSelection)
-
-                    isModified = (currentModelSelection[0].strip() in modifiers)
-                    if isModified:
-                        modifier = currentModelSelection[0].strip()
-                        selectionType    = currentModelSelection[1]
-                        selectionOptions = currentModelSelection[2:]
-                    else:
-                        selectionType    = currentModelSelection[0]
-                        selectionOptions = currentModelSelection[1:]
-
-                    if selectionType not in availableSelections[tk] and selectionType not in availableCommonSelections:
-                        logger.error(f"[ProcessSelections] Neither model \"{tk}\" nor common selections have selection \"{selectionType}\"")
-                        raise Exception("Selection not recognized")
-
-                    selectionOptions = " ".join(selectionOptions)
-
-                    if selectionType in availableCommonSelections and selectionType not in availableSelections[tk]:
-                        ids = processCommonSelection(availableModels[tk],selectionType,selectionOptions,applyOffset=False)
-                        # Offset is applied after
-                    else:
-                        if selectionType in availableCommonSelections:
-                            logger.debug(f"[ProcessSelections] Model \"{tk}\" is overriding common selection \"{selectionType}\"")
-                        ids = availableModels[tk].processSelection(selectionType,selectionOptions)
-
-                    if ids is None:
-                        logger.error(f"[ProcessSelections] Model \"{tk}\" does not process selection \"{selectionType}\" with options \"{selectionOptions}\"")
-                        raise Exception("Selection not recognized")
-
-                    #Apply offset
-                    listType = selectionListType(ids)
-                    if listType == 1:
-                        ids = [i+availableModels[tk].getIdOffset() for i in ids]
-                    else:
-                        for i in range(len(ids)):
-                            ids[i] = [j+availableModels[tk].getIdOffset() for j in ids[i]]
-
-                    if isModified:
-                        if modifier == "not":
-                            #Not modifier only works for listType 1
-                            if listType != 1:
-                                logger.error(f"[ProcessSelections] Modifier \"{modifier}\" only works for particle selections (no pairs, triples, ...)")
-                                raise Exception("Selection syntax error")
-                            ids = list(set(availableModels[tk].getGlobalIds()).difference(set(ids)))
-                        else:
-                            logger.error(f"[ProcessSelections] Modifier \"{modifier}\" is not recognized")
-                            raise Exception("Selection syntax error")
-
-                    procTokens.append(ids)
-                except Exception as e:
-                    failedSelection = tk + " " + " ".join(currentModelSelection)
-                    logger.error(f"[ProcessSelections] Selection \"{sel}\" has a syntax error. Error processing model selection \"{failedSelection}\"")
-                    raise Exception("Selection syntax error")
-            else:
-                logger.error(f"[ProcessSelections] Selection \"{sel}\" refers to an unknown model \"{tk}\"")
-                raise Exception("Model not recognized")
-
-        # At this point, procTokens is a list of lists and logical operators
-        # We check here if all list are the same type
-        # Lists can be a list of integers: [1,2,3,4,...]
-        # List of pairs of integers: [[1,2],[3,4],...]
-        # List of triples of integers: [[1,2,3],[4,5,6],...]
-        # ...
-        # In general, a list of n-tuples of integers
-        # But all lists must have the same type
-
-        listType = -1
-        for i in range(len(procTokens)):
-            if procTokens[i] in logicalOperators or procTokens[i] in modifiers:
-                continue
-            else:
-                if listType == -1:
-                    listType = selectionListType(procTokens[i])
-                elif listType != selectionListType(procTokens[i]):
-                    logger.error(f"[ProcessSelections] Selection \"{sel}\" has different types of lists")
-                    raise Exception("Selection has different types of lists")
-
-        # If not is present we preprer the list of all ids
-        for i in range(len(procTokens)):
-            if procTokens[i] == "not":
-                if allIds is None:
-                    allIds = getAllIds(models)
-                    break
-
         try:
-            while len(procTokens) > 1:
-                toProcess, start, end = extractDeepestParentheses(procTokens)
-                if toProcess is None:
-                    # Full expression is processed
-                    toProcess = copy.deepcopy(procTokens)
-                    start = 0
-                    end   = len(procTokens)-1
-                processed = evaluateTokens(toProcess,allIds)
-                # Replace tokens
-                procTokens = procTokens[:start] + [processed] + procTokens[end+1:]
+            node = compileSelection(expr,availableModels)
         except Exception as e:
-            logger.error(f"[ProcessSelections] Selection \"{sel}\" has a syntax error")
-            raise Exception("Selection syntax error")
+            logger.error(f"[ProcessSelections] Selection \"{sel}\" (\"{expr}\") could not be processed")
+            raise e
+
+        if isSpatialSelection(node):
+            selectionsCache = spatialData.selections
+        else:
+            selectionsCache = cache
 
-        # Clean up
-        procTokens = procTokens[0]
-        if selectionListType(procTokens) == 1:
-            procTokens = list(set(procTokens))
+        if selectionsCache is not None and expr in selectionsCache:
+            ids = selectionsCache[expr]
+            logger.debug("[ProcessSelections] Selection \"%s\" (\"%s\") found in cache",sel,expr)
         else:
-            # Sort every sublist and convert to tuple
-            for i in range(len(procTokens)):
-                procTokens[i] = tuple(sorted(procTokens[i]))
-            # Remove duplicates
-            procTokens = list(set(procTokens))
-            # Convert back to list
-            for i in range(len(procTokens)):
-                procTokens[i] = list(procTokens[i])
+            try:
+                ids = evaluateSelection(node,availableModels,getAllIdsBuffered,spatialData)
+            except Exception as e:
+                logger.error(f"[ProcessSelections] Selection \"{sel}\" (\"{expr}\") could not be processed")
+                raise e
 
+            # Selections can be shared (cache), they can not be modified
+            ids.flags.writeable = False
 
-        processedSelections[sel] = procTokens
-        logger.debug(f"[ProcessSelections] Selection \"{sel}\" processed: {processedSelections[sel]}")
+            if selectionsCache is not None:
+                selectionsCache[expr] = ids
 
-    return copy.deepcopy(processedSelections)
+        processedSelections[sel] = ids
+        logger.debug("[ProcessSelections] Selection \"%s\" processed: %d entries",sel,len(processedSelections[sel]))
+
+    return processedSelections
 
 def splitStateAccordingStructure(state,structure):
 
@@ -316,43 +452,32 @@ def splitStateAccordingStructure(state,structure):
         logger.error("[splitStateAccordingStructure] State and structure have different lengths")
         raise Exception("State and structure have different lengths")
 
+    if len(structure) == 0:
+        return []
+
     # Structure has to have the following format:
     # [A,A,A,...,B,B,B,...,C,C,C,...,...]
-    # Each letter represents a different structure
-    # Check structure is correct
-    appearedStructures = []
-    for s in structure:
-        if s not in appearedStructures:
-            appearedStructures.append(s)
-        elif s != appearedStructures[-1]:
-            logger.error("[splitStateAccordingStructure] Structure is not correct")
-            raise Exception("Structure is not correct")
-        else:
-            continue
-
-    # Split pos according the different models
-    splittedState = []
-
-    currentStruct      = structure[0]
-    currentStructState = []
-    for i in range(len(structure)):
-        if structure[i] == currentStruct:
-            currentStructState.append(state[i])
-        else:
-            splittedState.append(currentStructState)
-            currentStruct      = structure[i]
-            currentStructState = [state[i]]
-
-    splittedState.append(currentStructState)
-
-    # At this point, splittedState is a list of lists,
-    # each list contains the state of a model
-    #                       struct[0]          struct[1]   ...
+    # Each letter represents a different structure.
+    # The structure is run-length encoded, each run has to be a different structure
+    structure = np.asarray(structure)
+
+    runStarts = np.flatnonzero(structure[1:] != structure[:-1]) + 1
+    runValues = structure[np.concatenate([[0],runStarts])]
+
+    uniqueValues,counts = np.unique(runValues,return_counts=True)
+    if len(uniqueValues) != len(runValues):
+        repeated = uniqueValues[counts > 1].tolist()
+        logger.error(f"[splitStateAccordingStructure] Structure is not correct, the particles of the structures {repeated}"
+                      " are not contiguous")
+        raise Exception("Structure is not correct")
+
+    # Split state according the different structures.
+    # splittedState is a list of arrays (views of the state),
+    # each array contains the state of a structure
+    #                        struct[0]          struct[1]   ...
     # splittedState = [[state1_0,state2_0,...],[state1_0,state2_0,...],...]
     # It is ensured that the order is kept.
-    # splittedState is the state list splitted according the structure
-
-    return splittedState
-
 
+    splittedState = np.split(np.asarray(state),runStarts)
 
+    return splittedState
@@ -2,6 +2,10 @@ import copy
 
 import logging
 
+import numpy as np
+
+from operator import itemgetter
+
 from VLMP.utils.input import getLabelIndex
 from VLMP.utils.input.stringUtils import string2integerList
 
@@ -33,29 +37,28 @@ def modelStructureSelection(model, selectionType, selectionOptions, applyOffset=
 
     selectionType = rename[selectionType]
 
-    structure = model.getStructure()
     sel = []
 
+    # Selections are answered using the structure index of the model (value -> ids),
+    # except id selections, which are checked against the ids of the model
     if selectionType == "id":
         # Selection options is a list of integers (as string)
         selectedIDs = string2integerList(selectionOptions)
-        # Check if all selectedIDs are in model.getLocalIds()
-        localIds = model.getLocalIds()
-        if set(selectedIDs).issubset(localIds):
+        # Check if all selectedIDs are ids of the model
+        if np.all(np.isin(np.asarray(selectedIDs,dtype=int),model.getLocalIdsArray())):
             sel = selectedIDs
     else:
-        idLabelIndex  = getLabelIndex("id",structure["labels"])
-        strLabelIndex = getLabelIndex(selectionType,structure["labels"])
-
         if selectionType in ["resId","chainId","modelId"]:
             selectionOptions = string2integerList(selectionOptions)
         else: # selectionType == "type"
             selectionOptions = selectionOptions.split()
             selectionOptions = [x.strip() for x in selectionOptions]
 
-        for i in range(len(structure["data"])):
-            if structure["data"][i][strLabelIndex] in selectionOptions:
-                sel.append(structure["data"][i][idLabelIndex])
+        index = model.getStructureIndex(selectionType)
+
+        selected = [index[opt] for opt in set(selectionOptions) if opt in index]
+        if len(selected) > 0:
+            sel = np.unique(np.concatenate(selected)).tolist()
 
     ##############################################################
 
@@ -65,11 +68,19 @@ def modelStructureSelection(model, selectionType, selectionOptions, applyOffset=
 
 def forceFieldSelection(model, selectionType, selectionOptions, applyOffset=False):
 
+    # Returns the ids of the selected force field entries as an array,
+    # of shape (n,) for Bond1 entries and (n,k) for Bond2 (k=2), Bond3 (k=3) and Bond4 (k=4) entries
+
     logger = logging.getLogger("VLMP")
 
     forceFieldEntriesName = selectionOptions.split()
     forceFieldEntriesName = [x.strip() for x in forceFieldEntriesName]
 
+    idLabels = {"Bond1":["id_i"],
+                "Bond2":["id_i","id_j"],
+                "Bond3":["id_i","id_j","id_k"],
+                "Bond4":["id_i","id_j","id_k","id_l"]}
+
     sel = []
 
     forceField = model.getForceField()
@@ -84,87 +95,63 @@ def forceFieldSelection(model, selectionType, selectionOptions, applyOffset=Fals
             entryLabels = forceField[ff]["labels"]
             entryData   = forceField[ff]["data"]
 
-            if entryType == "Bond1":
-                id1Index = getLabelIndex("id_i",entryLabels)
-                for i in range(len(entryData)):
-                    id1 = int(entryData[i][id1Index])
-                    sel.append(id1)
-
-            elif entryType == "Bond2":
-                id1Index = getLabelIndex("id_i",entryLabels)
-                id2Index = getLabelIndex("id_j",entryLabels)
-                for i in range(len(entryData)):
-                    id1 = int(entryData[i][id1Index])
-                    id2 = int(entryData[i][id2Index])
-                    sel.append([id1,id2])
-
-            elif entryType == "Bond3":
-                id1Index = getLabelIndex("id_i",entryLabels)
-                id2Index = getLabelIndex("id_j",entryLabels)
-                id3Index = getLabelIndex("id_k",entryLabels)
-                for i in range(len(entryData)):
-                    id1 = int(entryData[i][id1Index])
-                    id2 = int(entryData[i][id2Index])
-                    id3 = int(entryData[i][id3Index])
-                    sel.append([id1,id2,id3])
-
-            elif entryType == "Bond4":
-                id1Index = getLabelIndex("id_i",entryLabels)
-                id2Index = getLabelIndex("id_j",entryLabels)
-                id3Index = getLabelIndex("id_k",entryLabels)
-                id4Index = getLabelIndex("id_l",entryLabels)
-                for i in range(len(entryData)):
-                    id1 = int(entryData[i][id1Index])
-                    id2 = int(entryData[i][id2Index])
-                    id3 = int(entryData[i][id3Index])
-                    id4 = int(entryData[i][id4Index])
-                    sel.append([id1,id2,id3,id4])
-
-            else:
+            if entryType not in idLabels:
                 logger.error(f"[Model] ({model.getName()}) Force field entry {ff} has not an available type."
                               "Available types are: Bond1, Bond2, Bond3, Bond4")
                 raise Exception(f"Force field entry has not an available type")
 
-    if applyOffset:
-        if len(sel[0]) == 1:
-            sel = [model.getIdOffset() + i for i in sel]
-        else:
-            sel = [[model.getIdOffset() + i for i in bond] for bond in sel]
+            idIndices = [getLabelIndex(label,entryLabels) for label in idLabels[entryType]]
 
-    return sel
+            ids = np.asarray(list(map(itemgetter(*idIndices),entryData)),dtype=int)
+            if len(entryData) == 0:
+                ids = ids.reshape((0,) if len(idIndices) == 1 else (0,len(idIndices)))
 
+            if len(sel) > 0 and sel[0].shape[1:] != ids.shape[1:]:
+                logger.error(f"[Model] ({model.getName()}) Force field entries {forceFieldEntriesName} are of different types,"
+                              " they can not be selected together")
+                raise Exception(f"Force field entries are of different types")
 
+            sel.append(ids)
 
+    if len(sel) == 0:
+        sel = np.zeros(0,dtype=int)
+    else:
+        sel = np.concatenate(sel)
+
+    if applyOffset:
+        sel = sel + model.getIdOffset()
+
+    return sel
 
 def processCommonSelection(models, selectionType, selectionOptions, applyOffset=False):
 
+    # Returns the selected ids as an array, of shape (n,) for particles selections
+    # and (n,k) for selections of pairs, triples, ...
+
     logger = logging.getLogger("VLMP")
 
     if not isinstance(models,list):
         models = [models]
 
     sel = []
-    if selectionType in ["id","type","res","chain","model"]:
-        for model in models:
-            selBuffer = modelStructureSelection(model, selectionType, selectionOptions, applyOffset)
-            if len(selBuffer) > 0:
-                sel += selBuffer
-            else:
-                logger.warning(f"[CommonSelection] Selection type {selectionType} with options {selectionOptions} "
-                               f"is empty for model {model.getName()}")
-    if selectionType == "forceField":
-        for model in models:
+    for model in models:
+        if selectionType in ["id","type","res","chain","model"]:
+            selBuffer = np.asarray(modelStructureSelection(model, selectionType, selectionOptions, applyOffset),dtype=int)
+        elif selectionType == "forceField":
             selBuffer = forceFieldSelection(model, selectionType, selectionOptions, applyOffset)
-            if len(selBuffer) > 0:
-                sel += selBuffer
-            else:
-                logger.warning(f"[CommonSelection] Selection type {selectionType} with options {selectionOptions} "
-                               f"is empty for model {model.getName()}")
+        else:
+            continue
+
+        if len(selBuffer) > 0:
+            sel.append(selBuffer)
+        else:
+            logger.warning(f"[CommonSelection] Selection type {selectionType} with options {selectionOptions} "
+                           f"is empty for model {model.getName()}")
 
     if len(sel) == 0:
         modelsNames = [model.getName() for model in models]
         logger.warning(f"[CommonSelection] Selection type {selectionType} with options {selectionOptions} "
                        f"is empty for models {modelsNames}")
+        return np.zeros(0,dtype=int)
 
-
-    return sel
+    return np.concatenate(sel)
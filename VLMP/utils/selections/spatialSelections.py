@@ -0,0 +1,168 @@
+import logging
+
+import numpy as np
+
+# Spatial selections keywords:
+#   within D of <selection> : particles closer than D (or at D) to any particle of <selection>
+#   x|y|z <op> value        : particles whose coordinate satisfies the comparison (<, <=, >, >=)
+#   sphere cx cy cz r       : particles inside the sphere of center (cx,cy,cz) and radius r
+#   box x0 y0 z0 x1 y1 z1   : particles inside the box with corners (x0,y0,z0) and (x1,y1,z1)
+#   slab x|y|z min max      : particles whose coordinate is between min and max
+# Distances (within, sphere) take into account the periodic box of the ensemble,
+# coordinates (x|y|z, box, slab) are compared as they are, without wrapping them into the box.
+# A keyword which is the name of a model selects the model instead.
+
+availableSpatialSelections = ["within","sphere","box","slab","x","y","z"]
+comparisonOperators        = ["<","<=",">",">="]
+
+axisIndex = {"x":0,"y":1,"z":2}
+
+#Selections smaller than this fraction of the particles are searched from the tree of all the particles
+withinSearchFraction = 0.01
+
+class spatialSelectionsData:
+    """
+    Positions of the particles of the models, and the KD-tree built over them,
+    used to evaluate spatial selections. Everything is computed the first time it is needed,
+    the object has to be discarded when the positions (or the models) change.
+    Evaluated spatial selections are stored by expression in selections.
+    beforeLoading (optional) is called before the positions are read from the models.
+    """
+
+    def __init__(self,models,beforeLoading = None):
+
+        self.logger = logging.getLogger("VLMP")
+
+        self.models = models
+
+        self.beforeLoading = beforeLoading
+
+        self.ids       = None
+        self.positions = None
+        self.idToRow   = None
+        self.boxSize   = None
+
+        self.tree = None
+
+        self.selections = {}
+
+    def __load(self):
+
+        if self.beforeLoading is not None:
+            self.beforeLoading()
+
+        ids       = []
+        positions = []
+        for mdl in self.models:
+            if mdl.getNumberOfParticles() == 0:
+                continue
+
+            ids.append(mdl.getGlobalIdsArray())
+            positions.append(np.asarray(mdl.getStateColumn("position"),dtype=float).reshape(-1,3))
+
+        if len(ids) > 0:
+            self.ids       = np.concatenate(ids)
+            self.positions = np.concatenate(positions)
+        else:
+            self.ids       = np.zeros(0,dtype=int)
+            self.positions = np.zeros((0,3),dtype=float)
+
+        self.idToRow = np.full(int(np.max(self.ids))+1 if len(self.ids) > 0 else 0,-1,dtype=int)
+        self.idToRow[self.ids] = np.arange(len(self.ids))
+
+        #Periodic box, only if all the box sides are finite
+        self.boxSize = None
+        if len(self.models) > 0:
+            ensemble = self.models[0].getEnsemble()
+            if ensemble.isEnsembleComponent("box"):
+                box = np.asarray(ensemble.getEnsembleComponent("box"),dtype=float)
+                if np.all(np.isfinite(box)) and np.all(box > 0.0):
+                    self.boxSize = box
+
+    def getIds(self):
+        if self.ids is None:
+            self.__load()
+        return self.ids
+
+    def getPositions(self):
+        if self.positions is None:
+            self.__load()
+        return self.positions
+
+    def getIdsPositions(self,ids):
+        if self.idToRow is None:
+            self.__load()
+        return self.positions[self.idToRow[ids]]
+
+    def __wrap(self,positions):
+        # Periodic KD-trees require the positions in [0,boxSize)
+        if self.boxSize is None:
+            return positions
+        wrapped = np.mod(positions + 0.5*self.boxSize,self.boxSize)
+        wrapped[wrapped >= self.boxSize] = 0.0
+        return wrapped
+
+    def __buildTree(self,positions):
+        # scipy is imported here, it is not needed if spatial selections are not used
+        from scipy.spatial import cKDTree
+        return cKDTree(self.__wrap(positions),boxsize=self.boxSize)
+
+    def getTree(self):
+        if self.tree is None:
+            self.logger.debug("[SpatialSelections] Building KD-tree over %d particles",len(self.getPositions()))
+            self.tree = self.__buildTree(self.getPositions())
+        return self.tree
+
+    ########################################################
+
+    def within(self,distance,ids):
+
+        if ids.ndim != 1:
+            self.logger.error("[SpatialSelections] \"within\" is only valid for particle selections (no pairs, triples, ...)")
+            raise Exception("Selection syntax error")
+
+        if len(ids) == 0:
+            return np.zeros(0,dtype=int)
+
+        allIds = self.getIds()
+        selPos = self.getIdsPositions(ids)
+
+        if len(ids) < withinSearchFraction*len(allIds):
+            # Few reference particles, they are searched in the tree of all the particles
+            neighbours = self.getTree().query_ball_point(self.__wrap(selPos),distance)
+            rows = np.unique(np.concatenate([np.asarray(n,dtype=int) for n in neighbours]))
+        else:
+            # Distance of each particle to the closest reference particle
+            dst,_ = self.__buildTree(selPos).query(self.__wrap(self.getPositions()),k=1,
+                                                   distance_upper_bound=np.nextafter(distance,np.inf))
+            rows = np.where(dst <= distance)[0]
+
+        return np.unique(allIds[rows])
+
+    def sphere(self,center,radius):
+        if len(self.getIds()) == 0:
+            return np.zeros(0,dtype=int)
+        center = self.__wrap(np.asarray(center,dtype=float).reshape(1,3))[0]
+        rows   = np.asarray(self.getTree().query_ball_point(center,radius),dtype=int)
+        return np.unique(self.getIds()[rows])
+
+    def coordinate(self,axis,operator,value):
+        coord = self.getPositions()[:,axisIndex[axis]]
+        if operator == "<":
+            mask = coord < value
+        elif operator == "<=":
+            mask = coord <= value
+        elif operator == ">":
+            mask = coord > value
+        else: # operator == ">="
+            mask = coord >= value
+        return np.unique(self.getIds()[mask])
+
+    def box(self,lower,upper):
+        positions = self.getPositions()
+        mask = np.all((positions >= np.asarray(lower)) & (positions <= np.asarray(upper)),axis=1)
+        return np.unique(self.getIds()[mask])
+
+    def slab(self,axis,lower,upper):
+        coord = self.getPositions()[:,axisIndex[axis]]
+        return np.unique(self.getIds()[(coord >= lower) & (coord <= upper)])
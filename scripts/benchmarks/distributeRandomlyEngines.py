@@ -0,0 +1,108 @@
+import math
+import time
+import logging
+import argparse
+
+import numpy as np
+
+from scipy.spatial.transform import Rotation
+
+from VLMP.utils.geometry import distributeRandomlyGeneratorChecker
+from VLMP.utils.geometry import distributeRandomlyCellList
+from VLMP.utils.geometry import distributeRandomlyCellListBatched
+from VLMP.utils.geometry import distributeOnLattice
+
+# Packs rigid molecules (clusters of particles) in a periodic box avoiding clashes,
+# as distributeRandomly does with avoidClashes, and reports the wall time of the "tree" engine
+# (distributeRandomlyGeneratorChecker), the "grid" engine (distributeRandomlyCellList) and
+# the "grid" engine with batched candidates and free space sampling, "batched" (distributeRandomlyCellListBatched),
+# and the placement on a fcc lattice of the "lattice" mode, "lattice" (distributeOnLattice).
+# The tree and grid engines use the same random points, the number of clashes between molecules
+# (particles closer than 1.05*(r1+r2)) left by each engine is also reported.
+
+def countClashes(positions,particlesPerMolecule,radius,L):
+    from scipy.spatial import cKDTree
+    tree  = cKDTree(np.mod(np.asarray(positions)+L/2.0,L),boxsize=L)
+    pairs = tree.query_pairs(1.05*2.0*radius,output_type="ndarray")
+    return int(np.sum(pairs[:,0]//particlesPerMolecule != pairs[:,1]//particlesPerMolecule))
+
+def getMolecules(nMolecules,particlesPerMolecule,radius,shape,rng):
+    posSets = []
+    radSets = []
+
+    # Globule: the lattice points (spacing 2*radius) closest to the origin
+    n = int(np.ceil(particlesPerMolecule**(1.0/3.0)))+2
+    lattice = np.stack(np.meshgrid(*[np.arange(-n,n+1)]*3,indexing="ij"),axis=-1).reshape(-1,3)*2.0*radius
+    lattice = lattice[np.argsort(np.linalg.norm(lattice,axis=1),kind="stable")][:particlesPerMolecule]
+
+    for _ in range(nMolecules):
+        if shape == "chain":
+            # Random walk of touching particles
+            steps = rng.normal(size=(particlesPerMolecule,3))
+            steps = 2.0*radius*steps/np.linalg.norm(steps,axis=1)[:,None]
+            steps[0] = 0.0
+            posSets.append(np.cumsum(steps,axis=0))
+        else:
+            # Randomly oriented, as distributeRandomly does with randomRotation
+            posSets.append(lattice @ Rotation.random(random_state=rng).as_matrix().T)
+        radSets.append([radius]*particlesPerMolecule)
+    return posSets,radSets
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Wall time of the clash avoidance engines of distributeRandomly")
+    parser.add_argument("--nMolecules",           type=int,   default=1000,  help="Number of molecules")
+    parser.add_argument("--particlesPerMolecule", type=int,   default=20,    help="Number of particles of each molecule")
+    parser.add_argument("--shape",                type=str,   default="chain", help="Shape of the molecules, chain or globule")
+    parser.add_argument("--radius",               type=float, default=1.0,   help="Radius of the particles")
+    parser.add_argument("--volumeFraction",       type=float, default=0.05,  help="Volume fraction of the particles")
+    parser.add_argument("--maxTries",             type=int,   default=10000, help="Maximum number of tries per molecule")
+    parser.add_argument("--batchSize",            type=int,   default=64,    help="Candidates per batch (batched engine)")
+    parser.add_argument("--engines",              type=str,   default="tree,grid,batched", help="Engines to run, comma separated")
+    args = parser.parse_args()
+
+    logging.getLogger("VLMP").setLevel(logging.INFO)
+
+    rng = np.random.default_rng(0)
+
+    posSets,radSets = getMolecules(args.nMolecules,args.particlesPerMolecule,args.radius,args.shape,rng)
+
+    nParticles = args.nMolecules*args.particlesPerMolecule
+    L   = ((nParticles*4.0/3.0*math.pi*args.radius**3)/args.volumeFraction)**(1.0/3.0)
+    box = [L,L,L]
+
+    def boxCheckDistance(p1,p2,r1,r2):
+        dr = np.asarray(p1)-np.asarray(p2)
+        dr = dr - np.floor(dr/L+0.5)*L
+        return np.linalg.norm(dr) > 1.05*(r1+r2)
+
+    print(f"Molecules:       {args.nMolecules}")
+    print(f"Particles:       {nParticles}")
+    print(f"Box:             {L:.2f}")
+
+    results = {}
+    for engine in args.engines.split(","):
+        points = np.random.default_rng(1)
+        def randomPoint():
+            return points.uniform(low=-L/2.0,high=L/2.0,size=3)
+        def randomPoints(n):
+            return np.random.uniform(low=-L/2.0,high=L/2.0,size=(n,3))
+
+        start = time.perf_counter()
+        if engine == "tree":
+            results[engine] = distributeRandomlyGeneratorChecker(box,posSets,radSets,randomPoint,boxCheckDistance,args.maxTries,1.05)
+        elif engine == "grid":
+            results[engine] = distributeRandomlyCellList(box,posSets,radSets,randomPoint,args.maxTries,1.05)
+        elif engine == "batched":
+            np.random.seed(1)
+            results[engine] = distributeRandomlyCellListBatched(box,posSets,radSets,randomPoints,args.maxTries,1.05,
+                                                                batchSize=args.batchSize,randomRotation=True)
+        elif engine == "lattice":
+            np.random.seed(1)
+            results[engine] = distributeOnLattice(box,posSets,radSets,"fcc",1.05,jitter=0.5)
+        else:
+            raise Exception(f"Engine {engine} not recognized")
+        wallTime = time.perf_counter() - start
+
+        clashes = countClashes(results[engine],args.particlesPerMolecule,args.radius,L)
+        print(f"Engine {engine+':':<9} {wallTime:.3f} s, {clashes} clashes")
@@ -0,0 +1,75 @@
+import os
+import time
+import argparse
+
+import tempfile
+
+import VLMP
+
+from VLMP.utils.units import picosecond2KcalMol_A_time
+
+# Loads a pool of CORONAVIRUS simulations, each one with a chain of model operations
+# (setCenterOfMassPosition, rotation, alignInertiaMomentAlongVector, setParticleLowestPosition)
+# over the same selection, and reports the wall time of loading the pool with and without the operations.
+# Run it from different versions of VLMP to compare them.
+
+def getSimulationPool(copies,nLipids,nSpikes,chainLength):
+
+    ps2AKMA = picosecond2KcalMol_A_time()
+
+    operations = []
+    for i in range(chainLength):
+        operations += [{"type":"setCenterOfMassPosition","parameters":{"position":[0.0,0.0,float(i)],
+                                                                       "selection":"CORONAVIRUS"}},
+                       {"type":"rotation","parameters":{"axis":[1.0,1.0,0.0],"angle":0.1,
+                                                        "selection":"CORONAVIRUS"}},
+                       {"type":"alignInertiaMomentAlongVector","parameters":{"vector":[0.0,0.0,1.0],
+                                                                             "selection":"CORONAVIRUS"}},
+                       {"type":"setParticleLowestPosition","parameters":{"position":-500.0,
+                                                                         "selection":"CORONAVIRUS"}}]
+
+    simulationPool = []
+    for i in range(copies):
+        simulationPool.append({"system":[{"type":"simulationName","parameters":{"simulationName":"TGEV_"+str(i)}},
+                                         {"type":"backup","parameters":{"backupIntervalStep":100000}}],
+                               "units":[{"type":"KcalMol_A"}],
+                               "types":[{"type":"basic"}],
+                               "ensemble":[{"type":"NVT","parameters":{"box":[2000.0,2000.0,4000.0],"temperature":300.0}}],
+                               "integrators":[{"type":"EulerMaruyamaRigidBody","parameters":{"timeStep":0.1*ps2AKMA,
+                                                                                             "viscosity":1.0/ps2AKMA,
+                                                                                             "integrationSteps":1000000}}],
+                               "models":[{"type":"CORONAVIRUS","parameters":{"nLipids":nLipids,
+                                                                             "nSpikes":nSpikes}}],
+                               "simulationSteps":[{"type":"info","parameters":{"intervalStep":10000}}]})
+        if chainLength > 0:
+            simulationPool[-1]["modelOperations"] = operations
+
+    return simulationPool
+
+def loadTime(simulationPool):
+    vlmp = VLMP.VLMP()
+
+    start = time.perf_counter()
+    vlmp.loadSimulationPool(simulationPool)
+    return time.perf_counter() - start
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Wall time of chained model operations over the same selection")
+    parser.add_argument("--copies",      type=int, default=5,    help="Number of simulations in the pool")
+    parser.add_argument("--nLipids",     type=int, default=5001, help="Number of lipids of each virus")
+    parser.add_argument("--nSpikes",     type=int, default=40,   help="Number of spikes of each virus")
+    parser.add_argument("--chainLength", type=int, default=5,    help="Number of times the chain of operations is repeated")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        os.chdir(tmpDir)
+
+        baseTime  = loadTime(getSimulationPool(args.copies,args.nLipids,args.nSpikes,0))
+        chainTime = loadTime(getSimulationPool(args.copies,args.nLipids,args.nSpikes,args.chainLength))
+
+    print(f"Simulations:     {args.copies}")
+    print(f"Operations:      {4*args.chainLength} per simulation")
+    print(f"Load time:       {baseTime:.2f} s (without operations)")
+    print(f"Load time:       {chainTime:.2f} s (with operations)")
+    print(f"Operations time: {(chainTime-baseTime)/args.copies:.3f} s per simulation")
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import resource
+import argparse
+
+import tempfile
+
+import VLMP
+
+from VLMP.utils.units import picosecond2KcalMol_A_time
+
+# Builds a pool of CORONAVIRUS simulations (as in Examples/sars) and reports
+# the wall time and the peak memory (RSS) of loading and writing the pool.
+# Run it from different versions of VLMP to compare them.
+
+def getPeakRSS():
+    # ru_maxrss is given in kilobytes (Linux) or bytes (macOS)
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return maxrss/1024**2
+    return maxrss/1024
+
+def getSimulationPool(copies,nLipids,nSpikes):
+
+    ps2AKMA = picosecond2KcalMol_A_time()
+
+    simulationPool = []
+    for i in range(copies):
+        simulationPool.append({"system":[{"type":"simulationName","parameters":{"simulationName":"TGEV_"+str(i)}},
+                                         {"type":"backup","parameters":{"backupIntervalStep":100000}}],
+                               "units":[{"type":"KcalMol_A"}],
+                               "types":[{"type":"basic"}],
+                               "ensemble":[{"type":"NVT","parameters":{"box":[2000.0,2000.0,4000.0],"temperature":300.0}}],
+                               "integrators":[{"type":"EulerMaruyamaRigidBody","parameters":{"timeStep":0.1*ps2AKMA,
+                                                                                             "viscosity":1.0/ps2AKMA,
+                                                                                             "integrationSteps":1000000}}],
+                               "models":[{"type":"CORONAVIRUS","parameters":{"nLipids":nLipids,
+                                                                             "nSpikes":nSpikes,
+                                                                             "surface":True}}],
+                               "modelExtensions":[{"type":"constantTorqueOverCenterOfMass",
+                                                   "parameters":{"torque":[0.0,0.0,-1.0],
+                                                                 "selection":"CORONAVIRUS type lipids"}}],
+                               "simulationSteps":[{"type":"saveState","parameters":{"startStep":10000,
+                                                                                    "intervalStep":10000,
+                                                                                    "outputFilePath":"test",
+                                                                                    "outputFormat":"sp"}},
+                                                  {"type":"info","parameters":{"intervalStep":10000}}]})
+
+    return simulationPool
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Wall time and peak RSS of building a CORONAVIRUS simulation pool")
+    parser.add_argument("--copies",  type=int, default=20,   help="Number of simulations in the pool")
+    parser.add_argument("--nLipids", type=int, default=1501, help="Number of lipids of each virus")
+    parser.add_argument("--nSpikes", type=int, default=40,   help="Number of spikes of each virus")
+    parser.add_argument("--workers", type=int, default=1,    help="Number of workers used to load the pool")
+    parser.add_argument("--stream",  action="store_true",    help="Use streamSimulationPool instead of loadSimulationPool")
+    args = parser.parse_args()
+
+    simulationPool = getSimulationPool(args.copies,args.nLipids,args.nSpikes)
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        os.chdir(tmpDir)
+
+        vlmp = VLMP.VLMP()
+
+        start = time.perf_counter()
+        if args.stream:
+            vlmp.streamSimulationPool("BENCHMARK",simulationPool,"one",workers=args.workers)
+            loadTime  = time.perf_counter() - start
+            writeTime = 0.0
+        else:
+            vlmp.loadSimulationPool(simulationPool,workers=args.workers)
+            loadTime = time.perf_counter() - start
+
+            start = time.perf_counter()
+            vlmp.distributeSimulationPool("one")
+            vlmp.setUpSimulation("BENCHMARK")
+            writeTime = time.perf_counter() - start
+
+    print(f"Simulations:     {args.copies}")
+    print(f"Load time:       {loadTime:.2f} s")
+    print(f"Write time:      {writeTime:.2f} s")
+    print(f"Total time:      {loadTime+writeTime:.2f} s")
+    print(f"Peak RSS:        {getPeakRSS():.1f} MB")
@@ -0,0 +1,45 @@
+import time
+import argparse
+
+import numpy as np
+
+from VLMP.utils.selections import splitStateAccordingStructure
+
+# Splits the positions of a system made of several molecules (contiguous structures)
+# as done by distributeRandomly, and reports the wall time of splitStateAccordingStructure.
+# Run it from different versions of VLMP to compare them.
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Wall time of splitStateAccordingStructure")
+    parser.add_argument("--nParticles",  type=int, default=1000000, help="Number of particles")
+    parser.add_argument("--nStructures", type=int, default=10000,   help="Number of structures (molecules)")
+    parser.add_argument("--repeat",      type=int, default=5,       help="Number of repetitions, the best time is reported")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    # Structures of random sizes, each one contiguous
+    sizes = rng.multinomial(args.nParticles-args.nStructures,np.ones(args.nStructures)/args.nStructures) + 1
+
+    structure = np.repeat(np.arange(args.nStructures),sizes)
+    positions = rng.uniform(-1.0,1.0,size=(args.nParticles,3))
+    radius    = np.ones(args.nParticles).tolist()
+
+    times = {"positions":[],"radius":[]}
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        splittedPositions = splitStateAccordingStructure(state=positions,structure=structure)
+        times["positions"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        splittedRadius = splitStateAccordingStructure(state=radius,structure=structure)
+        times["radius"].append(time.perf_counter() - start)
+
+    assert len(splittedPositions) == args.nStructures
+    assert len(splittedRadius)    == args.nStructures
+
+    print(f"Particles:       {args.nParticles}")
+    print(f"Structures:      {args.nStructures}")
+    print(f"Positions split: {min(times['positions']):.4f} s")
+    print(f"Radius split:    {min(times['radius']):.4f} s")
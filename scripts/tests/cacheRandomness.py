@@ -0,0 +1,111 @@
+import os
+import sys
+import glob
+import json
+import argparse
+
+import tempfile
+
+import random
+import numpy as np
+
+import VLMP
+
+from VLMP.utils.units import picosecond2KcalMol_A_time
+
+# Checks that the models cache does not change the simulation pool.
+# A pool of simulations with an IDP (its positions include random noise) and a WLC (deterministic),
+# with the same parameters, is built without cache, with an empty cache and with the cache filled by the previous build,
+# starting from the same state of the random number generators. The three builds have to be identical,
+# without a seed, with a different seed for each simulation and with the same seed for all of them.
+# The IDP conformations of the simulations of the pool have to be all different and the WLC has to be restored from the cache.
+
+def getSimulationPool(copies,sequence,seeds):
+
+    ps2AKMA = picosecond2KcalMol_A_time()
+
+    simulationPool = []
+    for i in range(copies):
+        system = [{"type":"simulationName","parameters":{"simulationName":"IDP_"+str(i)}},
+                  {"type":"backup","parameters":{"backupIntervalStep":100000}}]
+        if seeds is not None:
+            system.append({"type":"seed","parameters":{"seed":seeds[i]}})
+
+        simulationPool.append({"system":system,
+                               "units":[{"type":"KcalMol_A"}],
+                               "types":[{"type":"basic"}],
+                               "ensemble":[{"type":"NVT","parameters":{"box":[1000.0,1000.0,1000.0],"temperature":300.0}}],
+                               "integrators":[{"type":"BBK","parameters":{"timeStep":0.01*ps2AKMA,
+                                                                          "frictionConstant":0.2/ps2AKMA,
+                                                                          "integrationSteps":1000}}],
+                               "models":[{"type":"IDP","parameters":{"sequence":sequence}},
+                                         {"type":"WLC","parameters":{"N":len(sequence)}}],
+                               "simulationSteps":[{"type":"info","parameters":{"intervalStep":1000}}]})
+
+    return simulationPool
+
+def getConformations(simulationPool,cacheDir,outputDir):
+    # Positions of each simulation of the pool, sorted by simulation name.
+    # All the builds start from the same state of the random number generators
+    random.seed(1234)
+    np.random.seed(1234)
+
+    vlmp = VLMP.VLMP(cacheDir = cacheDir)
+    vlmp.loadSimulationPool(simulationPool)
+    vlmp.distributeSimulationPool("one")
+    vlmp.setUpSimulation(outputDir)
+
+    conformations = {}
+    for simFile in glob.glob(os.path.join(outputDir,"simulationSets","*","*","simulation.json")):
+        with open(simFile) as f:
+            state = json.load(f)["state"]
+        positionIndex = state["labels"].index("position")
+        name = os.path.basename(os.path.dirname(simFile))
+        conformations[name] = np.asarray([s[positionIndex] for s in state["data"]])
+
+    return [conformations[name] for name in sorted(conformations)]
+
+def countDistinct(conformations):
+    distinct = []
+    for conf in conformations:
+        if not any([np.array_equal(conf,d) for d in distinct]):
+            distinct.append(conf)
+    return len(distinct)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Randomness of cached models across the simulation pool")
+    parser.add_argument("--copies",   type=int, default=4,            help="Number of simulations in the pool")
+    parser.add_argument("--sequence", type=str, default="MKVLAAGIVGAL", help="Sequence of the IDP")
+    args = parser.parse_args()
+
+    cases = {"no seed"       : None,
+             "different seed": list(range(1,args.copies+1)),
+             "same seed"     : [1]*args.copies}
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmpDir:
+        os.chdir(tmpDir)
+
+        for case,seeds in cases.items():
+            simulationPool = getSimulationPool(args.copies,args.sequence,seeds)
+            cacheDir       = os.path.join(tmpDir,"cache_"+case.replace(" ","_"))
+
+            uncached = getConformations(simulationPool,None,"uncached_"+case.replace(" ","_"))
+            cold     = getConformations(simulationPool,cacheDir,"cold_"+case.replace(" ","_"))
+            warm     = getConformations(simulationPool,cacheDir,"warm_"+case.replace(" ","_"))
+
+            nUncached,nCold,nWarm = [countDistinct(c) for c in [uncached,cold,warm]]
+            nEntries = len([f for f in os.listdir(cacheDir) if f.endswith(".pkl")])
+            print(f"{case+':':<16} distinct conformations, uncached {nUncached}, "
+                  f"empty cache {nCold}, filled cache {nWarm} (of {args.copies}), {nEntries} cache entries")
+
+            # The cache does not change the output
+            identical = all([np.array_equal(u,c) and np.array_equal(u,w) for u,c,w in zip(uncached,cold,warm)])
+            # The IDP is random, every simulation is different. The WLC is cached
+            ok = identical and nUncached == args.copies and nEntries > 0
+            if not ok:
+                print(f"FAILED: {case} (identical output with and without cache: {identical})")
+                failed = True
+
+    sys.exit(1 if failed else 0)